@@ -3,7 +3,7 @@ import matplotlib
 import matplotlib.pyplot as plt
 from matplotlib.animation import ArtistAnimation
 from galpy.potential import SpiralArmsPotential
-from galpy.util import bovy_coords
+from spiral_grid import evaluate_xy
 
 
 ts = np.linspace(0, 1, 60)
@@ -43,13 +43,10 @@ phiforce_ims = []
 
 
 def plot(t):
-    for ii in range(n):
-        for jj in range(n):
-            R, phi, z = bovy_coords.rect_to_cyl(xs[ii], ys[jj], 0)
-            pot[ii, jj] = sp(R, z, phi, t)
-            dens[ii, jj] = sp.dens(R, z, phi, t)
-            Rforce[ii, jj] = sp.Rforce(R, z, phi, t)
-            phiforce[ii, jj] = sp.phiforce(R, z, phi, t)
+    pot[:] = evaluate_xy(sp, xs, ys, t=t)
+    dens[:] = evaluate_xy(sp, xs, ys, t=t, quantity='dens')
+    Rforce[:] = evaluate_xy(sp, xs, ys, t=t, quantity='Rforce')
+    phiforce[:] = evaluate_xy(sp, xs, ys, t=t, quantity='phiforce')
 
     return [ax1.imshow(pot, cmap='coolwarm'),
             ax2.imshow(dens, cmap='coolwarm'),
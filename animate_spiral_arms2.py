@@ -3,7 +3,7 @@ import matplotlib
 import matplotlib.pyplot as plt
 from matplotlib.animation import ArtistAnimation
 from galpy.potential import SpiralArmsPotential
-from galpy.util import bovy_coords
+from spiral_grid import evaluate_xy
 
 
 ts = np.linspace(0, 1, 100)
@@ -23,12 +23,7 @@ ys = np.linspace(ymin, ymax, n)
 fig = plt.figure(figsize=(10, 10))
 ax1 = fig.add_subplot(111)
 
-pot = np.zeros((n, n))
-
-for ii in range(n):
-    for jj in range(n):
-        R, phi, z = bovy_coords.rect_to_cyl(xs[ii], ys[jj], 0)
-        pot[ii, jj] = sp(R, z, phi, 0)
+pot = evaluate_xy(sp, xs, ys, t=0)
 
 im0 = ax1.imshow(pot.T, cmap='coolwarm', origin='lower')
 fig.colorbar(im0, ax=ax1, fraction=0.046, pad=0.04)
@@ -39,11 +34,7 @@ ax1.set_title('Spiral Arms Potential')
 pot_ims = []
 
 def plot(t):
-    for ii in range(n):
-        for jj in range(n):
-            R, phi, z = bovy_coords.rect_to_cyl(xs[ii], ys[jj], 0)
-            pot[ii, jj] = sp(R, z, phi, t)
-            #pot[ii, jj] = jj
+    pot[:] = evaluate_xy(sp, xs, ys, t=t)
 
     im1 = ax1.imshow(pot.T, cmap='coolwarm', origin='lower')
 
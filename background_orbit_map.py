@@ -0,0 +1,160 @@
+###############################################################################
+#  background_orbit_map.py: precomputed orbital properties in the axisymmetric
+#                           background (e.g., MWPotential2014)
+#
+#  The baseline rperi, rap, e, zmax and frequencies of an orbit in the static
+#  axisymmetric background only depend on its initial conditions. They are
+#  computed once on a grid in (R, vR, vT, z, vz), cached to disk, and
+#  interpolated on demand, so that spiral-vs-background comparisons only
+#  need to integrate the orbits in the spiral potential.
+###############################################################################
+
+from __future__ import division
+from orbit_batches import integrate_batch
+from orbit_diagnostics import orbit_properties, frequencies
+from galpy.potential import Potential
+from scipy.interpolate import RegularGridInterpolator
+import hashlib
+import os
+import numpy as np
+
+CACHEDIR = os.path.join(os.path.expanduser('~'), '.cache', 'spiral_orbit_maps')
+AXES = ('R', 'vR', 'vT', 'z', 'vz')
+QUANTITIES = ('rperi', 'rap', 'e', 'zmax', 'Omega_R', 'Omega_phi', 'Omega_z')
+
+
+class OrbitPropertyMap(object):
+    """Orbital properties tabulated on a grid of initial conditions (R, vR, vT, z, vz), with phi = 0."""
+
+    def __init__(self, axes, values):
+        """
+        NAME:
+            __init__
+        PURPOSE:
+            initialize a map from its grid and tabulated values
+        INPUT:
+            :axes: dictionary with the 1D grid for each of 'R', 'vR', 'vT', 'z' and 'vz'
+            :values: dictionary with an array of shape (len(R), len(vR), len(vT), len(z), len(vz))
+                     for each quantity
+        OUTPUT:
+            (none)
+        """
+        self.axes = dict((name, np.atleast_1d(np.asarray(axes[name], dtype=float))) for name in AXES)
+        self.values = dict((name, np.asarray(values[name])) for name in values)
+        # axes with a single grid point are held fixed
+        self._free = [name for name in AXES if len(self.axes[name]) > 1]
+        self._interp = {}
+
+    def __call__(self, R, vR, vT, z=0., vz=0., quantities=QUANTITIES):
+        """
+        NAME:
+            __call__
+        PURPOSE:
+            interpolate the tabulated quantities
+        INPUT:
+            :R, vR, vT, z, vz: initial conditions (arrays); coordinates along axes with a single grid point
+                               are ignored
+            :quantities: names of the quantities to return
+        OUTPUT:
+            :return: dictionary with an array for each quantity (NaN outside of the grid)
+        """
+        coords = dict(zip(AXES, np.broadcast_arrays(R, vR, vT, z, vz)))
+        points = np.stack([coords[name] for name in self._free], axis=-1)
+        out = {}
+        for name in quantities:
+            if name not in self._interp:
+                values = self.values[name].reshape([len(self.axes[axis]) for axis in self._free])
+                self._interp[name] = RegularGridInterpolator([self.axes[axis] for axis in self._free], values,
+                                                             bounds_error=False, fill_value=np.nan)
+            out[name] = self._interp[name](points)
+        return out
+
+    def save(self, filename):
+        """Save the map to a .npz file."""
+        kwargs = dict(('axis_' + name, self.axes[name]) for name in AXES)
+        kwargs.update(self.values)
+        np.savez(filename, **kwargs)
+
+    @classmethod
+    def load(cls, filename):
+        """Load a map saved with save."""
+        with np.load(filename) as data:
+            return cls(dict((name, data['axis_' + name]) for name in AXES),
+                       dict((name, data[name]) for name in data.files if not name.startswith('axis_')))
+
+
+def _update(h, value):
+    """Add value to the hash h; return False if it cannot be hashed reliably."""
+    if value is None or isinstance(value, (bool, int, float, complex, str, np.generic)):
+        h.update(repr(value).encode())
+    elif isinstance(value, np.ndarray):
+        h.update('{}{}'.format(value.dtype, value.shape).encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        h.update('[{}]'.format(len(value)).encode())
+        return all([_update(h, v) for v in value])
+    elif isinstance(value, Potential):
+        # nested potentials, e.g., the potential in a wrapper
+        h.update(type(value).__name__.encode())
+        for name in sorted(value.__dict__):
+            h.update(name.encode())
+            if not _update(h, value.__dict__[name]):
+                return False
+    else:
+        return False
+    return True
+
+
+def _key(pot, axes, ts, method):
+    """Return a hash identifying the potential, the grid and the integration, or None if pot cannot be hashed."""
+    h = hashlib.sha1()
+    if not _update(h, pot if isinstance(pot, (list, tuple)) else [pot]):
+        return None
+    for name in AXES:
+        h.update(np.ascontiguousarray(axes[name], dtype=float).tobytes())
+    h.update(np.ascontiguousarray(ts, dtype=float).tobytes())
+    h.update(method.encode())
+    return h.hexdigest()
+
+
+def background_map(pot, R, vR, vT, z=0., vz=0., ts=None, method='symplec4_c', numcores=1, cachedir=CACHEDIR):
+    """
+    NAME:
+        background_map
+    PURPOSE:
+        compute (or load from the cache) the orbital properties in an axisymmetric potential on a grid
+        of initial conditions
+    INPUT:
+        :pot: axisymmetric Potential instance or list thereof (e.g., MWPotential2014)
+        :R, vR, vT, z, vz: 1D grids of initial conditions (scalars for axes that are held fixed)
+        :ts: equally spaced integration times (default: np.linspace(0, 60, 1000))
+        :method: galpy integration method
+        :numcores: number of threads galpy integrates the orbits in
+        :cachedir: directory in which maps are cached (None: do not cache); potentials with attributes
+                   that cannot be hashed (e.g., functions) are never cached
+    OUTPUT:
+        :return: OrbitPropertyMap with rperi, rap, e, zmax, Omega_R, Omega_phi and Omega_z
+    """
+    if ts is None:
+        ts = np.linspace(0, 60, 1000)
+    axes = dict((name, np.atleast_1d(np.asarray(x, dtype=float))) for name, x in zip(AXES, (R, vR, vT, z, vz)))
+    filename = None
+    if cachedir is not None:
+        key = _key(pot, axes, ts, method)
+        if key is not None:
+            filename = os.path.join(cachedir, key + '.npz')
+        if filename is not None and os.path.exists(filename):
+            return OrbitPropertyMap.load(filename)
+
+    grid = np.meshgrid(*[axes[name] for name in AXES], indexing='ij')
+    shape = grid[0].shape
+    vxvv = np.stack([x.ravel() for x in grid] + [np.zeros(grid[0].size)], axis=-1)
+    orbits = integrate_batch(vxvv, pot, ts, method=method, numcores=numcores)
+    values = dict(zip(QUANTITIES, orbit_properties(orbits) + frequencies(orbits, ts)))
+    pmap = OrbitPropertyMap(axes, dict((name, values[name].reshape(shape)) for name in values))
+
+    if filename is not None:
+        if not os.path.exists(cachedir):
+            os.makedirs(cachedir)
+        pmap.save(filename)
+    return pmap
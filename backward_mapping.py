@@ -0,0 +1,59 @@
+###############################################################################
+#  backward_mapping.py: local velocity distributions in a grown spiral from
+#                       backward integration
+#
+#  By Liouville's theorem the distribution function is conserved along
+#  orbits, so the present-day f(vR, vT) at a position follows from
+#  integrating every point of a (vR, vT) grid backward to a time before the
+#  spiral was grown and evaluating the axisymmetric background distribution
+#  function there (e.g., DiskSampler.df). The result is deterministic and
+#  needs one orbit per grid point instead of a forward Monte Carlo sample.
+###############################################################################
+
+from __future__ import division
+from galpy.potential import DehnenSmoothWrapperPotential
+from orbit_batches import integrate_batch
+import numpy as np
+
+
+def grow(pot, tform, tsteady=None):
+    """
+    NAME:
+        grow
+    PURPOSE:
+        switch on the non-axisymmetric components of a potential smoothly
+    INPUT:
+        :pot: Potential instance or list thereof (e.g., [SpiralArmsPotential()] + MWPotential2014)
+        :tform: time at which the growth starts (the components vanish before tform)
+        :tsteady: duration of the growth (default: half of -tform, see DehnenSmoothWrapperPotential)
+    OUTPUT:
+        :return: list of potentials with the non-axisymmetric components wrapped in
+                 DehnenSmoothWrapperPotential
+    """
+    pots = pot if isinstance(pot, (list, tuple)) else [pot]
+    return [DehnenSmoothWrapperPotential(pot=p, tform=tform, tsteady=tsteady) if p.isNonAxi else p for p in pots]
+
+
+def backward_map(pot, df, vR, vT, R=1., phi=0., tback=20., nt=101, method='dopr54_c', numcores=1):
+    """
+    NAME:
+        backward_map
+    PURPOSE:
+        compute the present-day distribution function on a grid in (vR, vT) at a position in the midplane
+        by integrating backward to a time at which the potential is axisymmetric
+    INPUT:
+        :pot: Potential instance or list thereof that is axisymmetric at t = -tback (e.g., from grow)
+        :df: background distribution function f(R, vR, vT) that takes arrays (e.g., DiskSampler.df)
+        :vR, vT: 1D grids of present-day velocities
+        :R, phi: present-day position
+        :tback: time to integrate backward for
+        :nt: number of output times of the integration
+        :method: galpy integration method
+        :numcores: number of threads galpy integrates the orbits in
+    OUTPUT:
+        :return: array of shape (len(vR), len(vT)) with the distribution function
+    """
+    vRs, vTs = np.meshgrid(np.atleast_1d(vR), np.atleast_1d(vT), indexing='ij')
+    vxvv = np.stack([np.full(vRs.size, R), vRs.ravel(), vTs.ravel(), np.full(vRs.size, phi)], axis=-1)
+    orbits = integrate_batch(vxvv, pot, np.linspace(0., -tback, nt), method=method, numcores=numcores)
+    return df(orbits[:, -1, 0], orbits[:, -1, 1], orbits[:, -1, 2]).reshape(vRs.shape)
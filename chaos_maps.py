@@ -0,0 +1,108 @@
+###############################################################################
+#  chaos_maps.py: finite-time Lyapunov exponents and MEGNO for batches of
+#                 planar orbits from galpy's variational-equation integrators
+#
+#  All orbits are integrated together with their deviation vectors, in one
+#  integrate_dxdv call per segment (in C, on numcores threads, when all
+#  potentials have hasC_dxdv). The deviation grows exponentially for chaotic
+#  orbits, so the integration is split into segments and the deviations are
+#  rescaled to unit length between segments
+#  (Benettin et al. 1980); the accumulated log-growth ln|delta(t)| gives both
+#  the Lyapunov exponent and MEGNO. Rescaling inside galpy's C integration
+#  loop is not possible without modifying galpy, so the renormalization
+#  happens between C calls, a few times per orbit.
+###############################################################################
+
+from __future__ import division
+from galpy.orbit import Orbit
+from spiral_arms_fast import for_integration
+import numpy as np
+
+
+def log_deviation(vxvv, pot, ts, nsegments=10, method='dopr54_c', numcores=1):
+    """
+    NAME:
+        log_deviation
+    PURPOSE:
+        integrate the variational equations for an array of planar orbits and return the growth of the deviations
+    INPUT:
+        :vxvv: initial conditions, array of shape (norb, 4) with [R, vR, vT, phi]
+        :pot: Potential instance or list thereof (e.g., [SpiralArmsPotential()] + MWPotential2014; see
+              orbit_batches.integrate_batch for FastSpiralArmsPotentials with a growth envelope)
+        :ts: times at which to output (nt)
+        :nsegments: number of segments between which the deviation is renormalized
+        :method: galpy integration method that supports integrate_dxdv ('dopr54_c', 'rk4_c', 'rk6_c', ...)
+        :numcores: number of cores to integrate on
+    OUTPUT:
+        :return: array of shape (norb, nt) with ln|delta(t)/delta(ts[0])| (rectangular phase-space deviations)
+    """
+    vxvv = np.atleast_2d(np.asarray(vxvv, dtype=float))
+    ts = np.asarray(ts, dtype=float)
+    pot = for_integration(pot)
+    dx = np.ones(vxvv.shape) / 2.
+    out = np.empty((len(vxvv), len(ts)))
+    out[:, 0] = 0.
+    offset = np.zeros(len(vxvv))
+    bounds = np.linspace(0, len(ts) - 1, nsegments + 1).astype(int)
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        # all orbits are integrated in a single call (in parallel in the C integrators)
+        o = Orbit(vxvv)
+        o.integrate_dxdv(dx, ts[start:stop + 1], pot, method=method, numcores=numcores, rectIn=True, rectOut=True)
+        dxdv = o.getOrbit_dxdv()
+        lognorm = np.log(np.sqrt(np.sum(dxdv**2, axis=-1)))
+        out[:, start + 1:stop + 1] = offset[:, None] + lognorm[:, 1:]
+        offset += lognorm[:, -1]
+        dx = dxdv[:, -1] / np.exp(lognorm[:, -1:])
+        vxvv = o.getOrbit()[:, -1]
+    return out
+
+
+def lyapunov(logdev, ts):
+    """Return the finite-time largest Lyapunov exponents ln|delta(T)| / T from the output of log_deviation."""
+    return logdev[..., -1] / (ts[-1] - ts[0])
+
+
+def megno(logdev, ts):
+    """
+    NAME:
+        megno
+    PURPOSE:
+        compute the mean exponential growth factor of nearby orbits from the output of log_deviation
+    INPUT:
+        :logdev: array of shape (..., nt) with ln|delta(t)|
+        :ts: times (nt)
+    OUTPUT:
+        :return: time-averaged MEGNO <Y>(T) (2 for quasi-periodic orbits, 0 for stable periodic orbits,
+                 growing as lambda T / 2 for chaotic orbits)
+    """
+    t = np.asarray(ts, dtype=float) - ts[0]
+    # Y(t) = 2/t int_0^t s dln|delta|/ds ds = 2 (ln|delta(t)| - 1/t int_0^t ln|delta| ds)
+    cumint = np.concatenate([np.zeros(logdev.shape[:-1] + (1,)),
+                             np.cumsum(0.5 * (logdev[..., 1:] + logdev[..., :-1]) * np.diff(t), axis=-1)], axis=-1)
+    Y = 2 * (logdev[..., 1:] - cumint[..., 1:] / t[1:])
+    Y = np.concatenate([np.zeros(logdev.shape[:-1] + (1,)), Y], axis=-1)
+    return np.sum(0.5 * (Y[..., 1:] + Y[..., :-1]) * np.diff(t), axis=-1) / t[-1]
+
+
+def chaos_map(pot, vR, vT, R=1., phi=0., ts=None, nsegments=10, method='dopr54_c', numcores=1):
+    """
+    NAME:
+        chaos_map
+    PURPOSE:
+        compute maps of the Lyapunov exponent and MEGNO on a grid in (vR, vT) at a position in the midplane
+    INPUT:
+        :pot: Potential instance or list thereof
+        :vR, vT: 1D grids of velocities
+        :R, phi: position
+        :ts: integration times (default: np.linspace(0, 200, 2001))
+        :nsegments, method, numcores: see log_deviation
+    OUTPUT:
+        :return: dictionary with arrays of shape (len(vR), len(vT)) for 'lyapunov' and 'megno'
+    """
+    if ts is None:
+        ts = np.linspace(0, 200, 2001)
+    vRs, vTs = np.meshgrid(np.atleast_1d(vR), np.atleast_1d(vT), indexing='ij')
+    vxvv = np.stack([np.full(vRs.size, R), vRs.ravel(), vTs.ravel(), np.full(vRs.size, phi)], axis=-1)
+    logdev = log_deviation(vxvv, pot, ts, nsegments=nsegments, method=method, numcores=numcores)
+    return {'lyapunov': lyapunov(logdev, ts).reshape(vRs.shape),
+            'megno': megno(logdev, ts).reshape(vRs.shape)}
@@ -0,0 +1,266 @@
+###############################################################################
+#  disk_sampler.py: vectorized sampling of disk initial conditions from a
+#                   Shu (1969) or Schwarzschild distribution function, streamed
+#                   in chunks through orbit integration and onto disk
+#
+#  The disk has a power-law rotation curve vc = R^beta, an exponential
+#  surface density exp(-R/hR) and a radial velocity dispersion
+#  sr exp(-(R-1)/hs), with (hR, hs, sr) = profileParams as for galpy's shudf.
+#
+#  'schwarzschild' draws (vR, vT) from the Gaussian velocity ellipsoid of the
+#  epicycle approximation (with the asymmetric drift from the Jeans equation)
+#  and needs no rejection. 'shu' samples
+#
+#      f(E, L) ~ Sigma(R_e) / sigma^2(R_e) exp(-(E - E_c(L)) / sigma^2(R_e))
+#
+#  with R_e the guiding radius of L. At fixed (R, vT), vR is Gaussian with the
+#  dispersion sigma(R_e) and is drawn exactly; (R, vT) are rejection-sampled
+#  from a piecewise-constant envelope of their marginal density tabulated on a
+#  grid over Rrange. A proposal above the envelope means the grid missed a
+#  peak: the envelope is then raised and the whole draw restarts, so that no
+#  sample is ever accepted under a bound that turned out to be too low.
+###############################################################################
+
+from __future__ import division
+from orbit_batches import integrate_chunks
+import os
+import numpy as np
+
+
+def _quadmax(left, mid, right):
+    """Return the maximum over [-1, 1] of the quadratic through (-1, left), (0, mid) and (1, right); where
+    left is -inf (the density vanishes at vT = 0), the maximum of mid and right."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        a = (left + right) / 2 - mid
+        b = (right - left) / 2
+        top = np.where((a < 0) & (np.abs(b) < -2 * a), mid - b**2 / 4 / a, -np.inf)
+    return np.where(np.isfinite(left), np.maximum(np.maximum(left, right), top), np.maximum(mid, right))
+
+
+class DiskSampler(object):
+    """Sample initial conditions [R, vR, vT, z, vz, phi] from a Shu or Schwarzschild disk distribution function."""
+
+    def __init__(self, dist='shu', profileParams=(1./3., 1.0, 0.2), beta=0., Rrange=(0.1, 3.),
+                 hz=0., sigmaz=0., seed=None):
+        """
+        NAME:
+            __init__
+        PURPOSE:
+            initialize a sampler
+        INPUT:
+            :dist: 'shu' or 'schwarzschild'
+            :profileParams: (hR, hs, sr): scale length of the surface density, scale length of the radial
+                            velocity dispersion and radial velocity dispersion at R=1
+            :beta: power-law index of the rotation curve
+            :Rrange: range in R to sample
+            :hz: scale height of the isothermal (sech^2) vertical profile (0: all samples at z=0)
+            :sigmaz: vertical velocity dispersion
+            :seed: seed for the random number generator
+        OUTPUT:
+            (none)
+        """
+        if dist not in ('shu', 'schwarzschild'):
+            raise ValueError("dist must be 'shu' or 'schwarzschild'")
+        self._dist = dist
+        self._hR, self._hs, self._sr = profileParams
+        self._beta = beta
+        self._Rrange = Rrange
+        self._hz = hz
+        self._sigmaz = sigmaz
+        self._rng = np.random.RandomState(seed)
+        self._margin = 1.  # log of the envelope above its estimate on the grid, in units of 0.01
+        self._envelope = None
+        # inverse CDF of R exp(-R/hR) (surface density times area element) on Rrange
+        self._Rs = np.linspace(Rrange[0], Rrange[1], 10001)
+        cdf = np.cumsum(self._Rs * np.exp(-self._Rs / self._hR))
+        self._cdf = (cdf - cdf[0]) / (cdf[-1] - cdf[0])
+
+    def _sigmaR2(self, R):
+        return self._sr**2 * np.exp(-2 * (R - 1) / self._hs)
+
+    def _potential(self, R):
+        if self._beta == 0:
+            return np.log(R)
+        return R**(2 * self._beta) / 2 / self._beta
+
+    def _vTmean(self, R, sR2):
+        """Return the mean rotational velocity from the asymmetric-drift equation."""
+        X2 = (1 + self._beta) / 2
+        return np.sqrt(np.maximum(R**(2 * self._beta) - sR2 * (X2 - 1 + R / self._hR + 2 * R / self._hs), 0.))
+
+    def _schwarzschild(self, n):
+        """Return R, vR, vT drawn from the Schwarzschild distribution function."""
+        R = np.interp(self._rng.uniform(size=n), self._cdf, self._Rs)
+        sR2 = self._sigmaR2(R)
+        X2 = (1 + self._beta) / 2  # sigma_T^2 / sigma_R^2 in the epicycle approximation
+        xR, xT = self._rng.normal(size=(2, n))
+        return R, np.sqrt(sR2) * xR, self._vTmean(R, sR2) + np.sqrt(sR2 * X2) * xT
+
+    def _logshu(self, R, vT):
+        """Return the log of the (unnormalized) density of the Shu samples in (R, vT), and the dispersion
+        at the guiding radius."""
+        R, vT = np.broadcast_arrays(R, vT)
+        L = np.where(vT > 0, R * vT, 1.)
+        sRe2 = self._sigmaR2(L**(1 / (1 + self._beta)))
+        # R from the area element, and sqrt(2 pi) sigma(R_e) from the integral over vR
+        return np.log(R) + self._logdf(R, 0., vT) + 0.5 * np.log(sRe2), sRe2
+
+    def _vT(self, R, u):
+        """Map u in [0, 1] to vT in [0, vc + 10 sigma] at R, with a resolution ~sigma(R) around vc that coarsens
+        towards vT = 0; return vT and the log of dvT/du."""
+        vc = R**self._beta
+        sR = np.sqrt(self._sigmaR2(R))
+        tmin = -np.arcsinh(vc / sR)
+        tmax = np.arcsinh(10.)
+        t = tmin + u * (tmax - tmin)
+        return np.where(u > 0, np.maximum(vc + sR * np.sinh(t), 0.), 0.), np.log(sR * np.cosh(t) * (tmax - tmin))
+
+    def _tabulate(self, nR=200, nu=400):
+        """Tabulate the piecewise-constant envelope of the Shu density in (R, u) used as the proposal."""
+        R = np.linspace(self._Rrange[0], self._Rrange[1], 2 * nR + 1)
+        u = np.linspace(0., 1., 2 * nu + 1)
+        # the density above vc + 10 sigma(R) is negligible, as the dispersion at larger guiding radii is smaller
+        vT, logJ = self._vT(R[:, None], u)
+        logT = self._logshu(R[:, None], vT)[0] + logJ
+        # the maximum over every cell of the quadratic through the corners, the midpoints of the edges and the
+        # center, first along u (for each of the three R), then along R
+        cells = [[logT[ii:ii + 2 * nR:2, jj:jj + 2 * nu:2] for jj in range(3)] for ii in range(3)]
+        # (the quadratic overshoots in the far tails, where the density is far from quadratic on a cell, but
+        # no cell can rise much above the peak of the tabulated density)
+        logenv = np.minimum(_quadmax(*[_quadmax(*row) for row in cells]), np.amax(logT) + 1.)
+        logenv = np.where(np.isfinite(logenv), logenv + self._margin * 0.01, -np.inf)
+        mass = np.exp(logenv - np.amax(logenv)).ravel()
+        if not np.all(np.isfinite(mass)):
+            raise ValueError('the dispersion profile is too steep to sample over Rrange')
+        cdf = np.cumsum(mass)
+        self._envelope = (R[::2], u[::2], logenv.ravel(), cdf / cdf[-1])
+
+    def _shu(self, n):
+        """Rejection-sample n (R, vR, vT) from the Shu distribution function."""
+        while True:
+            if self._envelope is None:
+                self._tabulate()
+            R0, u0, logenv, cdf = self._envelope
+            out = []
+            nout = 0
+            while nout < n:
+                m = 2 * (n - nout) + 100
+                cell = np.minimum(np.searchsorted(cdf, self._rng.uniform(size=m)), len(cdf) - 1)
+                iR, iu = np.divmod(cell, len(u0) - 1)
+                R = R0[iR] + (R0[1] - R0[0]) * self._rng.uniform(size=m)
+                vT, logJ = self._vT(R, u0[iu] + (u0[1] - u0[0]) * self._rng.uniform(size=m))
+                logT, sRe2 = self._logshu(R, vT)
+                logratio = logT + logJ - logenv[cell]
+                if np.any(logratio > 0):
+                    break
+                keep = np.log(self._rng.uniform(size=m)) < logratio
+                vR = np.sqrt(sRe2[keep]) * self._rng.normal(size=np.sum(keep))
+                out.append(np.stack([R[keep], vR, vT[keep]], axis=-1))
+                nout += np.sum(keep)
+            else:
+                return np.concatenate(out)[:n].T
+            # the envelope was too low: raise it and discard this draw
+            self._margin *= 2
+            self._envelope = None
+
+    def _logdf(self, R, vR, vT):
+        """Return the log of 2 pi times the distribution function (-inf where it vanishes)."""
+        if self._dist == 'schwarzschild':
+            R, vR, vT = np.broadcast_arrays(R, vR, vT)
+            sR2 = self._sigmaR2(R)
+            X2 = (1 + self._beta) / 2
+            vTmean = self._vTmean(R, sR2)
+            return -R / self._hR - np.log(sR2 * np.sqrt(X2)) - 0.5 * (vR**2 + (vT - vTmean)**2 / X2) / sR2
+        L = np.where(R * vT > 0, R * vT, 1.)
+        Re = L**(1 / (1 + self._beta))
+        sRe2 = self._sigmaR2(Re)
+        E = 0.5 * (vR**2 + vT**2) + self._potential(R)
+        Ec = 0.5 * Re**(2 * self._beta) + self._potential(Re)
+        return np.where(R * vT > 0, -Re / self._hR - np.log(sRe2) - (E - Ec) / sRe2, -np.inf)
+
+    def df(self, R, vR, vT):
+        """
+        NAME:
+            df
+        PURPOSE:
+            evaluate the (planar) distribution function the samples are drawn from
+        INPUT:
+            :R, vR, vT: phase-space coordinates (arrays)
+        OUTPUT:
+            :return: f(R, vR, vT), normalized such that the surface density at R is exp(-R/hR) in the
+                     epicycle approximation
+        """
+        return np.exp(self._logdf(R, vR, vT)) / 2 / np.pi
+
+    def sample(self, n):
+        """
+        NAME:
+            sample
+        PURPOSE:
+            draw initial conditions
+        INPUT:
+            :n: number of samples
+        OUTPUT:
+            :return: array of shape (n, 6) with [R, vR, vT, z, vz, phi]
+        """
+        if self._dist == 'shu':
+            R, vR, vT = self._shu(n)
+        else:
+            R, vR, vT = self._schwarzschild(n)
+        if self._hz > 0:
+            z = 2 * self._hz * np.arctanh(2 * self._rng.uniform(size=n) - 1)
+        else:
+            z = np.zeros(n)
+        vz = self._sigmaz * self._rng.normal(size=n)
+        phi = self._rng.uniform(0, 2 * np.pi, size=n)
+        return np.stack([R, vR, vT, z, vz, phi], axis=-1)
+
+    def stream(self, n, chunk=10000):
+        """
+        NAME:
+            stream
+        PURPOSE:
+            draw initial conditions in chunks without materializing the whole sample
+        INPUT:
+            :n: total number of samples
+            :chunk: number of samples per chunk
+        OUTPUT:
+            :return: generator of arrays of shape (<=chunk, 6)
+        """
+        for start in range(0, n, chunk):
+            yield self.sample(min(chunk, n - start))
+
+
+def evolve_samples(samples, pot, ts, directory=None, method='symplec4_c', numcores=1):
+    """
+    NAME:
+        evolve_samples
+    PURPOSE:
+        integrate chunks of initial conditions (e.g., DiskSampler.stream) and write the evolved samples
+        chunk by chunk
+    INPUT:
+        :samples: iterable of arrays of shape (n, 6), or an array of shape (norb, 6) (integrated in chunks of
+                  1000, see orbit_batches.integrate_chunks)
+        :pot: Potential instance or list thereof (e.g., [SpiralArmsPotential()] + MWPotential2014)
+        :ts: integration times; the samples are evolved to ts[-1]
+        :directory: if set, every chunk is written to directory/samples_#####.npz (arrays 'ics' and 'evolved')
+        :method, numcores: see orbit_batches.integrate_batch
+    OUTPUT:
+        :return: generator yielding (initial conditions, evolved phase-space coordinates) for every chunk
+    """
+    if directory is not None and not os.path.exists(directory):
+        os.makedirs(directory)
+    for ii, (ics, orbits) in enumerate(integrate_chunks(samples, pot, ts, method=method, numcores=numcores)):
+        evolved = orbits[:, -1]
+        if directory is not None:
+            np.savez(os.path.join(directory, 'samples_{:05d}.npz'.format(ii)), ics=ics, evolved=evolved)
+        yield ics, evolved
+
+
+def load_samples(directory):
+    """Return a generator yielding (initial conditions, evolved phase-space coordinates) for the chunks written
+    by evolve_samples."""
+    for filename in sorted(os.listdir(directory)):
+        if filename.startswith('samples_') and filename.endswith('.npz'):
+            with np.load(os.path.join(directory, filename)) as data:
+                yield data['ics'], data['evolved']
@@ -0,0 +1,299 @@
+###############################################################################
+#  multi_spiral_arms.py: several Cox & Gomez (2002) spiral patterns with
+#                        their own N, pitch angle, r_ref, phi_ref, Cs and
+#                        pattern speed, evaluated in a single pass
+#
+#  K_n, B_n and D_n (and therefore the expensive sech(K_n z / B_n)^B_n) only
+#  depend on R through the wavenumber k = n N / sin(alpha): K_n = k / R. All
+#  non-zero (arm, n) terms are stacked into flat parameter arrays, the radial
+#  and vertical factors are computed and combined once for every distinct k
+#  (e.g., arms with the same N and alpha, or n = 2 of a two-armed and n = 1
+#  of a four-armed pattern with the same pitch angle), gathered onto the
+#  terms, and the harmonic sum runs over the term axis. cos(n gamma) and
+#  sin(n gamma) come from one cos(gamma), sin(gamma) pair per component.
+#
+#  As for FastSpiralArmsPotential, the methods accept (broadcastable) arrays.
+###############################################################################
+
+from __future__ import division
+from galpy.potential import Potential, SpiralArmsPotential
+from spiral_arms_fast import _multiple_angles
+import numpy as np
+try:
+    from galpy.util import bovy_conversion as conversion
+except ImportError:  # galpy >= 1.7
+    from galpy.util import conversion
+try:
+    from astropy import units
+    _APY_LOADED = True
+except ImportError:
+    _APY_LOADED = False
+
+
+def _to_internal(x, unit, scale):
+    if _APY_LOADED and isinstance(x, units.Quantity):
+        return x.to(unit).value / scale
+    return x
+
+
+class MultiSpiralArmsPotential(Potential):
+    """Sum of spiral arms potentials of Cox and Gomez (2002) with per-arm N, alpha, r_ref, phi_ref, Cs and omega,
+    and a common amplitude, Rs and H."""
+    normalize = property()  # turn off normalize
+
+    def __init__(self, amp=1, ro=None, vo=None, amp_units='density',
+                 N=2, alpha=0.2, r_ref=1, phi_ref=0, Rs=0.3, H=0.125, omega=0, Cs=[1]):
+        """
+        NAME:
+            __init__
+        PURPOSE:
+            initialize a composite spiral arms potential
+        INPUT:
+            :amp: amplitude to be applied to the potential (default: 1); can be a Quantity with units of density
+            :ro, vo: distance and velocity scales for translation into internal units
+            :N, alpha, r_ref, phi_ref, omega: number of arms, pitch angle, reference radius, reference angle and
+                                              pattern speed of every component (arrays, broadcast against each
+                                              other; can be Quantity)
+            :Rs: radial scale length of the drop-off in density amplitude of the arms (can be Quantity)
+            :H: scale height of the stellar arm perturbation (can be Quantity)
+            :Cs: constants multiplying the cos(n gamma) terms, one list per component (or a single list for all
+                 components); lists of different lengths are padded with zeros. Scale the Cs of a component to
+                 give it a different amplitude.
+        OUTPUT:
+            (none)
+        """
+        Potential.__init__(self, amp=amp, ro=ro, vo=vo, amp_units=amp_units)
+        alpha = _to_internal(alpha, 'rad', 1.)
+        r_ref = _to_internal(r_ref, 'kpc', self._ro)
+        phi_ref = _to_internal(phi_ref, 'rad', 1.)
+        Rs = _to_internal(Rs, 'kpc', self._ro)
+        H = _to_internal(H, 'kpc', self._ro)
+        omega = _to_internal(omega, 'km/(s kpc)', conversion.freq_in_kmskpc(self._vo, self._ro))
+
+        N, alpha, r_ref, phi_ref, omega = [np.atleast_1d(np.asarray(x, dtype=float))
+                                           for x in np.broadcast_arrays(N, alpha, r_ref, phi_ref, omega)]
+        if np.ndim(Cs[0]) == 0:
+            Cs = [Cs] * len(N)
+        if len(Cs) != len(N):
+            raise ValueError('Cs must have one list of constants per component')
+        nharm = max(len(C) for C in Cs)
+        Cs = np.array([list(C) + [0.] * (nharm - len(C)) for C in Cs], dtype=float)
+
+        # per component, with the sign conventions of SpiralArmsPotential (left-handed coordinates)
+        self._N = -N
+        self._alpha = -alpha
+        self._tan_alpha = np.tan(-alpha)
+        self._r_ref = r_ref
+        self._phi_ref = phi_ref
+        self._omega = omega
+        self._Cs = Cs
+        self._Rs = Rs
+        self._H = H
+        self._rho0 = 1 / (4 * np.pi)
+
+        # the non-zero terms, stacked
+        arm, n = np.nonzero(Cs)
+        self._arm = arm
+        self._n = n + 1.
+        self._C = Cs[arm, n]
+        self._Nn = self._N[arm] * self._n
+        self._Nn_tan_alpha = self._Nn / self._tan_alpha[arm]
+        self._cos_alpha = np.cos(alpha[arm])
+        # exp(-(R - r_ref)/Rs) = exp(-R/Rs) exp(r_ref/Rs): the first factor comes out of the sum
+        self._C_ref = self._C * np.exp(r_ref[arm] / Rs)
+        # position of the term in the output of _multiple_angles
+        self._harmonic_idx = n * len(N) + arm
+        k = self._Nn / np.sin(self._alpha[arm])
+        self._k, self._kidx = np.unique(k, return_inverse=True)
+        self._radial_key = None
+
+        self.isNonAxi = True
+        self.hasC = False
+        self.hasC_dxdv = False
+
+    @classmethod
+    def from_potentials(cls, pots):
+        """Return the MultiSpiralArmsPotential equivalent to the sum of a list of SpiralArmsPotentials with the
+        same Rs, H, ro and vo (their amplitudes are folded into Cs); FastSpiralArmsPotentials with a growth
+        envelope are not supported."""
+        first = pots[0]
+        for p in pots:
+            if not isinstance(p, SpiralArmsPotential):
+                raise ValueError('from_potentials only takes SpiralArmsPotential instances')
+            if getattr(p, '_tform', None) is not None:
+                raise ValueError('from_potentials does not support potentials with a growth envelope')
+            if (p._Rs, p._H, p._ro, p._vo) != (first._Rs, first._H, first._ro, first._vo):
+                raise ValueError('the potentials must have the same Rs, H, ro and vo')
+        out = cls(amp=first._amp, ro=first._ro, vo=first._vo,
+                  N=[-p._N for p in pots], alpha=[-p._alpha for p in pots], r_ref=[p._r_ref for p in pots],
+                  phi_ref=[p._phi_ref for p in pots], Rs=first._Rs, H=first._H, omega=[p._omega for p in pots],
+                  Cs=[np.asarray(getattr(p, '_Cs0', p._Cs)) * p._amp / first._amp for p in pots])
+        out._roSet = first._roSet
+        out._voSet = first._voSet
+        return out
+
+    def _radial(self, R):
+        """Return R, then K, KH, B and D per distinct wavenumber along the last axis, and exp(-R/Rs)."""
+        # keyed on a copy, as a 0-d array can be changed in place
+        key = float(R) if np.ndim(R) == 0 else None
+        if key is not None and self._radial_key == key:
+            return self._radial_terms
+        Rn = np.asarray(R, dtype=float)[..., None]
+        Ks = self._k / Rn
+        KH = Ks * self._H
+        Bs = KH * (1 + 0.4 * KH)
+        Ds = (1 + KH + 0.3 * KH**2) / (1 + 0.3 * KH)
+        terms = (Rn, Ks, KH, Bs, Ds, np.exp(-Rn[..., 0] / self._Rs))
+        if key is not None:
+            self._radial_key = key
+            self._radial_terms = terms
+        return terms
+
+    def _harmonics(self, R, phi, t):
+        """Return cos(n gamma), sin(n gamma) for every term, from one cos(gamma), sin(gamma) per component."""
+        phase = np.asarray(phi, dtype=float)[..., None] - self._omega * np.asarray(t, dtype=float)[..., None]
+        g = self._N * (phase - self._phi_ref
+                       - np.log(np.asarray(R, dtype=float)[..., None] / self._r_ref) / self._tan_alpha)
+        cos_ng, sin_ng = _multiple_angles(np.cos(g), np.sin(g), self._Cs.shape[1])
+        return cos_ng[..., self._harmonic_idx], sin_ng[..., self._harmonic_idx]
+
+    def _evaluate(self, R, z, phi=0., t=0.):
+        """
+        NAME:
+            _evaluate
+        PURPOSE:
+            Evaluate the potential at the given coordinates. (without the amp factor; handled by super class)
+        INPUT:
+            :param R: galactocentric cylindrical radius
+            :param z: vertical height
+            :param phi: azimuth
+            :param t: time
+        OUTPUT:
+            :return: Phi(R, z, phi, t)
+        """
+        Rn, Ks, KH, Bs, Ds, expR = self._radial(R)
+        cos_ng, sin_ng = self._harmonics(R, phi, t)
+        zKB = np.asarray(z, dtype=float)[..., None] * Ks / Bs
+        w = (np.cosh(zKB)**-Bs / Ks / Ds)[..., self._kidx]
+        return -self._H * expR * np.sum(self._C_ref * cos_ng * w, axis=-1)
+
+    def _Rforce(self, R, z, phi=0., t=0.):
+        """
+        NAME:
+            _Rforce
+        PURPOSE:
+            Evaluate the radial force for this potential at the given coordinates. (-dPhi/dR)
+        INPUT:
+            :param R: galactocentric cylindrical radius
+            :param z: vertical height
+            :param phi: azimuth
+            :param t: time
+        OUTPUT:
+            :return: the radial force
+        """
+        Rn, Ks, KH, Bs, Ds, expR = self._radial(R)
+        cos_ng, sin_ng = self._harmonics(R, phi, t)
+        z = np.asarray(z, dtype=float)[..., None]
+        zKB = z * Ks / Bs
+        log_cosh_zKB = np.log(np.cosh(zKB))
+        sechB_D = np.exp(-Bs * log_cosh_zKB) / Ds
+
+        # dK/dR = -K/R, and dB/dR and dD/dR follow from dKH/dR = -KH/R
+        dBs_dR = -KH / Rn * (1 + 0.8 * KH)
+        dDs_dR = -KH / Rn * (0.7 + 0.6 * KH + 0.09 * KH**2) / (1 + 0.3 * KH)**2
+        cos_coeff = sechB_D * (z * np.tanh(zKB) * (-1 / Rn - dBs_dR / Bs)
+                               + dBs_dR / Ks * log_cosh_zKB
+                               + (-1 / Rn + dDs_dR / Ds + 1 / self._Rs) / Ks)
+        sin_coeff = sechB_D / Ks
+
+        idx = self._kidx
+        return -self._H * expR * np.sum(self._C_ref * (cos_coeff[..., idx] * cos_ng
+                                                       - self._Nn_tan_alpha / Rn * sin_coeff[..., idx] * sin_ng),
+                                        axis=-1)
+
+    def _zforce(self, R, z, phi=0., t=0.):
+        """
+        NAME:
+            _zforce
+        PURPOSE:
+            Evaluate the vertical force for this potential at the given coordinates. (-dPhi/dz)
+        INPUT:
+            :param R: galactocentric cylindrical radius
+            :param z: vertical height
+            :param phi: azimuth
+            :param t: time
+        OUTPUT:
+            :return: the vertical force
+        """
+        Rn, Ks, KH, Bs, Ds, expR = self._radial(R)
+        cos_ng, sin_ng = self._harmonics(R, phi, t)
+        zKB = np.asarray(z, dtype=float)[..., None] * Ks / Bs
+        w = (np.tanh(zKB) * np.cosh(zKB)**-Bs / Ds)[..., self._kidx]
+        return -self._H * expR * np.sum(self._C_ref * cos_ng * w, axis=-1)
+
+    def _phiforce(self, R, z, phi=0., t=0.):
+        """
+        NAME:
+            _phiforce
+        PURPOSE:
+            Evaluate the azimuthal force in cylindrical coordinates. (-dPhi/dphi)
+        INPUT:
+            :param R: galactocentric cylindrical radius
+            :param z: vertical height
+            :param phi: azimuth
+            :param t: time
+        OUTPUT:
+            :return: the azimuthal force
+        """
+        Rn, Ks, KH, Bs, Ds, expR = self._radial(R)
+        cos_ng, sin_ng = self._harmonics(R, phi, t)
+        zKB = np.asarray(z, dtype=float)[..., None] * Ks / Bs
+        w = (np.cosh(zKB)**-Bs / Ks / Ds)[..., self._kidx]
+        return -self._H * expR * np.sum(self._Nn * self._C_ref * sin_ng * w, axis=-1)
+
+    _phitorque = _phiforce  # galpy >= 1.8
+
+    def _dens(self, R, z, phi=0., t=0.):
+        """
+        NAME:
+            _dens
+        PURPOSE:
+            Evaluate the density.
+        INPUT:
+            :param R: galactocentric cylindrical radius
+            :param z: vertical height
+            :param phi: azimuth
+            :param t: time
+        OUTPUT:
+            :return: the density
+        """
+        Rn, Ks, KH, Bs, Ds, expR = self._radial(R)
+        cos_ng, sin_ng = self._harmonics(R, phi, t)
+        zKB = np.asarray(z, dtype=float)[..., None] * Ks / Bs
+        sech_zKB = 1 / np.cosh(zKB)
+        tanh_zKB = np.tanh(zKB)
+        log_sech_zKB = np.log(sech_zKB)
+
+        # E as defined in the appendix of the paper.
+        E = 1 + KH / Ds * (1 - 0.3 / (1 + 0.3 * KH) ** 2) - Rn / self._Rs \
+            - KH * (1 + 0.8 * KH) * log_sech_zKB \
+            - 0.4 * KH ** 2 * zKB * tanh_zKB
+
+        # rE' as defined in the appendix of the paper.
+        rE = -KH / Ds * (1 - 0.3 * (1 - 0.3 * KH) / (1 + 0.3 * KH) ** 3) \
+             + (KH / Ds * (1 - 0.3 / (1 + 0.3 * KH) ** 2)) - Rn / self._Rs \
+             + KH * (1 + 1.6 * KH) * log_sech_zKB \
+             - (0.4 * KH ** 2 * zKB * sech_zKB) ** 2 / Bs \
+             + 1.2 * KH ** 2 * zKB * tanh_zKB
+
+        prefactor = self._H / (Ds * Rn) * sech_zKB**Bs
+        cos_coeff = prefactor * (Ks * Rn * (Bs + 1) / Bs * sech_zKB**2 - 1 / Ks / Rn * (E**2 + rE))
+        sin_coeff = -2 * prefactor * E
+
+        idx = self._kidx
+        return self._rho0 * expR * np.sum(self._C_ref * (cos_coeff[..., idx] * cos_ng
+                                                         + self._cos_alpha * sin_coeff[..., idx] * sin_ng), axis=-1)
+
+    def OmegaP(self):
+        """Return the pattern speeds of the components (an array, also when they are all the same)."""
+        return self._omega
@@ -0,0 +1,56 @@
+###############################################################################
+#  orbit_batches.py: integrate arrays of initial conditions
+#
+#  Initial conditions are arrays of shape (norb, 6) in galpy's order
+#  [R, vR, vT, z, vz, phi] (or (norb, 4) for planar orbits [R, vR, vT, phi]),
+#  and integrated orbits are returned as arrays of shape (norb, nt, 6),
+#  the format used by orbit_diagnostics.
+###############################################################################
+
+from __future__ import division
+from galpy.orbit import Orbit
+from spiral_arms_fast import for_integration
+import numpy as np
+
+
+def integrate_batch(vxvv, pot, ts, method='symplec4_c', numcores=1):
+    """
+    NAME:
+        integrate_batch
+    PURPOSE:
+        integrate orbits for an array of initial conditions
+    INPUT:
+        :vxvv: initial conditions, array of shape (norb, 6) or (norb, 4)
+        :pot: Potential instance or list thereof (FastSpiralArmsPotentials with a growth envelope are integrated
+              as their to_wrapper() equivalents, in C)
+        :ts: times at which to output the orbits (nt)
+        :method: galpy integration method
+        :numcores: number of cores to integrate on (default: 1)
+    OUTPUT:
+        :return: array of shape (norb, nt, 6) (or (norb, nt, 4))
+    """
+    # all orbits are integrated in a single call (in parallel in the C integrators)
+    o = Orbit(np.atleast_2d(vxvv))
+    o.integrate(ts, for_integration(pot), method=method, numcores=numcores)
+    return o.getOrbit()
+
+
+def integrate_chunks(vxvv, pot, ts, chunk=1000, method='symplec4_c', numcores=1):
+    """
+    NAME:
+        integrate_chunks
+    PURPOSE:
+        integrate batches of initial conditions one batch at a time
+    INPUT:
+        :vxvv: iterable of arrays of shape (n, 6) (e.g., a generator), or an array of shape (norb, 6)
+               that is split into batches of length chunk
+        :pot, ts, method, numcores: see integrate_batch
+    OUTPUT:
+        :return: generator yielding (initial conditions, integrated orbits) for every batch
+    """
+    if isinstance(vxvv, np.ndarray):
+        batches = (vxvv[start:start + chunk] for start in range(0, len(vxvv), chunk))
+    else:
+        batches = vxvv
+    for batch in batches:
+        yield batch, integrate_batch(batch, pot, ts, method=method, numcores=numcores)
@@ -0,0 +1,188 @@
+###############################################################################
+#  orbit_diagnostics.py: batch diagnostics for integrated orbits in a rotating
+#                        spiral (or any rotating) potential
+#
+#  All functions work on arrays of integrated orbits of shape (norb, nt, 6),
+#  with the phase-space coordinates in galpy's order [R, vR, vT, z, vz, phi]
+#  (i.e., np.array([o.getOrbit() for o in orbits])), sampled at the times ts.
+#
+#  Resonances are classified with the ratio
+#
+#      x = m (Omega_phi - OmegaP) / Omega_R
+#
+#  which is 0 at corotation, +1 at the inner and -1 at the outer Lindblad
+#  resonance and +-1/2 at the inner/outer ultraharmonic (4:1) resonances.
+###############################################################################
+
+from __future__ import division
+from spiral_grid import evaluate
+import numpy as np
+
+RESONANCES = {'corotation': 0., 'ILR': 1., 'OLR': -1., 'IUHR': 0.5, 'OUHR': -0.5}
+
+
+def orbit_array(orbits):
+    """Return the integrated galpy Orbits as an array of shape (norb, nt, 6)."""
+    return np.array([o.getOrbit() for o in orbits])
+
+
+def pattern_speed(pot):
+    """Return the pattern speed of the (first) rotating component of a potential or list of potentials; a
+    composite pattern (e.g., MultiSpiralArmsPotential) must have a single pattern speed."""
+    for p in (pot if isinstance(pot, (list, tuple)) else [pot]):
+        if hasattr(p, 'OmegaP'):
+            OmegaP = np.unique(p.OmegaP())
+            if len(OmegaP) > 1:
+                raise ValueError('the components of {} rotate at different pattern speeds; pass OmegaP '
+                                 'explicitly'.format(type(p).__name__))
+            return OmegaP[0]
+    return 0.
+
+
+def orbit_properties(orbits):
+    """
+    NAME:
+        orbit_properties
+    PURPOSE:
+        compute the pericenter and apocenter radii, eccentricities and maximum heights of orbits
+        (as Orbit.rperi, rap, e and zmax, i.e., using the spherical radius)
+    INPUT:
+        :orbits: array of shape (norb, nt, 6) (or (nt, 6) for a single orbit)
+    OUTPUT:
+        :return: (rperi, rap, e, zmax), each of shape (norb,)
+    """
+    orbits = np.asarray(orbits)
+    r = np.sqrt(orbits[..., 0]**2 + orbits[..., 3]**2)
+    rperi = np.amin(r, axis=-1)
+    rap = np.amax(r, axis=-1)
+    return rperi, rap, (rap - rperi) / (rap + rperi), np.amax(np.fabs(orbits[..., 3]), axis=-1)
+
+
+def jacobi(pot, orbits, ts, OmegaP=None):
+    """
+    NAME:
+        jacobi
+    PURPOSE:
+        compute the Jacobi integral E - OmegaP Lz in the frame rotating with the pattern along the orbits
+    INPUT:
+        :pot: Potential instance or list thereof
+        :orbits: array of shape (norb, nt, 6) (or (nt, 6) for a single orbit)
+        :ts: times at which the orbits are sampled (nt)
+        :OmegaP: pattern speed (default: OmegaP() of the rotating component of pot)
+    OUTPUT:
+        :return: array of shape (norb, nt)
+    """
+    if OmegaP is None:
+        OmegaP = pattern_speed(pot)
+    orbits = np.asarray(orbits)
+    R, vR, vT, z, vz, phi = np.moveaxis(orbits, -1, 0)
+    return 0.5 * (vR**2 + vT**2 + vz**2) + evaluate(pot, R, z, phi, ts) - OmegaP * R * vT
+
+
+def _dominant_frequency(x, dt):
+    """Return the angular frequency of the strongest Fourier mode along the last axis of x (excluding the mean)."""
+    nt = x.shape[-1]
+    x = (x - np.mean(x, axis=-1)[..., None]) * np.hanning(nt)
+    power = np.abs(np.fft.rfft(x, axis=-1))**2
+    k = np.argmax(power[..., 1:-1], axis=-1) + 1
+    # refine the peak by fitting a parabola to the log power around it
+    idx = np.arange(len(k))
+    lm, l0, lp = [np.log(power[idx, k + ii] + 1e-300) for ii in (-1, 0, 1)]
+    denom = lm - 2 * l0 + lp
+    delta = np.where(denom != 0, 0.5 * (lm - lp) / np.where(denom != 0, denom, 1.), 0.)
+    return 2 * np.pi * (k + delta) / (nt * dt)
+
+
+def frequencies(orbits, ts, chunk=4096):
+    """
+    NAME:
+        frequencies
+    PURPOSE:
+        estimate the radial, azimuthal and vertical frequencies of orbits from their time series
+    INPUT:
+        :orbits: array of shape (norb, nt, 6) (or (nt, 6) for a single orbit)
+        :ts: equally spaced times at which the orbits are sampled (nt); the time span should cover many radial periods
+        :chunk: number of orbits transformed at a time (bounds the memory used by the FFTs)
+    OUTPUT:
+        :return: (Omega_R, Omega_phi, Omega_z), each of shape (norb,); Omega_R and Omega_z are the frequencies
+                 of the strongest Fourier modes of R(t) and z(t), Omega_phi is the mean rate of change of phi
+    """
+    orbits = np.asarray(orbits)
+    single = orbits.ndim == 2
+    if single:
+        orbits = orbits[None]
+    ts = np.asarray(ts, dtype=float)
+    dt = ts[1] - ts[0]
+    if not np.allclose(np.diff(ts), dt):
+        raise ValueError('frequencies requires equally spaced times ts')
+
+    norb = orbits.shape[0]
+    Omega_R = np.empty(norb)
+    Omega_phi = np.empty(norb)
+    Omega_z = np.empty(norb)
+    tc = ts - np.mean(ts)
+    for start in range(0, norb, chunk):
+        sl = slice(start, start + chunk)
+        Omega_R[sl] = _dominant_frequency(orbits[sl, :, 0], dt)
+        Omega_z[sl] = _dominant_frequency(orbits[sl, :, 3], dt)
+        phi = np.unwrap(orbits[sl, :, 5], axis=-1)
+        Omega_phi[sl] = np.sum((phi - np.mean(phi, axis=-1)[:, None]) * tc, axis=-1) / np.sum(tc**2)
+    if single:
+        return Omega_R[0], Omega_phi[0], Omega_z[0]
+    return Omega_R, Omega_phi, Omega_z
+
+
+def classify_resonances(Omega_R, Omega_phi, OmegaP, m=2, tol=0.05):
+    """
+    NAME:
+        classify_resonances
+    PURPOSE:
+        classify orbits as trapped near corotation, the Lindblad or the ultraharmonic resonances
+    INPUT:
+        :Omega_R: radial frequencies (array)
+        :Omega_phi: azimuthal frequencies (array)
+        :OmegaP: pattern speed
+        :m: number of spiral arms
+        :tol: maximum distance of m (Omega_phi - OmegaP) / Omega_R from the resonant value
+    OUTPUT:
+        :return: (labels, x) where labels is a string array with 'corotation', 'ILR', 'OLR', 'IUHR', 'OUHR'
+                 or '' (not resonant) and x is the frequency ratio used for the classification
+    """
+    x = m * (np.asarray(Omega_phi) - OmegaP) / np.asarray(Omega_R)
+    labels = np.zeros(x.shape, dtype='U10')
+    for name, value in RESONANCES.items():
+        labels[np.fabs(x - value) < tol] = name
+    return labels, x
+
+
+def diagnose(pot, orbits, ts, m=None, OmegaP=None, tol=0.05):
+    """
+    NAME:
+        diagnose
+    PURPOSE:
+        compute the Jacobi integral, the frequencies and the resonance classification of a batch of orbits
+    INPUT:
+        :pot: Potential instance or list thereof the orbits were integrated in
+        :orbits: array of shape (norb, nt, 6)
+        :ts: equally spaced times at which the orbits are sampled (nt)
+        :m: number of spiral arms (default: N of the SpiralArmsPotential in pot, or 2)
+        :OmegaP: pattern speed (default: OmegaP() of the rotating component of pot)
+        :tol: see classify_resonances
+    OUTPUT:
+        :return: dictionary with 'EJ' (mean Jacobi integral), 'dEJ' (its rms variation, a check of the
+                 integration), 'Omega_R', 'Omega_phi', 'Omega_z', 'x' and 'resonance'
+    """
+    if OmegaP is None:
+        OmegaP = pattern_speed(pot)
+    if m is None:
+        m = 2
+        for p in (pot if isinstance(pot, (list, tuple)) else [pot]):
+            if hasattr(p, '_N'):
+                m = abs(p._N)
+                break
+    EJ = jacobi(pot, orbits, ts, OmegaP=OmegaP)
+    Omega_R, Omega_phi, Omega_z = frequencies(orbits, ts)
+    labels, x = classify_resonances(Omega_R, Omega_phi, OmegaP, m=m, tol=tol)
+    return {'EJ': np.mean(EJ, axis=-1), 'dEJ': np.std(EJ, axis=-1),
+            'Omega_R': Omega_R, 'Omega_phi': Omega_phi, 'Omega_z': Omega_z,
+            'x': x, 'resonance': labels}
@@ -0,0 +1,130 @@
+###############################################################################
+#  resonance_radii.py: corotation and Lindblad radii for many pattern speeds
+#                      at once
+#
+#  potential.lindbladR does one scalar root-find per pattern speed. Here the
+#  circular and epicycle frequencies of the axisymmetric background are
+#  tabulated once per background potential (and cached), every requested
+#  (omega, m) pair is bracketed on the table, and all brackets are refined
+#  together with a vectorized regula falsi.
+#
+#  As in lindbladR, a resonance of order m satisfies m (Omega - OmegaP) = kappa
+#  (m > 0: inner, m < 0: outer Lindblad resonance); m = 0 denotes corotation.
+###############################################################################
+
+from __future__ import division
+import numpy as np
+
+_TABLES = {}
+
+
+def _background(pot):
+    """Return the axisymmetric components of a potential or list of potentials."""
+    pots = pot if isinstance(pot, (list, tuple)) else [pot]
+    return [p for p in pots if not p.isNonAxi]
+
+
+def _Omega_kappa(pots, R):
+    """Return the circular and epicycle frequencies in the midplane of pots at the radii R."""
+    Rforce = np.zeros_like(R)
+    R2deriv = np.zeros_like(R)
+    for p in pots:
+        Rforce += p.Rforce(R, 0., use_physical=False)
+        R2deriv += p.R2deriv(R, 0., use_physical=False)
+    Omega2 = -Rforce / R
+    return np.sqrt(Omega2), np.sqrt(R2deriv + 3 * Omega2)
+
+
+def frequency_table(pot, Rmin=0.01, Rmax=10., nR=2001):
+    """
+    NAME:
+        frequency_table
+    PURPOSE:
+        tabulate the circular frequency Omega(R) and epicycle frequency kappa(R) of the axisymmetric
+        part of a potential on a logarithmic grid (cached per potential and grid)
+    INPUT:
+        :pot: Potential instance or list thereof; non-axisymmetric components (e.g., SpiralArmsPotential)
+              are left out
+        :Rmin, Rmax, nR: the radial grid
+    OUTPUT:
+        :return: (R, Omega, kappa) arrays of length nR
+    """
+    pots = _background(pot)
+    key = (tuple(id(p) for p in pots), Rmin, Rmax, nR)
+    if key not in _TABLES:
+        R = np.exp(np.linspace(np.log(Rmin), np.log(Rmax), nR))
+        # keep a reference to the potentials, so that their ids are not reused while cached
+        _TABLES[key] = (pots, (R,) + _Omega_kappa(pots, R))
+    return _TABLES[key][1]
+
+
+def clear_cache():
+    """Forget all cached frequency tables."""
+    _TABLES.clear()
+
+
+def lindblad_radii(pot, omega, m=0, Rmin=0.01, Rmax=10., nR=2001, xtol=1e-10):
+    """
+    NAME:
+        lindblad_radii
+    PURPOSE:
+        compute the radii of corotation or of the Lindblad resonances for arrays of pattern speeds
+    INPUT:
+        :pot: Potential instance or list thereof (e.g., [SpiralArmsPotential()] + MWPotential2014);
+              only the axisymmetric components set the resonances
+        :omega: pattern speed(s) (array)
+        :m: order(s) of the resonance as in m (Omega - omega) = kappa, broadcast against omega;
+            0 or 'corotation' for corotation, positive for inner, negative for outer Lindblad resonances
+        :Rmin, Rmax, nR: radial grid of the frequency table used to bracket the roots
+        :xtol: absolute tolerance on the radii
+    OUTPUT:
+        :return: array of radii with the broadcast shape of omega and m (NaN where there is no resonance
+                 within [Rmin, Rmax]; where there are several, the outermost one is returned)
+    """
+    if isinstance(m, str):
+        if m.lower() != 'corotation':
+            raise ValueError("m must be an integer or 'corotation'")
+        m = 0
+    omega, m = np.broadcast_arrays(np.asarray(omega, dtype=float), np.asarray(m, dtype=float))
+    shape = omega.shape
+    omega = omega.ravel()
+    m = m.ravel()
+    invm = np.where(m == 0, 0., 1. / np.where(m == 0, 1., m))
+
+    pots = _background(pot)
+    R, Omega, kappa = frequency_table(pots, Rmin=Rmin, Rmax=Rmax, nR=nR)
+
+    # bracket the outermost root for each order m: because Omega - kappa/m is continuous, the values it
+    # takes outside R[i] span [min, max] of the table beyond i, which shrink monotonically with i
+    idx = np.empty(len(omega), dtype=int)
+    for mm in np.unique(m):
+        sel = m == mm
+        g = Omega - (1. / mm if mm != 0 else 0.) * kappa
+        gmin = np.minimum.accumulate(g[::-1])[::-1]
+        gmax = np.maximum.accumulate(g[::-1])[::-1]
+        idx[sel] = np.minimum(np.searchsorted(gmin, omega[sel], side='right') - 1,
+                              nR - 1 - np.searchsorted(gmax[::-1], omega[sel], side='left'))
+    found = idx >= 0
+    idx = np.clip(idx, 0, nR - 2)
+    lo, hi = R[idx], R[idx + 1]
+    flo = np.where(found, Omega[idx] - invm * kappa[idx] - omega, -1.)
+    fhi = np.where(found, Omega[idx + 1] - invm * kappa[idx + 1] - omega, 1.)
+
+    # refine all brackets at once with the Illinois variant of regula falsi
+    side = np.zeros(len(omega))
+    out = lo
+    for _ in range(100):
+        out = (lo * fhi - hi * flo) / (fhi - flo)
+        Om, ka = _Omega_kappa(pots, out)
+        fout = Om - invm * ka - omega
+        left = np.signbit(fout) == np.signbit(flo)
+        fhi = np.where(left & (side == -1), 0.5 * fhi, fhi)
+        flo = np.where(~left & (side == 1), 0.5 * flo, flo)
+        lo, flo = np.where(left, out, lo), np.where(left, fout, flo)
+        hi, fhi = np.where(left, hi, out), np.where(left, fhi, fout)
+        side = np.where(left, -1, 1)
+        if np.all((hi - lo < xtol) | (fout == 0) | ~found):
+            break
+
+    out[~found] = np.nan
+    return out.reshape(shape)
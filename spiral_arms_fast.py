@@ -0,0 +1,402 @@
+###############################################################################
+#  spiral_arms_fast.py: SpiralArmsPotential with precomputed phase terms
+#
+#  The harmonic sum of Cox and Gomez (2002) needs cos(n*gamma) and
+#  sin(n*gamma) for n = 1 .. len(Cs). Here they are built from a single
+#  cos(gamma), sin(gamma) pair with the angle-addition recurrence, and the
+#  radial factors K, B, D and the phase terms of the last scalar point are
+#  kept, so that Rforce, zforce, phiforce and dens at the same point (as
+#  requested by the orbit integrators) only do the trigonometric work once.
+#
+#  When omega == 0 the potential is static and t is never used; when omega
+#  is non-zero the phase terms are keyed on phi - omega*t, so that repeated
+#  evaluations at a fixed time reuse them as well.
+#
+#  Unlike SpiralArmsPotential, the methods accept (broadcastable) arrays.
+#
+#  With tform set, the amplitude is multiplied by the growth envelope of
+#  galpy's DehnenSmoothWrapperPotential inside every kernel, instead of
+#  through a wrapper call per evaluation. galpy's C integrators would treat
+#  the subclass as a plain SpiralArmsPotential, so the C flags are switched
+#  off while an envelope is active (with a warning); to_wrapper() returns the
+#  equivalent DehnenSmoothWrapperPotential, which the C integrators do
+#  support, and for_integration() does that for a whole list of potentials
+#  (orbit_batches and chaos_maps apply it automatically).
+###############################################################################
+
+from __future__ import division
+from galpy.potential import SpiralArmsPotential, DehnenSmoothWrapperPotential
+from galpy.util import galpyWarning
+import warnings
+import numpy as np
+try:
+    from galpy.util import bovy_conversion as conversion
+except ImportError:  # galpy >= 1.7
+    from galpy.util import conversion
+try:
+    from astropy import units
+    _APY_LOADED = True
+except ImportError:
+    _APY_LOADED = False
+
+
+def _multiple_angles(cos_g, sin_g, n):
+    """Return cos(k*gamma), sin(k*gamma) for k = 1 .. n, stacked along the (length one) last axis of the input."""
+    cos_ng = [cos_g]
+    sin_ng = [sin_g]
+    for k in range(1, n):
+        cos_ng.append(cos_ng[-1] * cos_g - sin_ng[-1] * sin_g)
+        sin_ng.append(sin_ng[-1] * cos_g + cos_ng[-2] * sin_g)
+    return np.concatenate(cos_ng, axis=-1), np.concatenate(sin_ng, axis=-1)
+
+
+class FastSpiralArmsPotential(SpiralArmsPotential):
+    """SpiralArmsPotential with cached radial factors and phase terms, array inputs and an optional growth envelope.
+
+    Takes the same arguments as SpiralArmsPotential (plus tform and tsteady) and returns identical results.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        NAME:
+            __init__
+        PURPOSE:
+            initialize a spiral arms potential
+        INPUT:
+            :tform: if set, the amplitude grows smoothly from zero at tform as in DehnenSmoothWrapperPotential
+                    (can be Quantity; default: None, constant amplitude)
+            :tsteady: time from tform at which the potential is fully grown (default: -tform/2, can be Quantity)
+            all other arguments are those of SpiralArmsPotential
+        OUTPUT:
+            (none)
+        """
+        tform = kwargs.pop('tform', None)
+        tsteady = kwargs.pop('tsteady', None)
+        SpiralArmsPotential.__init__(self, *args, **kwargs)
+        self._reset_harmonics()
+        self._radial_key = None
+        self._phase_key = None
+        self.set_envelope(tform, tsteady)
+
+    @classmethod
+    def from_potential(cls, pot, tform=None, tsteady=None):
+        """Return a FastSpiralArmsPotential with the same parameters (and ro, vo) as the SpiralArmsPotential pot,
+        or as the SpiralArmsPotential wrapped in the (growing) DehnenSmoothWrapperPotential pot."""
+        if isinstance(pot, DehnenSmoothWrapperPotential):
+            if not getattr(pot, '_grow', True):
+                raise ValueError('decaying DehnenSmoothWrapperPotentials are not supported')
+            # (an explicit conversion for evaluation, so without the warning of set_envelope)
+            new = cls.from_potential(pot._pot)
+            new._set_envelope(pot._tform, pot._tsteady - pot._tform)
+            new._amp *= pot._amp
+            return new
+        new = cls.__new__(cls)
+        new.__dict__.update(pot.__dict__)
+        new._reset_harmonics()
+        new._radial_key = None
+        new._phase_key = None
+        if tform is not None or '_c_flags' not in new.__dict__:
+            new.set_envelope(tform, tsteady)
+        return new
+
+    def _reset_harmonics(self):
+        """Point _Cs, _ns and _HNn back at the 1D arrays of the harmonics, _Cs0, _ns0 and _HNn0 (for array input,
+        the methods of SpiralArmsPotential replace them by 2D arrays, which the kernels here cannot use)."""
+        for name in ('_Cs', '_ns', '_HNn'):
+            if name + '0' not in self.__dict__:  # older galpy keeps the 1D arrays only
+                setattr(self, name + '0', getattr(self, name))
+            setattr(self, name, getattr(self, name + '0'))
+
+    def set_envelope(self, tform=None, tsteady=None):
+        """
+        NAME:
+            set_envelope
+        PURPOSE:
+            switch the growth envelope on or off
+        INPUT:
+            :tform: start of the growth (can be Quantity); None for a constant amplitude
+            :tsteady: time from tform at which the potential is fully grown (default: -tform/2, can be Quantity)
+        OUTPUT:
+            (none)
+        NOTE:
+            switches off galpy's C integrators for this potential while the envelope is active (with a
+            warning); integrate orbits in to_wrapper() instead
+        """
+        self._set_envelope(tform, tsteady)
+        if tform is not None:
+            warnings.warn('galpy cannot integrate orbits in a FastSpiralArmsPotential with a growth envelope in C '
+                          'and falls back to a much slower Python integrator; integrate orbits in to_wrapper() '
+                          '(or use spiral_arms_fast.for_integration) instead', galpyWarning)
+
+    def _set_envelope(self, tform, tsteady):
+        """Switch the growth envelope on or off, without the warning of set_envelope."""
+        if '_c_flags' not in self.__dict__:
+            self._c_flags = dict((name, value) for name, value in self.__dict__.items() if name.startswith('hasC'))
+        if _APY_LOADED and isinstance(tform, units.Quantity):
+            tform = tform.to(units.Gyr).value / conversion.time_in_Gyr(self._vo, self._ro)
+        if _APY_LOADED and isinstance(tsteady, units.Quantity):
+            tsteady = tsteady.to(units.Gyr).value / conversion.time_in_Gyr(self._vo, self._ro)
+        self._tform = tform
+        self._envelope_key = None
+        if tform is None:
+            self._tsteady = None
+            self.__dict__.update(self._c_flags)
+        else:
+            self._tsteady = tform / 2. if tsteady is None else tform + tsteady
+            for name in self._c_flags:
+                setattr(self, name, False)
+
+    def to_wrapper(self):
+        """Return an equivalent SpiralArmsPotential, wrapped in DehnenSmoothWrapperPotential if the envelope is
+        active, for use with galpy's C integrators."""
+        pot = SpiralArmsPotential.__new__(SpiralArmsPotential)
+        pot.__dict__.update(self.__dict__)
+        pot.__dict__.update(self._c_flags)
+        for name in ('_c_flags', '_tform', '_tsteady', '_envelope_key', '_envelope_value',
+                     '_radial_key', '_radial_terms', '_phase_key', '_phase_terms'):
+            pot.__dict__.pop(name, None)
+        if self._tform is None:
+            return pot
+        wrapper = DehnenSmoothWrapperPotential(pot=pot, tform=self._tform, tsteady=self._tsteady - self._tform)
+        # same units and physical-output setting as this potential
+        for name in ('_ro', '_vo', '_roSet', '_voSet'):
+            setattr(wrapper, name, getattr(self, name))
+        return wrapper
+
+    def _envelope(self, t):
+        """Return the growth factor of the amplitude at time(s) t (1 without an envelope)."""
+        if self._tform is None:
+            return 1.
+        # (a copy of t, so that 0-d arrays changed in place do not return stale values)
+        key = float(t) if np.ndim(t) == 0 else None
+        if key is not None and self._envelope_key == key:
+            return self._envelope_value
+        xi = np.clip(2. * (np.asarray(t, dtype=float) - self._tform) / (self._tsteady - self._tform) - 1., -1., 1.)
+        value = 3. / 16. * xi**5 - 5. / 8. * xi**3 + 15. / 16. * xi + 0.5
+        if key is not None:
+            self._envelope_key = key
+            self._envelope_value = value
+        return value
+
+    def _phase(self, phi, t):
+        """Return the azimuth in the frame rotating with the pattern (t only matters if omega != 0)."""
+        if self._omega == 0:
+            return phi
+        return phi - self._omega * t
+
+    def _radial(self, R):
+        """Return R, K, B, D, broadcast against the harmonics along the last axis."""
+        # the keys are copies, so that 0-d arrays changed in place do not return stale terms
+        key = float(R) if np.ndim(R) == 0 else None
+        if key is not None and self._radial_key == key:
+            return self._radial_terms
+        Rn = np.asarray(R, dtype=float)[..., None]
+        # K, B and D (eqns. 5-7) from the 1D arrays of the harmonics, which SpiralArmsPotential never replaces
+        HNn_R_sina = self._HNn0 / Rn / self._sin_alpha
+        Ks = self._ns0 * self._N / Rn / self._sin_alpha
+        Bs = HNn_R_sina * (0.4 * HNn_R_sina + 1)
+        Ds = (0.3 * self._HNn0 * HNn_R_sina + self._HNn0 + Rn * self._sin_alpha) \
+            / (0.3 * self._HNn0 + Rn * self._sin_alpha)
+        terms = (Rn, Ks, Bs, Ds)
+        if key is not None:
+            self._radial_key = key
+            self._radial_terms = terms
+        return terms
+
+    def _harmonics(self, R, phi, t):
+        """Return cos(n*gamma), sin(n*gamma), broadcast against the harmonics along the last axis."""
+        phase = self._phase(phi, t)
+        # (the phase is complex when spiral_gradients perturbs omega)
+        key = (float(R), np.asarray(phase).item()) if np.ndim(R) == 0 and np.ndim(phase) == 0 else None
+        if key is not None and self._phase_key == key:
+            return self._phase_terms
+        g = self._gamma(np.asarray(R, dtype=float)[..., None], np.asarray(phase)[..., None])
+        terms = _multiple_angles(np.cos(g), np.sin(g), len(self._Cs0))
+        if key is not None:
+            self._phase_key = key
+            self._phase_terms = terms
+        return terms
+
+    def _evaluate(self, R, z, phi=0., t=0.):
+        """
+        NAME:
+            _evaluate
+        PURPOSE:
+            Evaluate the potential at the given coordinates. (without the amp factor; handled by super class)
+        INPUT:
+            :param R: galactocentric cylindrical radius
+            :param z: vertical height
+            :param phi: azimuth
+            :param t: time
+        OUTPUT:
+            :return: Phi(R, z, phi, t)
+        """
+        Rn, Ks, Bs, Ds = self._radial(R)
+        cos_ng, sin_ng = self._harmonics(R, phi, t)
+        z = np.asarray(z, dtype=float)[..., None]
+
+        return -self._envelope(t) * self._H * np.exp(-(Rn[..., 0] - self._r_ref) / self._Rs) \
+               * np.sum(self._Cs0 / Ks / Ds * cos_ng / np.cosh(Ks * z / Bs) ** Bs, axis=-1)
+
+    def _Rforce(self, R, z, phi=0., t=0.):
+        """
+        NAME:
+            _Rforce
+        PURPOSE:
+            Evaluate the radial force for this potential at the given coordinates. (-dPhi/dR)
+        INPUT:
+            :param R: galactocentric cylindrical radius
+            :param z: vertical height
+            :param phi: azimuth
+            :param t: time
+        OUTPUT:
+            :return: the radial force
+        """
+        Rn, Ks, Bs, Ds = self._radial(R)
+        cos_ng, sin_ng = self._harmonics(R, phi, t)
+        z = np.asarray(z, dtype=float)[..., None]
+
+        He = self._envelope(t) * self._H * np.exp(-(Rn[..., 0] - self._r_ref) / self._Rs)
+
+        HNn_R_sina = self._HNn0 / Rn / self._sin_alpha
+        dKs_dR = -Ks / Rn
+        dBs_dR = -HNn_R_sina / Rn**2 / self._sin_alpha * (0.8 * self._HNn0 + Rn * self._sin_alpha)
+        dDs_dR = HNn_R_sina * (0.3 * (HNn_R_sina + 0.3 * HNn_R_sina**2 + 1) / Rn / (0.3 * HNn_R_sina + 1)**2
+                               - (1 / Rn * (1 + 0.6 * HNn_R_sina) / (0.3 * HNn_R_sina + 1)))
+        dg_dR = self._dgamma_dR(Rn)
+
+        zKB = z * Ks / Bs
+        sechzKB = 1 / np.cosh(zKB)
+
+        return -He * np.sum(self._Cs0 * sechzKB**Bs / Ds * ((self._ns0 * dg_dR / Ks * sin_ng
+                                                            + cos_ng * (z * np.tanh(zKB) * (dKs_dR/Ks - dBs_dR/Bs)
+                                                                        - dBs_dR / Ks * np.log(sechzKB)
+                                                                        + dKs_dR / Ks**2
+                                                                        + dDs_dR / Ds / Ks))
+                                                           + cos_ng / Ks / self._Rs), axis=-1)
+
+    def _zforce(self, R, z, phi=0., t=0.):
+        """
+        NAME:
+            _zforce
+        PURPOSE:
+            Evaluate the vertical force for this potential at the given coordinates. (-dPhi/dz)
+        INPUT:
+            :param R: galactocentric cylindrical radius
+            :param z: vertical height
+            :param phi: azimuth
+            :param t: time
+        OUTPUT:
+            :return: the vertical force
+        """
+        Rn, Ks, Bs, Ds = self._radial(R)
+        cos_ng, sin_ng = self._harmonics(R, phi, t)
+        zK_B = np.asarray(z, dtype=float)[..., None] * Ks / Bs
+
+        return -self._envelope(t) * self._H * np.exp(-(Rn[..., 0] - self._r_ref) / self._Rs) \
+               * np.sum(self._Cs0 / Ds * cos_ng * np.tanh(zK_B) / np.cosh(zK_B)**Bs, axis=-1)
+
+    def _phiforce(self, R, z, phi=0., t=0.):
+        """
+        NAME:
+            _phiforce
+        PURPOSE:
+            Evaluate the azimuthal force in cylindrical coordinates. (-dPhi/dphi)
+        INPUT:
+            :param R: galactocentric cylindrical radius
+            :param z: vertical height
+            :param phi: azimuth
+            :param t: time
+        OUTPUT:
+            :return: the azimuthal force
+        """
+        Rn, Ks, Bs, Ds = self._radial(R)
+        cos_ng, sin_ng = self._harmonics(R, phi, t)
+        z = np.asarray(z, dtype=float)[..., None]
+
+        return -self._envelope(t) * self._H * np.exp(-(Rn[..., 0] - self._r_ref) / self._Rs) \
+               * np.sum(self._N * self._ns0 * self._Cs0 / Ds / Ks / np.cosh(z * Ks / Bs)**Bs * sin_ng, axis=-1)
+
+    # galpy >= 1.8 calls the azimuthal force _phitorque
+    _phitorque = _phiforce
+
+    def _dens(self, R, z, phi=0., t=0.):
+        """
+        NAME:
+            _dens
+        PURPOSE:
+            Evaluate the density.
+        INPUT:
+            :param R: galactocentric cylindrical radius
+            :param z: vertical height
+            :param phi: azimuth
+            :param t: time
+        OUTPUT:
+            :return: the density
+        """
+        Rn, Ks, Bs, Ds = self._radial(R)
+        cos_ng, sin_ng = self._harmonics(R, phi, t)
+        z = np.asarray(z, dtype=float)[..., None]
+
+        KH = Ks * self._H
+        zKB = z * Ks / Bs
+        sech_zKB = 1 / np.cosh(zKB)
+        tanh_zKB = np.tanh(zKB)
+        log_sech_zKB = np.log(sech_zKB)
+
+        # E as defined in the appendix of the paper.
+        E = 1 + KH / Ds * (1 - 0.3 / (1 + 0.3 * KH) ** 2) - Rn / self._Rs \
+            - KH * (1 + 0.8 * KH) * log_sech_zKB \
+            - 0.4 * KH ** 2 * zKB * tanh_zKB
+
+        # rE' as defined in the appendix of the paper.
+        rE = -KH / Ds * (1 - 0.3 * (1 - 0.3 * KH) / (1 + 0.3 * KH) ** 3) \
+             + (KH / Ds * (1 - 0.3 / (1 + 0.3 * KH) ** 2)) - Rn / self._Rs \
+             + KH * (1 + 1.6 * KH) * log_sech_zKB \
+             - (0.4 * KH ** 2 * zKB * sech_zKB) ** 2 / Bs \
+             + 1.2 * KH ** 2 * zKB * tanh_zKB
+
+        rho = np.sum(self._Cs0 * self._rho0 * (self._H / (Ds * Rn)) * np.exp(-(Rn - self._r_ref) / self._Rs)
+                     * sech_zKB**Bs * (cos_ng * (Ks * Rn * (Bs + 1) / Bs * sech_zKB**2
+                                                 - 1 / Ks / Rn * (E**2 + rE))
+                                       - 2 * sin_ng * E * np.cos(self._alpha)), axis=-1)
+        return self._envelope(t) * rho
+
+
+def for_integration(pot):
+    """
+    NAME:
+        for_integration
+    PURPOSE:
+        replace FastSpiralArmsPotentials with a growth envelope by their to_wrapper() equivalents, which galpy
+        integrates orbits in with its C integrators
+    INPUT:
+        :pot: Potential instance or list thereof
+    OUTPUT:
+        :return: pot, or a list with the replaced potentials
+    """
+    if isinstance(pot, (list, tuple)):
+        return [for_integration(p) for p in pot]
+    if isinstance(pot, FastSpiralArmsPotential) and pot._tform is not None:
+        return pot.to_wrapper()
+    return pot
+
+
+def _enveloped(name):
+    """Return the second-derivative method name of SpiralArmsPotential multiplied by the growth envelope."""
+    base = getattr(SpiralArmsPotential, name)
+
+    def method(self, R, z, phi=0., t=0.):
+        try:
+            return self._envelope(t) * base(self, R, z, phi=phi, t=t)
+        finally:
+            # galpy replaces the 1D harmonic arrays for array input
+            self._reset_harmonics()
+    method.__name__ = name
+    method.__doc__ = base.__doc__
+    return method
+
+
+for _name in ('_R2deriv', '_z2deriv', '_phi2deriv', '_Rzderiv', '_Rphideriv', '_phizderiv'):
+    if hasattr(SpiralArmsPotential, _name):
+        setattr(FastSpiralArmsPotential, _name, _enveloped(_name))
@@ -0,0 +1,91 @@
+###############################################################################
+#  spiral_gradients.py: derivatives of the SpiralArmsPotential potential,
+#                       forces and density with respect to its parameters
+#
+#  The derivatives are computed with the complex-step method (Squire &
+#  Trapp 1998): evaluating the vectorized kernels of FastSpiralArmsPotential
+#  with one parameter moved by i h gives
+#
+#      df/dp = Im f(p + i h) / h
+#
+#  without subtractive cancellation, so with h = 1e-20 the result is exact to
+#  machine precision, like an analytic derivative, for every quantity and
+#  parameter with a single extra (complex) evaluation.
+###############################################################################
+
+from __future__ import division
+from spiral_arms_fast import FastSpiralArmsPotential
+import numpy as np
+
+PARAMETERS = ('amp', 'alpha', 'r_ref', 'phi_ref', 'Rs', 'H', 'Cs', 'omega')
+QUANTITIES = ('potential', 'Rforce', 'zforce', 'phiforce', 'dens')
+
+# quantity -> method of FastSpiralArmsPotential (without the amplitude)
+_METHODS = {'potential': '_evaluate',
+            'Rforce': '_Rforce',
+            'zforce': '_zforce',
+            'phiforce': '_phiforce',
+            'dens': '_dens'}
+
+_STEP = 1e-20
+
+
+def _perturbed(pot, name, index=None):
+    """Return a copy of the FastSpiralArmsPotential pot with parameter name (element index of Cs) moved by i h."""
+    new = FastSpiralArmsPotential.from_potential(pot)
+    if name == 'alpha':
+        # alpha is stored with a flipped sign
+        new._alpha = pot._alpha - 1j * _STEP
+        new._sin_alpha = np.sin(new._alpha)
+        new._tan_alpha = np.tan(new._alpha)
+    elif name == 'H':
+        new._H = pot._H + 1j * _STEP
+        new._HNn = new._HNn0 = new._H * pot._N * pot._ns0
+    elif name == 'Cs':
+        new._Cs = new._Cs0 = np.array(pot._Cs0, dtype=complex)
+        new._Cs0[index] += 1j * _STEP
+    else:
+        setattr(new, '_' + name, getattr(pot, '_' + name) + 1j * _STEP)
+    return new
+
+
+def gradients(pot, R, z, phi=0., t=0., quantities=QUANTITIES, params=PARAMETERS):
+    """
+    NAME:
+        gradients
+    PURPOSE:
+        evaluate the potential, forces and density together with their derivatives with respect to the
+        parameters of a SpiralArmsPotential
+    INPUT:
+        :pot: SpiralArmsPotential (or FastSpiralArmsPotential, or a SpiralArmsPotential wrapped in
+              DehnenSmoothWrapperPotential)
+        :R, z, phi, t: coordinates in internal units (broadcastable arrays)
+        :quantities: any of 'potential', 'Rforce', 'zforce', 'phiforce' and 'dens'
+        :params: any of 'amp', 'alpha', 'r_ref', 'phi_ref', 'Rs', 'H', 'Cs' and 'omega' (alpha is the pitch
+                 angle as passed to the constructor, in radians)
+    OUTPUT:
+        :return: dictionary quantity -> dictionary with the 'value' and the derivative with respect to every
+                 parameter in internal units, with the broadcast shape of the coordinates; the derivatives with
+                 respect to Cs have an additional last axis of length len(Cs)
+    """
+    pot = FastSpiralArmsPotential.from_potential(pot)
+    R, z, phi, t = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (R, z, phi, t)])
+    out = {}
+    for quantity in quantities:
+        # the kernels without the amplitude are the derivatives with respect to amp
+        kernel = getattr(pot, _METHODS[quantity])(R, z, phi, t)
+        out[quantity] = {'value': pot._amp * kernel}
+        if 'amp' in params:
+            out[quantity]['amp'] = kernel
+    for name in params:
+        if name == 'amp':
+            continue
+        indices = range(len(pot._Cs0)) if name == 'Cs' else [None]
+        grads = dict((quantity, []) for quantity in quantities)
+        for index in indices:
+            new = _perturbed(pot, name, index)
+            for quantity in quantities:
+                grads[quantity].append(pot._amp * np.imag(getattr(new, _METHODS[quantity])(R, z, phi, t)) / _STEP)
+        for quantity in quantities:
+            out[quantity][name] = np.stack(grads[quantity], axis=-1) if name == 'Cs' else grads[quantity][0]
+    return out
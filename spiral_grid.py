@@ -0,0 +1,164 @@
+###############################################################################
+#  spiral_grid.py: evaluate potentials, forces and densities on whole grids
+#
+#  Replaces double loops like
+#
+#      for ii in range(n):
+#          for jj in range(n):
+#              R, phi, z = bovy_coords.rect_to_cyl(xs[ii], ys[jj], 0)
+#              pot[ii, jj] = evaluateDensities(sp, R*u.kpc, z*u.kpc, phi=phi)
+#
+#  with a single vectorized call, evaluate_xy(sp, xs, ys, quantity='dens').
+#  Units are converted once per array instead of once per point.
+###############################################################################
+
+from __future__ import division
+from galpy.potential import Potential, SpiralArmsPotential, DehnenSmoothWrapperPotential
+from spiral_arms_fast import FastSpiralArmsPotential
+from multi_spiral_arms import MultiSpiralArmsPotential
+import numpy as np
+try:
+    from galpy.util import bovy_conversion as conversion
+except ImportError:  # galpy >= 1.7
+    from galpy.util import conversion
+try:
+    from astropy import units
+    _APY_LOADED = True
+except ImportError:
+    _APY_LOADED = False
+
+# quantity -> (name of the public galpy method, kind of physical unit); galpy >= 1.8 calls phiforce phitorque
+_QUANTITIES = {'potential': ('__call__', 'energy'),
+               'Rforce': ('Rforce', 'force'),
+               'zforce': ('zforce', 'force'),
+               'phiforce': ('phitorque' if hasattr(Potential, 'phitorque') else 'phiforce', 'energy'),
+               'dens': ('dens', 'density')}
+
+# quantity -> method of FastSpiralArmsPotential and MultiSpiralArmsPotential (without the amplitude)
+_SPIRAL_METHODS = {'potential': '_evaluate',
+                   'Rforce': '_Rforce',
+                   'zforce': '_zforce',
+                   'phiforce': '_phiforce',
+                   'dens': '_dens'}
+
+
+def _to_internal(x, unit, scale, physical):
+    """Convert an array of positions or times to internal units (once for the whole array)."""
+    if _APY_LOADED and isinstance(x, units.Quantity):
+        return x.to(unit).value / scale
+    x = np.asarray(x, dtype=float)
+    if physical:
+        return x / scale
+    return x
+
+
+def _vectorized(p):
+    """Return a potential whose methods accept arrays (growing spirals get the envelope fused into the kernels)."""
+    if isinstance(p, SpiralArmsPotential) and not isinstance(p, FastSpiralArmsPotential):
+        return FastSpiralArmsPotential.from_potential(p)
+    if isinstance(p, DehnenSmoothWrapperPotential) and isinstance(p._pot, SpiralArmsPotential) \
+            and getattr(p, '_grow', True):
+        return FastSpiralArmsPotential.from_potential(p)
+    return p
+
+
+def evaluate(pot, R, z, phi=0., t=0., quantity='potential', physical=False, ro=None, vo=None):
+    """
+    NAME:
+        evaluate
+    PURPOSE:
+        evaluate the potential, a force or the density of a potential (or list thereof) for arrays of points
+    INPUT:
+        :pot: Potential instance or list thereof
+        :R: galactocentric cylindrical radius (array, can be Quantity)
+        :z: vertical height (array, can be Quantity)
+        :phi: azimuth (array, can be Quantity)
+        :t: time (array, can be Quantity)
+        :quantity: 'potential', 'Rforce', 'zforce', 'phiforce' or 'dens'
+        :physical: if True, plain-array inputs are in kpc and Gyr, and the output is in (km/s)^2, km/s/Myr
+                   or Msun/pc^3; otherwise everything is in internal units (Quantity inputs are always converted)
+        :ro: distance scale in kpc (default: that of the (first) potential)
+        :vo: velocity scale in km/s (default: that of the (first) potential)
+    OUTPUT:
+        :return: array with the broadcast shape of R, z, phi and t
+    """
+    if quantity not in _QUANTITIES:
+        raise ValueError("quantity must be one of {}".format(sorted(_QUANTITIES)))
+    pots = pot if isinstance(pot, (list, tuple)) else [pot]
+    if ro is None:
+        ro = pots[0]._ro
+    if vo is None:
+        vo = pots[0]._vo
+
+    R = _to_internal(R, 'kpc', ro, physical)
+    z = _to_internal(z, 'kpc', ro, physical)
+    phi = _to_internal(phi, 'rad', 1., False)
+    t = _to_internal(t, 'Gyr', conversion.time_in_Gyr(vo, ro), physical)
+    R, z, phi, t = np.broadcast_arrays(R, z, phi, t)
+
+    method, kind = _QUANTITIES[quantity]
+    out = np.zeros(R.shape)
+    for p in pots:
+        p = _vectorized(p)
+        if isinstance(p, (FastSpiralArmsPotential, MultiSpiralArmsPotential)):
+            out += p._amp * getattr(p, _SPIRAL_METHODS[quantity])(R, z, phi, t)
+        else:
+            out += getattr(p, method)(R, z, phi=phi, t=t, use_physical=False)
+
+    if not physical:
+        return out
+    if kind == 'energy':
+        return out * vo**2
+    elif kind == 'force':
+        return out * conversion.force_in_kmsMyr(vo, ro)
+    return out * conversion.dens_in_msolpc3(vo, ro)
+
+
+def evaluate_xy(pot, x, y, z=0., t=0., quantity='potential', physical=False, ro=None, vo=None):
+    """
+    NAME:
+        evaluate_xy
+    PURPOSE:
+        evaluate a quantity on the rectangular grid spanned by x and y (e.g., for a face-on map)
+    INPUT:
+        :pot: Potential instance or list thereof
+        :x, y: 1D arrays of grid coordinates (can be Quantity)
+        :z: vertical height of the plane (can be Quantity)
+        :t: time (can be Quantity)
+        :quantity, physical, ro, vo: see evaluate
+    OUTPUT:
+        :return: array of shape (len(x), len(y)), with out[ii, jj] at (x[ii], y[jj])
+    """
+    X, Y = np.meshgrid(_strip(x, pot, ro, physical), _strip(y, pot, ro, physical), indexing='ij')
+    return evaluate(pot, np.sqrt(X**2 + Y**2), z, np.arctan2(Y, X), t,
+                    quantity=quantity, physical=physical, ro=ro, vo=vo)
+
+
+def evaluate_Rz(pot, R, z, phi=0., t=0., quantity='potential', physical=False, ro=None, vo=None):
+    """
+    NAME:
+        evaluate_Rz
+    PURPOSE:
+        evaluate a quantity on the meridional grid spanned by R and z
+    INPUT:
+        :pot: Potential instance or list thereof
+        :R, z: 1D arrays of grid coordinates (can be Quantity)
+        :phi: azimuth of the plane (can be Quantity)
+        :t: time (can be Quantity)
+        :quantity, physical, ro, vo: see evaluate
+    OUTPUT:
+        :return: array of shape (len(R), len(z)), with out[ii, jj] at (R[ii], z[jj])
+    """
+    RR, zz = np.meshgrid(_strip(R, pot, ro, physical), _strip(z, pot, ro, physical), indexing='ij')
+    return evaluate(pot, RR, zz, phi, t, quantity=quantity, physical=physical, ro=ro, vo=vo)
+
+
+def _strip(x, pot, ro, physical):
+    """Convert a Quantity array of positions to plain numbers in the unit system declared by physical."""
+    if _APY_LOADED and isinstance(x, units.Quantity):
+        if physical:
+            return x.to(units.kpc).value
+        if ro is None:
+            ro = (pot[0] if isinstance(pot, (list, tuple)) else pot)._ro
+        return x.to(units.kpc).value / ro
+    return np.asarray(x, dtype=float)
@@ -0,0 +1,102 @@
+/*
+ * spiral_kernel.c: SpiralArmsPotential (Cox & Gomez 2002) potential, forces
+ *                  and density for arrays of points
+ *
+ * Compiled and called through ctypes by spiral_threads.py; ctypes releases
+ * the GIL for the duration of the call, so several threads can fill
+ * disjoint slices of one output array at the same time. The parameters are
+ * those stored by SpiralArmsPotential (N and alpha with flipped signs), and
+ * the formulas follow spiral_arms_fast.py.
+ */
+#include <math.h>
+
+#define SPIRAL_POTENTIAL 0
+#define SPIRAL_RFORCE 1
+#define SPIRAL_ZFORCE 2
+#define SPIRAL_PHIFORCE 3
+#define SPIRAL_DENS 4
+
+/* args: amp, N, alpha, sin_alpha, tan_alpha, r_ref, phi_ref, Rs, H, omega, rho0, then nCs, Cs[nCs] */
+static double spiral_point(int quantity, double R, double z, double phi, double t,
+                           const double *args, int nCs, const double *Cs)
+{
+    double amp = args[0], N = args[1], alpha = args[2], sin_alpha = args[3], tan_alpha = args[4];
+    double r_ref = args[5], phi_ref = args[6], Rs = args[7], H = args[8], omega = args[9], rho0 = args[10];
+    double g = N * (phi - omega * t - phi_ref - log(R / r_ref) / tan_alpha);
+    double cos_g = cos(g), sin_g = sin(g), cos_ng = cos_g, sin_ng = sin_g, tmp;
+    double expR = exp(-(R - r_ref) / Rs);
+    double dg_dR = -N / R / tan_alpha;
+    double sum = 0.;
+    int ii;
+    for (ii = 0; ii < nCs; ii++) {
+        double n = ii + 1.;
+        double HNn = H * N * n;
+        double K = n * N / R / sin_alpha;
+        double HNn_R_sina = HNn / R / sin_alpha;
+        double B = HNn_R_sina * (0.4 * HNn_R_sina + 1.);
+        double D = (0.3 * HNn * HNn / sin_alpha / R + HNn + R * sin_alpha) / (0.3 * HNn + R * sin_alpha);
+        double zKB = z * K / B;
+        double log_sech = -log(cosh(zKB));
+        double sechB = exp(B * log_sech);
+        if (Cs[ii] != 0.) {
+            switch (quantity) {
+            case SPIRAL_POTENTIAL:
+                sum += Cs[ii] / K / D * cos_ng * sechB;
+                break;
+            case SPIRAL_RFORCE: {
+                double dK = -n * N / R / R / sin_alpha;
+                double dB = -HNn / R / R / R / sin_alpha / sin_alpha * (0.8 * HNn + R * sin_alpha);
+                double dD = HNn_R_sina * (0.3 * (HNn_R_sina + 0.3 * HNn_R_sina * HNn_R_sina + 1.) / R
+                                          / ((0.3 * HNn_R_sina + 1.) * (0.3 * HNn_R_sina + 1.))
+                                          - (1. / R * (1. + 0.6 * HNn_R_sina) / (0.3 * HNn_R_sina + 1.)));
+                sum += Cs[ii] * sechB / D * ((n * dg_dR / K * sin_ng
+                                              + cos_ng * (z * tanh(zKB) * (dK / K - dB / B)
+                                                          - dB / K * log_sech
+                                                          + dK / K / K
+                                                          + dD / D / K))
+                                             + cos_ng / K / Rs);
+                break;
+            }
+            case SPIRAL_ZFORCE:
+                sum += Cs[ii] / D * cos_ng * tanh(zKB) * sechB;
+                break;
+            case SPIRAL_PHIFORCE:
+                sum += N * n * Cs[ii] / D / K * sechB * sin_ng;
+                break;
+            case SPIRAL_DENS: {
+                double KH = K * H;
+                double sech = 1. / cosh(zKB);
+                double tanh_zKB = tanh(zKB);
+                /* E and rE' as defined in the appendix of the paper */
+                double E = 1. + KH / D * (1. - 0.3 / ((1. + 0.3 * KH) * (1. + 0.3 * KH))) - R / Rs
+                    - KH * (1. + 0.8 * KH) * log_sech
+                    - 0.4 * KH * KH * zKB * tanh_zKB;
+                double rE = -KH / D * (1. - 0.3 * (1. - 0.3 * KH) / ((1. + 0.3 * KH) * (1. + 0.3 * KH) * (1. + 0.3 * KH)))
+                    + (KH / D * (1. - 0.3 / ((1. + 0.3 * KH) * (1. + 0.3 * KH)))) - R / Rs
+                    + KH * (1. + 1.6 * KH) * log_sech
+                    - (0.4 * KH * KH * zKB * sech) * (0.4 * KH * KH * zKB * sech) / B
+                    + 1.2 * KH * KH * zKB * tanh_zKB;
+                sum += Cs[ii] * rho0 * (H / (D * R)) * expR * sechB
+                    * (cos_ng * (K * R * (B + 1.) / B * sech * sech - 1. / K / R * (E * E + rE))
+                       - 2. * sin_ng * E * cos(alpha));
+                break;
+            }
+            }
+        }
+        /* cos((n+1) g) and sin((n+1) g) */
+        tmp = cos_ng * cos_g - sin_ng * sin_g;
+        sin_ng = sin_ng * cos_g + cos_ng * sin_g;
+        cos_ng = tmp;
+    }
+    if (quantity == SPIRAL_DENS)
+        return amp * sum;
+    return -amp * H * expR * sum;
+}
+
+void spiral_eval(int quantity, long n, const double *R, const double *z, const double *phi, const double *t,
+                 const double *args, int nCs, const double *Cs, double *out)
+{
+    long ii;
+    for (ii = 0; ii < n; ii++)
+        out[ii] = spiral_point(quantity, R[ii], z[ii], phi[ii], t[ii], args, nCs, Cs);
+}
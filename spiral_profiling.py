@@ -0,0 +1,178 @@
+###############################################################################
+#  spiral_profiling.py: opt-in call counting and timing for SpiralArmsPotential
+#                       (and any other galpy potential evaluated alongside it)
+#
+#  Methods are wrapped on the *instance* only while a profiler is attached, so
+#  the class (and every other instance) runs the original code with no
+#  overhead when profiling is disabled.
+#
+#  NOTE: only Python-side evaluations are visible. Orbit integrations that use
+#        the C extension (e.g. method='dopr54_c') evaluate the potential inside
+#        galpy's C code, which exposes no call counters.
+###############################################################################
+
+from __future__ import division
+from functools import wraps
+from timeit import default_timer
+import numpy as np
+
+# public and private evaluation methods of galpy potentials
+_METHODS = ['_call_nodecorator', 'Rforce', 'zforce', 'phiforce', 'phitorque', 'dens',
+            'R2deriv', 'z2deriv', 'phi2deriv', 'Rzderiv', 'Rphideriv',
+            '_evaluate', '_Rforce', '_zforce', '_phiforce', '_phitorque', '_dens',
+            '_R2deriv', '_z2deriv', '_phi2deriv', '_Rzderiv', '_Rphideriv']
+
+# internal helpers of SpiralArmsPotential
+_HELPERS = ['_gamma', '_dgamma_dR', '_K', '_dK_dR', '_B', '_dB_dR', '_D', '_dD_dR']
+
+
+class SpiralArmsProfiler(object):
+    """Count calls and accumulate time spent in the methods of one or more potentials.
+
+    Usage::
+
+        prof = SpiralArmsProfiler()
+        with prof.instrument([sp] + MWPotential2014):
+            o.integrate(ts, [sp] + MWPotential2014, method='odeint')
+        print(prof.summary())
+        prof.dump_flamegraph('spiral.folded')
+    """
+
+    def __init__(self, methods=None, helpers=None):
+        """
+        NAME:
+            __init__
+        PURPOSE:
+            initialize a profiler
+        INPUT:
+            :methods: names of the evaluation methods to wrap (default: all galpy evaluation methods)
+            :helpers: names of helper methods to wrap (default: the SpiralArmsPotential helpers
+                      _gamma, _dgamma_dR, _K, _dK_dR, _B, _dB_dR, _D, _dD_dR)
+        OUTPUT:
+            (none)
+        """
+        self._methods = list(_METHODS if methods is None else methods)
+        self._helpers = list(_HELPERS if helpers is None else helpers)
+        self._attached = []  # (potential, [wrapped attribute names])
+        self.reset()
+
+    def reset(self):
+        """Discard all accumulated counts and timings."""
+        self._stats = {}    # name -> [ncalls, tottime, cumtime]
+        self._stacks = {}   # 'a;b;c' -> [ncalls, tottime]
+        self._stack = []
+        self._children = []
+
+    def instrument(self, pot):
+        """
+        NAME:
+            instrument
+        PURPOSE:
+            start recording calls to the methods of a potential or list of potentials
+        INPUT:
+            :pot: Potential instance or list thereof
+        OUTPUT:
+            :return: self, so that it can be used as a context manager that detaches on exit
+        """
+        for p in (pot if isinstance(pot, (list, tuple)) else [pot]):
+            if any(p is q for q, _ in self._attached):
+                continue
+            label = type(p).__name__
+            names = []
+            for name in self._methods + self._helpers:
+                if not hasattr(type(p), name) or name in p.__dict__:
+                    continue
+                setattr(p, name, self._wrap('{}.{}'.format(label, name.replace('_call_nodecorator', '__call__')),
+                                            getattr(p, name)))
+                names.append(name)
+            self._attached.append((p, names))
+        return self
+
+    def release(self):
+        """Detach from all instrumented potentials, restoring the original methods."""
+        for p, names in self._attached:
+            for name in names:
+                p.__dict__.pop(name, None)
+        self._attached = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+    def _wrap(self, label, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            self._stack.append(label)
+            self._children.append(0.)
+            start = default_timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = default_timer() - start
+                own = elapsed - self._children.pop()
+                if self._children:
+                    self._children[-1] += elapsed
+                key = ';'.join(self._stack)
+                self._stack.pop()
+                stats = self._stats.setdefault(label, [0, 0., 0.])
+                stats[0] += 1
+                stats[1] += own
+                if label not in self._stack:  # don't double count recursive calls
+                    stats[2] += elapsed
+                path = self._stacks.setdefault(key, [0, 0.])
+                path[0] += 1
+                path[1] += own
+
+        return wrapper
+
+    def stats(self):
+        """
+        NAME:
+            stats
+        PURPOSE:
+            return the accumulated statistics
+        INPUT:
+            (none)
+        OUTPUT:
+            :return: dictionary mapping 'Class.method' to (ncalls, tottime, cumtime), where tottime
+                     excludes and cumtime includes the time spent in instrumented callees (seconds)
+        """
+        return dict((name, tuple(s)) for name, s in self._stats.items())
+
+    def summary(self, sort='tottime'):
+        """
+        NAME:
+            summary
+        PURPOSE:
+            format the statistics as a table, similar to the output of cProfile
+        INPUT:
+            :sort: column to sort on ('ncalls', 'tottime' or 'cumtime')
+        OUTPUT:
+            :return: string
+        """
+        column = {'ncalls': 0, 'tottime': 1, 'cumtime': 2}[sort]
+        rows = sorted(self.stats().items(), key=lambda item: item[1][column], reverse=True)
+        width = max([len('method')] + [len(name) for name, _ in rows])
+        lines = ['{:<{w}} {:>10} {:>12} {:>12} {:>12}'.format('method', 'ncalls', 'tottime', 'percall', 'cumtime', w=width)]
+        for name, (ncalls, tottime, cumtime) in rows:
+            lines.append('{:<{w}} {:>10d} {:>12.6f} {:>12.3e} {:>12.6f}'.format(name, ncalls, tottime, tottime / ncalls,
+                                                                               cumtime, w=width))
+        return '\n'.join(lines)
+
+    def dump_flamegraph(self, filename):
+        """
+        NAME:
+            dump_flamegraph
+        PURPOSE:
+            write the call stacks in the 'folded' format read by flamegraph.pl and speedscope
+        INPUT:
+            :filename: output file
+        OUTPUT:
+            (none); each line is 'outer;inner;innermost <exclusive time in microseconds>'
+        """
+        with open(filename, 'w') as f:
+            for key in sorted(self._stacks):
+                f.write('{} {:d}\n'.format(key, int(np.round(self._stacks[key][1] * 1e6))))
@@ -0,0 +1,478 @@
+###############################################################################
+#  spiral_server.py: local evaluation service for SpiralArmsPotential
+#
+#  Notebooks and dashboards that ask for the potential, forces or density
+#  of a spiral at a few points at a time pay the Python dispatch, potential
+#  setup and unit conversion on every call. SpiralServer keeps warm
+#  (vectorized) potential instances for the parameter sets it has seen and
+#  coalesces the requests for the same parameter set, quantity and unit
+#  system that arrive while an event-loop iteration (or delay seconds) is
+#  pending into a single call of spiral_grid.evaluate. Whole grids
+#  (spiral_grid.evaluate_xy and evaluate_Rz) are cached, and concurrent
+#  requests for the same grid share one evaluation.
+#
+#  The server is used in-process (await server.evaluate(...)) or over a Unix
+#  socket or localhost TCP with SpiralClient, speaking newline-delimited
+#  JSON:
+#
+#      {"id": 0, "op": "evaluate", "params": {"N": 2, "Cs": [1.]}, "R": [1., 2.], "z": 0.1}
+#      {"id": 0, "result": [-0.003, -0.001]}
+#
+#  Quantity parameters travel as {"value": 12., "unit": "deg"}. Potentials
+#  are cached by their parameters, but batches and grids are identified by
+#  the internal parameters of the constructed potential, so that parameters
+#  in different units can neither be confused nor kept apart.
+#
+#  metrics() reports the batching, latency and throughput statistics.
+###############################################################################
+
+from __future__ import division
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from spiral_arms_fast import FastSpiralArmsPotential
+import spiral_grid
+import asyncio
+import itertools
+import json
+import time
+import numpy as np
+try:
+    from astropy import units
+    _APY_LOADED = True
+except ImportError:
+    _APY_LOADED = False
+
+_GRIDS = {'xy': spiral_grid.evaluate_xy, 'Rz': spiral_grid.evaluate_Rz}
+
+_LIMIT = 2**26  # longest line (request or response) in bytes
+
+
+def _tolist(x):
+    """Make numpy arrays and numbers, and Quantities (as {'value': ..., 'unit': ...}), JSON serializable."""
+    if _APY_LOADED and isinstance(x, units.Quantity):
+        return {'value': x.value.tolist(), 'unit': x.unit.to_string()}
+    return np.asarray(x).tolist()
+
+
+def _encode(message):
+    return (json.dumps(message, default=_tolist) + '\n').encode()
+
+
+def _decode_params(params):
+    """Turn the Quantities in a dictionary of parameters decoded from JSON back into Quantity objects."""
+    out = {}
+    for name, value in params.items():
+        if isinstance(value, dict) and set(value) == {'value', 'unit'}:
+            if not _APY_LOADED:
+                raise ValueError('astropy is needed for the Quantity parameter {}'.format(name))
+            value = units.Quantity(value['value'], value['unit'])
+        out[name] = value
+    return out
+
+
+def _key(params):
+    """Return a hashable key of a dictionary of SpiralArmsPotential parameters (Quantities keep their units)."""
+    return json.dumps(params, sort_keys=True, default=_tolist)
+
+
+def _pot_key(pot):
+    """Return a hashable key of the internal parameters of a FastSpiralArmsPotential."""
+    return (pot._amp, pot._N, pot._alpha, pot._r_ref, pot._phi_ref, pot._Rs, pot._H, tuple(pot._Cs), pot._omega,
+            pot._tform, pot._tsteady, pot._ro, pot._vo)
+
+
+class _Batch(object):
+    """Requests for one parameter set, quantity and unit system waiting to be evaluated together."""
+
+    def __init__(self, pot):
+        self.pot = pot
+        self.requests = []  # (future, coordinates, start time)
+        self.npoints = 0
+
+
+class SpiralServer(object):
+    """Evaluate SpiralArmsPotentials for many small concurrent requests in coalesced, vectorized batches."""
+
+    def __init__(self, delay=0., max_points=1000000, cache_size=32, grid_cache_size=64, nlatencies=10000):
+        """
+        NAME:
+            __init__
+        PURPOSE:
+            initialize a server
+        INPUT:
+            :delay: time in s to wait for more requests before evaluating a batch (default: 0, evaluate the
+                    requests that arrived in the same iteration of the event loop together)
+            :max_points: evaluate a batch right away once it has this many points
+            :cache_size: number of potential instances to keep
+            :grid_cache_size: number of grids to keep
+            :nlatencies: number of recent request latencies used for the latency percentiles
+        OUTPUT:
+            (none)
+        """
+        self.delay = delay
+        self.max_points = max_points
+        self.cache_size = cache_size
+        self.grid_cache_size = grid_cache_size
+        self._pots = OrderedDict()
+        self._grids = OrderedDict()
+        self._pending = {}
+        self._tasks = set()
+        self._writers = set()
+        self._handlers = set()
+        self._server = None
+        # a single worker keeps the evaluations off the event loop, one at a time
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._latencies = deque(maxlen=nlatencies)
+        self._counts = dict((name, 0) for name in ('requests', 'points', 'batches', 'errors', 'grid_requests',
+                                                   'pot_hits', 'pot_misses', 'grid_hits', 'grid_misses'))
+        self._eval_time = 0.
+        self._start = time.time()
+
+    def _potential(self, params):
+        """Return the cached FastSpiralArmsPotential for the parameters (creating it if necessary) and the key of
+        its internal parameters, which identifies batches and grids."""
+        key = _key(params)
+        if key in self._pots:
+            self._counts['pot_hits'] += 1
+            self._pots[key] = cached = self._pots.pop(key)
+            return cached
+        self._counts['pot_misses'] += 1
+        pot = FastSpiralArmsPotential(**params)
+        self._pots[key] = cached = (pot, _pot_key(pot))
+        while len(self._pots) > self.cache_size:
+            self._pots.popitem(last=False)
+        return cached
+
+    async def evaluate(self, params, R, z, phi=0., t=0., quantity='potential', physical=False):
+        """
+        NAME:
+            evaluate
+        PURPOSE:
+            evaluate the potential, a force or the density of a spiral, batched with the other pending requests
+            for the same parameters, quantity and unit system
+        INPUT:
+            :params: dictionary of keyword arguments of SpiralArmsPotential (values can be Quantity; tform and
+                     tsteady add the growth envelope of FastSpiralArmsPotential)
+            :R, z, phi, t: coordinates (broadcastable arrays)
+            :quantity: 'potential', 'Rforce', 'zforce', 'phiforce' or 'dens'
+            :physical: if True, the coordinates are in kpc and Gyr and the output is in physical units (see
+                       spiral_grid.evaluate)
+        OUTPUT:
+            :return: array with the broadcast shape of R, z, phi and t
+        """
+        start = time.time()
+        if quantity not in spiral_grid._QUANTITIES:
+            raise ValueError("quantity must be one of {}".format(sorted(spiral_grid._QUANTITIES)))
+        pot, pot_key = self._potential(params)
+        coords = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (R, z, phi, t)])
+        key = (pot_key, quantity, bool(physical))
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = _Batch(pot)
+            loop.call_later(self.delay, self._flush, key, batch)
+        batch.requests.append((future, coords, start))
+        batch.npoints += coords[0].size
+        if batch.npoints >= self.max_points:
+            self._flush(key, batch)
+        return await future
+
+    def _flush(self, key, batch):
+        """Start evaluating a batch, unless that has already happened."""
+        if self._pending.get(key) is not batch:
+            return
+        del self._pending[key]
+        task = asyncio.ensure_future(self._run(batch, key[1], key[2]))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch, quantity, physical):
+        R, z, phi, t = [np.concatenate([coords[ii].ravel() for _, coords, _ in batch.requests])
+                        for ii in range(4)]
+        start = time.time()
+        try:
+            out = await asyncio.get_event_loop().run_in_executor(
+                self._executor, partial(spiral_grid.evaluate, batch.pot, R, z, phi, t, quantity=quantity,
+                                        physical=physical))
+        except Exception as e:
+            self._counts['errors'] += len(batch.requests)
+            for future, _, _ in batch.requests:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        end = time.time()
+        self._eval_time += end - start
+        self._counts['batches'] += 1
+        self._counts['requests'] += len(batch.requests)
+        self._counts['points'] += len(R)
+        offset = 0
+        for future, coords, begin in batch.requests:
+            size = coords[0].size
+            if not future.done():
+                future.set_result(out[offset:offset + size].reshape(coords[0].shape))
+            offset += size
+            self._latencies.append(end - begin)
+
+    async def grid(self, params, kind, a, b, c=0., t=0., quantity='potential', physical=False):
+        """
+        NAME:
+            grid
+        PURPOSE:
+            evaluate a quantity on a grid, using the grid cache
+        INPUT:
+            :params: dictionary of keyword arguments of SpiralArmsPotential (values can be Quantity)
+            :kind: 'xy' (face-on grid spanned by x = a and y = b at height z = c, see spiral_grid.evaluate_xy)
+                   or 'Rz' (meridional grid spanned by R = a and z = b at azimuth phi = c, see
+                   spiral_grid.evaluate_Rz)
+            :a, b: 1D arrays of grid coordinates
+            :c, t: the third coordinate and the time (scalars)
+            :quantity, physical: see evaluate
+        OUTPUT:
+            :return: read-only array of shape (len(a), len(b))
+        """
+        if kind not in _GRIDS:
+            raise ValueError("kind must be one of {}".format(sorted(_GRIDS)))
+        self._counts['grid_requests'] += 1
+        a = np.asarray(a, dtype=float).ravel()
+        b = np.asarray(b, dtype=float).ravel()
+        pot, pot_key = self._potential(params)
+        key = (pot_key, kind, quantity, bool(physical), a.tobytes(), b.tobytes(), float(c), float(t))
+        task = self._grids.get(key)
+        if task is not None:
+            self._counts['grid_hits'] += 1
+            self._grids[key] = self._grids.pop(key)
+        else:
+            self._counts['grid_misses'] += 1
+            # the task is cached right away, so that concurrent requests for the same grid share it
+            task = asyncio.ensure_future(asyncio.get_event_loop().run_in_executor(
+                self._executor, partial(_GRIDS[kind], pot, a, b, c, t, quantity=quantity, physical=physical)))
+            self._grids[key] = task
+            while len(self._grids) > self.grid_cache_size:
+                self._grids.popitem(last=False)
+        try:
+            out = await asyncio.shield(task)
+        except Exception:
+            if self._grids.get(key) is task:
+                del self._grids[key]
+            self._counts['errors'] += 1
+            raise
+        out.setflags(write=False)
+        return out
+
+    def metrics(self):
+        """
+        NAME:
+            metrics
+        PURPOSE:
+            return the statistics of the server
+        INPUT:
+            (none)
+        OUTPUT:
+            :return: dictionary with the numbers of evaluated requests, points and batches, failed requests,
+                     grid requests and cache hits and misses, the mean number of requests and points per batch,
+                     the request and point throughput (per s since the server was created), the time spent
+                     evaluating (s) and the 50th, 90th and 99th percentile of the recent request latencies (s)
+        """
+        out = dict(self._counts)
+        elapsed = time.time() - self._start
+        batches = max(out['batches'], 1)
+        out.update(requests_per_batch=out['requests'] / batches,
+                   points_per_batch=out['points'] / batches,
+                   requests_per_s=out['requests'] / elapsed,
+                   points_per_s=out['points'] / elapsed,
+                   eval_time=self._eval_time,
+                   uptime=elapsed)
+        latencies = np.array(self._latencies)
+        for p in (50, 90, 99):
+            out['latency_p{}'.format(p)] = float(np.percentile(latencies, p)) if len(latencies) else None
+        return out
+
+    async def start(self, path=None, host='127.0.0.1', port=0):
+        """
+        NAME:
+            start
+        PURPOSE:
+            start serving clients on a Unix socket (if path is given) or on localhost TCP
+        INPUT:
+            :path: path of the Unix socket
+            :host, port: address to listen on for TCP (port=0 picks a free port)
+        OUTPUT:
+            :return: the address the server listens on (path, or (host, port))
+        """
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, path=path, limit=_LIMIT)
+        else:
+            self._server = await asyncio.start_server(self._handle, host, port, limit=_LIMIT)
+        return self._server.sockets[0].getsockname()
+
+    async def close(self):
+        """Stop serving, disconnect the clients and wait for the running evaluations."""
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._handlers:
+            await asyncio.gather(*self._handlers, return_exceptions=True)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _handle(self, reader, writer):
+        """Answer the requests of one connection, concurrently, so that they can be batched with each other."""
+        handler = asyncio.current_task()
+        self._handlers.add(handler)
+        self._writers.add(writer)
+        lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.ensure_future(self._respond(line, writer, lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (ConnectionError, ValueError):  # disconnected, or a line longer than _LIMIT
+            pass
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            self._writers.discard(writer)
+            self._handlers.discard(handler)
+            writer.close()
+
+    async def _respond(self, line, writer, lock):
+        rid = None
+        try:
+            request = json.loads(line)
+            rid = request.get('id')
+            op = request.get('op', 'evaluate')
+            if op in ('evaluate', 'grid'):
+                params = _decode_params(request['params'])
+            if op == 'evaluate':
+                result = await self.evaluate(params, request['R'], request['z'], request.get('phi', 0.),
+                                             request.get('t', 0.), quantity=request.get('quantity', 'potential'),
+                                             physical=request.get('physical', False))
+            elif op == 'grid':
+                result = await self.grid(params, request['kind'], request['a'], request['b'],
+                                         request.get('c', 0.), request.get('t', 0.),
+                                         quantity=request.get('quantity', 'potential'),
+                                         physical=request.get('physical', False))
+            elif op == 'metrics':
+                result = self.metrics()
+            else:
+                raise ValueError("unknown op {}".format(op))
+            response = {'id': rid, 'result': result}
+        except Exception as e:
+            response = {'id': rid, 'error': '{}: {}'.format(type(e).__name__, e)}
+        async with lock:
+            writer.write(_encode(response))
+            await writer.drain()
+
+
+class SpiralClient(object):
+    """Client of a SpiralServer; concurrent requests are sent over one connection without waiting for each other."""
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._futures = {}
+        self._ids = itertools.count()
+        self._listener = asyncio.ensure_future(self._listen())
+
+    @classmethod
+    async def connect(cls, path=None, host='127.0.0.1', port=None):
+        """
+        NAME:
+            connect
+        PURPOSE:
+            connect to a SpiralServer
+        INPUT:
+            :path: path of the Unix socket
+            :host, port: TCP address, if path is not given
+        OUTPUT:
+            :return: SpiralClient
+        """
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path, limit=_LIMIT)
+        else:
+            reader, writer = await asyncio.open_connection(host, port, limit=_LIMIT)
+        return cls(reader, writer)
+
+    async def _listen(self):
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self._futures.pop(response['id'], None)
+                if future is None or future.done():
+                    continue
+                if 'error' in response:
+                    future.set_exception(ValueError(response['error']))
+                else:
+                    future.set_result(response['result'])
+        except ConnectionError:
+            pass
+        finally:
+            for future in self._futures.values():
+                if not future.done():
+                    future.set_exception(ConnectionError('connection to the server closed'))
+            self._futures.clear()
+
+    async def _request(self, **request):
+        if self._listener.done():
+            raise ConnectionError('connection to the server closed')
+        request['id'] = rid = next(self._ids)
+        future = asyncio.get_event_loop().create_future()
+        self._futures[rid] = future
+        self._writer.write(_encode(request))
+        await self._writer.drain()
+        return await future
+
+    async def evaluate(self, params, R, z, phi=0., t=0., quantity='potential', physical=False):
+        """
+        NAME:
+            evaluate
+        PURPOSE:
+            evaluate the potential, a force or the density of a spiral (see SpiralServer.evaluate)
+        INPUT:
+            :params: dictionary of keyword arguments of SpiralArmsPotential (values can be Quantity)
+            :R, z, phi, t: coordinates (broadcastable arrays; plain numbers, no Quantity)
+            :quantity, physical: see SpiralServer.evaluate
+        OUTPUT:
+            :return: array with the broadcast shape of R, z, phi and t
+        """
+        return np.array(await self._request(op='evaluate', params=params, R=R, z=z, phi=phi, t=t,
+                                            quantity=quantity, physical=physical))
+
+    async def grid(self, params, kind, a, b, c=0., t=0., quantity='potential', physical=False):
+        """
+        NAME:
+            grid
+        PURPOSE:
+            evaluate a quantity on a grid (see SpiralServer.grid)
+        INPUT:
+            :params, kind, a, b, c, t, quantity, physical: see SpiralServer.grid
+        OUTPUT:
+            :return: array of shape (len(a), len(b))
+        """
+        return np.array(await self._request(op='grid', params=params, kind=kind, a=a, b=b, c=c, t=t,
+                                            quantity=quantity, physical=physical))
+
+    async def metrics(self):
+        """Return the statistics of the server (see SpiralServer.metrics)."""
+        return await self._request(op='metrics')
+
+    async def close(self):
+        """Close the connection."""
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
+        await self._listener
@@ -0,0 +1,142 @@
+###############################################################################
+#  spiral_threads.py: multithreaded evaluation of SpiralArmsPotential on
+#                     large arrays of points
+#
+#  The points are split into disjoint slices of one shared output array and
+#  a thread pool fills the slices with the compiled kernel in
+#  spiral_kernel.c. ctypes releases the GIL while the kernel runs, so the
+#  threads run in parallel without copying the inputs or the output per
+#  worker. The kernel is compiled with the system C compiler (cc, or $CC)
+#  the first time it is needed; when that is not possible, the slices are
+#  evaluated with the numpy kernels of FastSpiralArmsPotential instead.
+###############################################################################
+
+from __future__ import division
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from spiral_arms_fast import FastSpiralArmsPotential
+import ctypes
+import hashlib
+import os
+import subprocess
+import tempfile
+import numpy as np
+
+_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spiral_kernel.c')
+
+# quantity -> (code in spiral_kernel.c, method of FastSpiralArmsPotential without the amplitude)
+_QUANTITIES = {'potential': (0, '_evaluate'),
+               'Rforce': (1, '_Rforce'),
+               'zforce': (2, '_zforce'),
+               'phiforce': (3, '_phiforce'),
+               'dens': (4, '_dens')}
+
+_LIB = []  # the loaded library (None if it cannot be built), once _load has been called
+
+
+def _build(filename):
+    """Compile spiral_kernel.c into the shared library filename."""
+    tmp = '{}.{}.tmp'.format(filename, os.getpid())
+    subprocess.check_call([os.environ.get('CC', 'cc'), '-O3', '-fPIC', '-shared', '-o', tmp, _SOURCE, '-lm'],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    os.rename(tmp, filename)  # atomic, so that concurrent builds do not load half-written files
+
+
+def _load():
+    """Return the compiled kernel, building it if necessary, or None if it cannot be built."""
+    if _LIB:
+        return _LIB[0]
+    lib = None
+    try:
+        with open(_SOURCE, 'rb') as f:
+            name = '_spiral_kernel_{}.so'.format(hashlib.sha1(f.read()).hexdigest()[:12])
+        for directory in (os.path.dirname(_SOURCE), tempfile.gettempdir()):
+            filename = os.path.join(directory, name)
+            try:
+                if not os.path.exists(filename):
+                    _build(filename)
+                lib = ctypes.CDLL(filename)
+                break
+            except (OSError, subprocess.CalledProcessError):
+                continue
+    except (IOError, OSError):
+        pass
+    if lib is not None:
+        array = np.ctypeslib.ndpointer(dtype=np.float64, flags='C_CONTIGUOUS')
+        lib.spiral_eval.restype = None
+        lib.spiral_eval.argtypes = [ctypes.c_int, ctypes.c_long, array, array, array, array,
+                                    array, ctypes.c_int, array, array]
+    _LIB.append(lib)
+    return lib
+
+
+def kernel_available():
+    """Return True if the compiled kernel can be used."""
+    return _load() is not None
+
+
+def evaluate_threaded(pot, R, z, phi=0., t=0., quantity='potential', nthreads=None, out=None, use_c=True):
+    """
+    NAME:
+        evaluate_threaded
+    PURPOSE:
+        evaluate the potential, a force or the density of a SpiralArmsPotential for large arrays of points
+        with a pool of threads
+    INPUT:
+        :pot: SpiralArmsPotential (or FastSpiralArmsPotential, or a SpiralArmsPotential wrapped in
+              DehnenSmoothWrapperPotential)
+        :R, z, phi, t: coordinates in internal units (broadcastable arrays)
+        :quantity: 'potential', 'Rforce', 'zforce', 'phiforce' or 'dens'
+        :nthreads: number of threads (default: number of CPUs)
+        :out: optional C-contiguous float64 array with the broadcast shape of the coordinates to write into
+        :use_c: if False, always use the numpy kernels
+    OUTPUT:
+        :return: array with the broadcast shape of R, z, phi and t (out, if given)
+    """
+    if quantity not in _QUANTITIES:
+        raise ValueError("quantity must be one of {}".format(sorted(_QUANTITIES)))
+    code, method = _QUANTITIES[quantity]
+    fp = FastSpiralArmsPotential.from_potential(pot)
+    coords = np.broadcast_arrays(*[np.asarray(x, dtype=np.float64) for x in (R, z, phi, t)])
+    shape = coords[0].shape
+    R, z, phi, t = [np.ascontiguousarray(x).ravel() for x in coords]
+    if out is None:
+        out = np.empty(shape)
+    elif out.shape != shape or out.dtype != np.float64 or not out.flags.c_contiguous:
+        raise ValueError("out must be a C-contiguous float64 array of shape {}".format(shape))
+    flat = out.reshape(-1)  # a view, so that the threads write into out
+    lib = _load() if use_c else None
+    if lib is not None:
+        args = np.array([fp._amp, fp._N, fp._alpha, fp._sin_alpha, fp._tan_alpha, fp._r_ref, fp._phi_ref,
+                         fp._Rs, fp._H, fp._omega, fp._rho0], dtype=np.float64)
+        Cs = np.ascontiguousarray(fp._Cs0, dtype=np.float64)
+        if Cs.ndim != 1:  # the kernel reads len(Cs) doubles
+            raise ValueError('the Cs of the potential must be a 1D array')
+    if nthreads is None:
+        nthreads = cpu_count()
+    # a few slices per thread balance the load when the threads are not scheduled evenly
+    nslices = max(1, min(4 * nthreads, len(flat) // 1024))
+    bounds = np.linspace(0, len(flat), nslices + 1).astype(int)
+
+    def work(ii):
+        sl = slice(bounds[ii], bounds[ii + 1])
+        if lib is None:
+            # the numpy kernels include the growth envelope
+            flat[sl] = fp._amp * getattr(fp, method)(R[sl], z[sl], phi[sl], t[sl])
+            return
+        lib.spiral_eval(code, bounds[ii + 1] - bounds[ii], R[sl], z[sl], phi[sl], t[sl], args, len(Cs), Cs,
+                        flat[sl])
+        if fp._tform is not None:
+            flat[sl] *= fp._envelope(t[sl])
+
+    if nthreads == 1 or nslices == 1:
+        for ii in range(nslices):
+            work(ii)
+    else:
+        pool = ThreadPool(nthreads)
+        try:
+            pool.map(work, range(nslices))
+        finally:
+            pool.close()
+            pool.join()
+    return out
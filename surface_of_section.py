@@ -0,0 +1,149 @@
+###############################################################################
+#  surface_of_section.py: Poincare surfaces of section in the frame rotating
+#                         with the pattern
+#
+#  A crossing of the section phi - OmegaP t = phi0 (mod 2 pi) is detected
+#  between two output times of an integrated orbit and located with a cubic
+#  Hermite interpolant of the dense output: the time derivatives of all
+#  coordinates follow from the phase-space coordinates and the forces at the
+#  two output times, so the crossings are accurate to the order of the cubic
+#  interpolant even for coarse output.
+#
+#  The output must still be dense enough for the azimuth to be followed from
+#  one output to the next: the azimuth may advance by less than pi per step
+#  (the continuous azimuth is reconstructed with np.unwrap), and the azimuth
+#  in the rotating frame by less than 2 pi (more than one crossing in a step
+#  cannot be resolved). Steps that look undersampled, judging from the
+#  angular velocities vT/R at the outputs, are counted per orbit and warned
+#  about rather than silently missing crossings.
+#
+#  section_chunks only keeps the crossings of every chunk, but the chunk's
+#  trajectories, (chunk, nt, 6) floats, are materialized before they are
+#  reduced, so chunk bounds the memory used for long integrations.
+###############################################################################
+
+from __future__ import division
+from orbit_batches import integrate_chunks
+from orbit_diagnostics import pattern_speed
+from spiral_grid import evaluate
+from galpy.util import galpyWarning
+import warnings
+import numpy as np
+
+SECTION_COORDS = ('t', 'R', 'vR', 'vT', 'z', 'vz')
+
+
+def _derivatives(pot, R, vR, vT, z, vz, phi, t):
+    """Return the time derivatives of (R, vR, vT, z, vz, phi)."""
+    FR = evaluate(pot, R, z, phi, t, quantity='Rforce')
+    Fz = evaluate(pot, R, z, phi, t, quantity='zforce')
+    Fphi = evaluate(pot, R, z, phi, t, quantity='phiforce')
+    return vR, vT**2 / R + FR, -vR * vT / R + Fphi / R, vz, Fz, vT / R
+
+
+def _hermite(s, h, p0, p1, m0, m1):
+    """Evaluate the cubic Hermite interpolant at s in [0, 1] of a step h."""
+    s2 = s * s
+    s3 = s2 * s
+    return (2 * s3 - 3 * s2 + 1) * p0 + (s3 - 2 * s2 + s) * h * m0 + (-2 * s3 + 3 * s2) * p1 + (s3 - s2) * h * m1
+
+
+def crossings(orbits, ts, pot, OmegaP=None, phi0=0., direction=1, vRsign=None):
+    """
+    NAME:
+        crossings
+    PURPOSE:
+        find the crossings of integrated orbits through the surface of section phi - OmegaP t = phi0
+    INPUT:
+        :orbits: array of shape (norb, nt, 6) with [R, vR, vT, z, vz, phi] or (norb, nt, 4) with [R, vR, vT, phi]
+        :ts: output times (nt)
+        :pot: Potential instance or list thereof the orbits were integrated in (for the interpolation)
+        :OmegaP: pattern speed of the rotating frame (default: that of the potential)
+        :phi0: azimuth of the section in the rotating frame
+        :direction: 1 (-1) to only keep crossings in the direction of increasing (decreasing) phi - OmegaP t,
+                    0 to keep both
+        :vRsign: if 1 (-1), only keep crossings with vR > 0 (vR < 0)
+    OUTPUT:
+        :return: dictionary with flat arrays 'orbit' (index of the orbit), 't', 'R', 'vR', 'vT', 'z' and 'vz'
+                 of the crossings, ordered by orbit and time, and 'offsets' (norb+1) such that the crossings
+                 of orbit i are [offsets[i]:offsets[i+1]], and 'undersampled' (norb), the number of steps of
+                 every orbit in which crossings may have been missed (see the note at the top of this module)
+    """
+    orbits = np.asarray(orbits)
+    if orbits.ndim == 2:
+        orbits = orbits[None]
+    ts = np.asarray(ts, dtype=float)
+    if OmegaP is None:
+        OmegaP = pattern_speed(pot)
+    norb = len(orbits)
+    if orbits.shape[-1] == 4:
+        zero = np.zeros(orbits.shape[:-1])
+        orbits = np.stack([orbits[..., 0], orbits[..., 1], orbits[..., 2], zero, zero, orbits[..., 3]], axis=-1)
+
+    # number of turns through the section, from the continuous azimuth in the rotating frame
+    phi = np.unwrap(orbits[..., 5], axis=-1)
+    phirot = phi - OmegaP * ts - phi0
+    # the advance of the azimuth per step expected from the angular velocities at the outputs, against
+    # the advance after unwrapping (off by multiples of 2 pi if the azimuth advanced by more than pi)
+    Omega = orbits[..., 2] / orbits[..., 0]
+    advance = (Omega[:, 1:] + Omega[:, :-1]) / 2 * np.diff(ts)
+    undersampled = np.sum((np.fabs(advance - OmegaP * np.diff(ts)) >= 2 * np.pi)
+                          | (np.fabs(advance - np.diff(phi, axis=-1)) >= np.pi), axis=-1)
+    if np.any(undersampled):
+        warnings.warn('{} steps of the output are too coarse to follow the azimuth, crossings may have been '
+                      'missed; use denser output times'.format(np.sum(undersampled)), galpyWarning)
+    turn = np.floor(phirot / 2 / np.pi)
+    dturn = np.diff(turn, axis=-1)
+    keep = dturn != 0
+    if direction != 0:
+        keep &= np.sign(dturn) == direction
+    iorb, istep = np.nonzero(keep)
+
+    # the section in the coordinates of the bracketing outputs
+    target = 2 * np.pi * np.maximum(turn[iorb, istep], turn[iorb, istep + 1])
+    g0 = phirot[iorb, istep] - target
+    g1 = phirot[iorb, istep + 1] - target
+    x0 = orbits[iorb, istep]
+    x1 = orbits[iorb, istep + 1]
+    t0 = ts[istep]
+    h = ts[istep + 1] - t0
+    m0 = _derivatives(pot, *(tuple(x0.T) + (t0,)))
+    m1 = _derivatives(pot, *(tuple(x1.T) + (t0 + h,)))
+    dg0 = m0[5] - OmegaP
+    dg1 = m1[5] - OmegaP
+
+    # Newton iterations on the Hermite interpolant of the section, from the linear estimate
+    s = g0 / (g0 - g1)
+    for _ in range(6):
+        s2 = s * s
+        g = _hermite(s, h, g0, g1, dg0, dg1)
+        dg = (6 * s2 - 6 * s) * g0 + (3 * s2 - 4 * s + 1) * h * dg0 + (-6 * s2 + 6 * s) * g1 + (3 * s2 - 2 * s) * h * dg1
+        s = np.clip(s - g / np.where(dg != 0, dg, 1.), 0., 1.)
+
+    out = {'orbit': iorb, 't': t0 + s * h}
+    for ii, name in enumerate(SECTION_COORDS[1:]):
+        out[name] = _hermite(s, h, x0[:, ii], x1[:, ii], m0[ii], m1[ii])
+    if vRsign is not None:
+        sel = np.sign(out['vR']) == vRsign
+        out = dict((name, out[name][sel]) for name in out)
+    out['offsets'] = np.concatenate([[0], np.cumsum(np.bincount(out['orbit'], minlength=norb))])
+    out['undersampled'] = undersampled
+    return out
+
+
+def section_chunks(vxvv, pot, ts, chunk=1000, OmegaP=None, phi0=0., direction=1, vRsign=None,
+                   method='symplec4_c', numcores=1):
+    """
+    NAME:
+        section_chunks
+    PURPOSE:
+        integrate initial conditions chunk by chunk and only keep the crossings through a surface of section
+    INPUT:
+        :vxvv, pot, ts, chunk, method, numcores: see orbit_batches.integrate_chunks
+        :OmegaP, phi0, direction, vRsign: see crossings
+    OUTPUT:
+        :return: generator yielding (initial conditions, crossings) for every chunk, with 'orbit' indexing
+                 the initial conditions of the chunk
+    """
+    for batch, orbits in integrate_chunks(vxvv, pot, ts, chunk=chunk, method=method, numcores=numcores):
+        yield batch, crossings(orbits, ts, pot, OmegaP=OmegaP, phi0=phi0, direction=direction, vRsign=vRsign)
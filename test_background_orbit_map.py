@@ -0,0 +1,75 @@
+from __future__ import division
+from galpy.orbit import Orbit
+from galpy.potential import MWPotential2014, DehnenSmoothWrapperPotential, LogarithmicHaloPotential, \
+    MiyamotoNagaiPotential
+from background_orbit_map import background_map, OrbitPropertyMap, _key
+from orbit_batches import integrate_batch
+from orbit_diagnostics import orbit_properties
+import numpy as np
+from numpy.testing import assert_allclose
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestBackgroundOrbitMap(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def test_orbit_properties(self):
+        """Test that the orbital properties of a batch agree with those of galpy Orbits."""
+        mp = list(MWPotential2014)
+        ts = np.linspace(0, 20, 501)
+        vxvv = np.array([[1., 0.1, 1.1, 0.05, 0.02, 0.], [0.8, -0.2, 0.9, 0., 0.1, 1.]])
+        rperi, rap, e, zmax = orbit_properties(integrate_batch(vxvv, mp, ts))
+        for ii in range(2):
+            o = Orbit(vxvv=list(vxvv[ii]))
+            o.integrate(ts, mp, method='symplec4_c')
+            assert_allclose([rperi[ii], rap[ii], e[ii], zmax[ii]], [o.rperi(), o.rap(), o.e(), o.zmax()])
+
+    def test_map(self):
+        """Test the map at and between grid points, and its disk cache."""
+        mp = list(MWPotential2014)
+        vRs = np.linspace(-0.2, 0.2, 3)
+        vTs = np.linspace(0.9, 1.1, 3)
+        ts = np.linspace(0, 30, 601)
+        pmap = background_map(mp, 1., vRs, vTs, 0.05, ts=ts, cachedir=self.cachedir)
+        vxvv = np.array([[1., vRs[1], vTs[2], 0.05, 0., 0.]])
+        rperi, rap, e, zmax = orbit_properties(integrate_batch(vxvv, mp, ts))
+        out = pmap(1., vRs[1], vTs[2], 0.05)
+        assert_allclose([out['rperi'], out['rap'], out['e'], out['zmax']], [rperi, rap, e, zmax], rtol=1e-10)
+        between = pmap(1., 0.05, 1.05)['rap']
+        assert np.all(np.isfinite(between))
+        assert np.isnan(pmap(1., 0.5, 1.)['rap'])
+        # second call loads the cached map
+        assert len(os.listdir(self.cachedir)) == 1
+        cached = background_map(mp, 1., vRs, vTs, 0.05, ts=ts, cachedir=self.cachedir)
+        for name in pmap.values:
+            assert_allclose(cached.values[name], pmap.values[name])
+        assert isinstance(OrbitPropertyMap.load(os.path.join(self.cachedir, os.listdir(self.cachedir)[0])),
+                          OrbitPropertyMap)
+
+    def test_key(self):
+        """Test that the cache key sees the potentials inside wrappers and lists, and refuses unhashable ones."""
+        axes = dict((name, np.zeros(1)) for name in 'R vR vT z vz'.split())
+        ts = np.linspace(0, 1, 11)
+        keys = [_key(pot, axes, ts, 'dop853_c') for pot in
+                [DehnenSmoothWrapperPotential(pot=LogarithmicHaloPotential(), tform=1.),
+                 DehnenSmoothWrapperPotential(pot=MiyamotoNagaiPotential(), tform=1.),
+                 DehnenSmoothWrapperPotential(pot=[MiyamotoNagaiPotential(), LogarithmicHaloPotential()], tform=1.),
+                 DehnenSmoothWrapperPotential(pot=[MiyamotoNagaiPotential(b=0.3)], tform=1.)]]
+        assert len(set(keys)) == 4
+        assert keys[1] == _key(DehnenSmoothWrapperPotential(pot=MiyamotoNagaiPotential(), tform=1.), axes, ts,
+                               'dop853_c')
+        pot = LogarithmicHaloPotential()
+        pot._func = lambda x: x
+        assert _key(pot, axes, ts, 'dop853_c') is None
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+from __future__ import division
+from galpy.potential import SpiralArmsPotential as spiral
+from galpy.potential import DehnenSmoothWrapperPotential, LogarithmicHaloPotential
+from backward_mapping import grow, backward_map
+from disk_sampler import DiskSampler
+import numpy as np
+from numpy.testing import assert_allclose
+import unittest
+
+
+class TestBackwardMapping(unittest.TestCase):
+
+    def setUp(self):
+        # the Shu distribution function with beta = 0 is an equilibrium of the flat rotation curve
+        self.background = [LogarithmicHaloPotential(normalize=1.)]
+        self.df = DiskSampler('shu', profileParams=(1. / 3., 1., 0.1)).df
+        self.vR = np.linspace(-0.3, 0.3, 7)
+        self.vT = np.linspace(0.7, 1.3, 5)
+
+    def test_grow(self):
+        """Test that only the non-axisymmetric components are wrapped."""
+        pot = grow([spiral()] + self.background, tform=-10.)
+        assert isinstance(pot[0], DehnenSmoothWrapperPotential)
+        assert not any(isinstance(p, DehnenSmoothWrapperPotential) for p in pot[1:])
+        assert pot[0](1., 0., phi=0.3, t=-11.) == 0.
+
+    def test_axisymmetric(self):
+        """Test that the distribution function is unchanged in an axisymmetric potential."""
+        f = backward_map(self.background, self.df, self.vR, self.vT, tback=5.)
+        vRs, vTs = np.meshgrid(self.vR, self.vT, indexing='ij')
+        assert f.shape == (7, 5)
+        assert_allclose(f, self.df(1., vRs, vTs), rtol=1e-5)
+
+    def test_spiral(self):
+        """Test that the grown spiral changes the local velocity distribution."""
+        pot = grow([spiral(amp=2., omega=1.2)] + self.background, tform=-10., tsteady=3.)
+        f = backward_map(pot, self.df, self.vR, self.vT, phi=0.5, tback=12.)
+        vRs, vTs = np.meshgrid(self.vR, self.vT, indexing='ij')
+        assert np.all(np.isfinite(f))
+        assert not np.allclose(f, self.df(1., vRs, vTs), rtol=1e-3)
+        assert_allclose(backward_map(pot, self.df, self.vR, self.vT, phi=0.5, tback=12., numcores=2), f)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+from __future__ import division
+from galpy.potential import SpiralArmsPotential as spiral
+from galpy.potential import LogarithmicHaloPotential, MWPotential2014
+from chaos_maps import log_deviation, lyapunov, megno, chaos_map
+import numpy as np
+from numpy.testing import assert_allclose
+import unittest
+
+
+class TestChaosMaps(unittest.TestCase):
+
+    def setUp(self):
+        self.ts = np.linspace(0, 300, 3001)
+        self.vxvv = np.array([[1., 0.1, 1.05, 0.], [1., 0.3, 0.8, 0.]])
+
+    def test_regular(self):
+        """Test that orbits in an axisymmetric potential are regular and that renormalizing changes nothing."""
+        pot = [LogarithmicHaloPotential(normalize=1.)]
+        logdev = log_deviation(self.vxvv, pot, self.ts, nsegments=15)
+        assert logdev.shape == (2, 3001)
+        assert_allclose(logdev, log_deviation(self.vxvv, pot, self.ts, nsegments=1), atol=1e-6)
+        assert np.all(lyapunov(logdev, self.ts) < 0.03)
+        assert_allclose(megno(logdev, self.ts), 2., atol=0.15)
+
+    def test_megno_linear(self):
+        """Test MEGNO for prescribed linear and exponential deviation growth."""
+        ts = np.linspace(0, 1000, 100001)
+        assert_allclose(megno(np.log(1 + ts), ts), 2., rtol=0.05)
+        assert_allclose(megno(np.stack([0.1 * ts, 0.2 * ts]), ts), [0.1 * 1000 / 2, 0.2 * 1000 / 2], rtol=1e-6)
+        assert_allclose(lyapunov(0.1 * ts, ts), 0.1)
+
+    def test_chaos_map(self):
+        """Test that a strong spiral makes orbits chaotic."""
+        pot = [spiral(amp=3., omega=0.9, alpha=0.3)] + list(MWPotential2014)
+        vR = np.linspace(-0.3, 0.3, 3)
+        vT = np.linspace(0.8, 1.2, 2)
+        maps = chaos_map(pot, vR, vT, ts=self.ts)
+        assert maps['megno'].shape == (3, 2)
+        assert np.all(maps['megno'] > 5.)
+        assert np.all(maps['lyapunov'] > 0.02)
+        assert_allclose(chaos_map(pot, vR, vT, ts=self.ts, numcores=2)['megno'], maps['megno'])
+
+
+if __name__ == '__main__':
+    unittest.main()
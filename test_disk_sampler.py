@@ -0,0 +1,112 @@
+from __future__ import division
+from galpy.potential import MWPotential2014
+from disk_sampler import DiskSampler, evolve_samples, load_samples
+from orbit_batches import integrate_batch, integrate_chunks
+import shutil
+import tempfile
+import numpy as np
+from numpy.testing import assert_allclose
+import unittest
+
+
+class TestDiskSampler(unittest.TestCase):
+
+    def test_shape_and_seed(self):
+        """Test the shape of the samples and their reproducibility."""
+        for dist in ['shu', 'schwarzschild']:
+            x = DiskSampler(dist, seed=4, hz=0.1, sigmaz=0.05).sample(1000)
+            assert x.shape == (1000, 6)
+            assert np.all((x[:, 0] >= 0.1) & (x[:, 0] <= 3.))
+            assert np.all((x[:, 5] >= 0) & (x[:, 5] < 2 * np.pi))
+            assert_allclose(x, DiskSampler(dist, seed=4, hz=0.1, sigmaz=0.05).sample(1000))
+        with self.assertRaises(ValueError):
+            DiskSampler('dehnen')
+
+    def test_shu_moments(self):
+        """Test the velocity moments of the Shu samples against a quadrature of the distribution function."""
+        vR, vT = np.meshgrid(np.linspace(-1.5, 1.5, 601), np.linspace(1e-4, 2.5, 601), indexing='ij')
+        sRe2 = 0.04 * np.exp(-2 * (vT - 1))
+        w = np.exp(-3 * vT - (0.5 * (vR**2 + vT**2) - 0.5 - np.log(vT)) / sRe2) / sRe2
+        w /= np.sum(w)
+        meanvT = np.sum(w * vT)
+        x = DiskSampler('shu', seed=2, Rrange=(0.99, 1.01)).sample(100000)
+        assert_allclose(np.std(x[:, 1]), np.sqrt(np.sum(w * vR**2)), rtol=0.01)
+        assert_allclose(np.mean(x[:, 2]), meanvT, rtol=0.003)
+        assert_allclose(np.std(x[:, 2]), np.sqrt(np.sum(w * (vT - meanvT)**2)), rtol=0.01)
+
+    def test_shu_moments_Rrange(self):
+        """Test the radial distribution and the velocity moments of the Shu samples over the default Rrange."""
+        sampler = DiskSampler('shu', seed=2)
+        edges = [0.1, 0.5, 1., 2., 3.]
+        R = np.arange(0.105, 3., 0.01)
+        vR, vT = np.meshgrid(np.linspace(-2., 2., 401), np.linspace(1e-4, 2.5, 501), indexing='ij')
+        moments = np.zeros((len(R), 4))
+        for ii in range(len(R)):
+            f = R[ii] * sampler.df(R[ii], vR, vT)
+            moments[ii] = np.sum(f), np.sum(f * vT), np.sum(f * vT**2), np.sum(f * vR**2)
+        x = sampler.sample(100000)
+        for lo, hi in zip(edges[:-1], edges[1:]):
+            w = np.sum(moments[(R > lo) & (R < hi)], axis=0)
+            inbin = (x[:, 0] > lo) & (x[:, 0] < hi)
+            meanvT = w[1] / w[0]
+            assert_allclose(np.mean(inbin), w[0] / np.sum(moments[:, 0]), rtol=0.02, atol=0.002)
+            assert_allclose(np.mean(x[inbin, 2]), meanvT, rtol=0.005)
+            if hi <= 2.:  # the dispersions of the few samples beyond are dominated by the tail to low vT
+                assert_allclose(np.std(x[inbin, 1]), np.sqrt(w[3] / w[0]), rtol=0.02)
+                assert_allclose(np.std(x[inbin, 2]), np.sqrt(w[2] / w[0] - meanvT**2), rtol=0.02)
+
+    def test_schwarzschild_moments(self):
+        """Test the velocity moments of the Schwarzschild samples."""
+        x = DiskSampler('schwarzschild', seed=3, Rrange=(0.99, 1.01)).sample(100000)
+        assert_allclose(np.std(x[:, 1]), 0.2, rtol=0.01)
+        assert_allclose(np.std(x[:, 2]), 0.2 / np.sqrt(2), rtol=0.01)
+        # asymmetric drift from the Jeans equation
+        assert_allclose(np.mean(x[:, 2]), np.sqrt(1 - 0.04 * 4.5), rtol=0.003)
+
+    def test_df(self):
+        """Test that the distribution functions integrate to the surface density."""
+        vR, vT = np.meshgrid(np.linspace(-1.5, 1.5, 601), np.linspace(-1., 2.5, 701), indexing='ij')
+        dv = 0.005**2
+        # the surface density of the Shu distribution function is only approximately exp(-R/hR) for a warm disk
+        for dist, rtol in [('schwarzschild', 1e-6), ('shu', 0.1)]:
+            f = DiskSampler(dist).df(1.2, vR, vT)
+            assert f.shape == vR.shape
+            assert_allclose(np.sum(f) * dv, np.exp(-1.2 * 3), rtol=rtol)
+
+    def test_stream_and_evolve(self):
+        """Test streaming samples through the integration and back from disk."""
+        sampler = DiskSampler('shu', seed=5, Rrange=(0.8, 1.2))
+        chunks = list(sampler.stream(25, chunk=10))
+        assert [len(c) for c in chunks] == [10, 10, 5]
+        directory = tempfile.mkdtemp()
+        try:
+            ts = np.linspace(0, 1, 11)
+            evolved = list(evolve_samples(chunks, list(MWPotential2014), ts, directory=directory,
+                                          method='leapfrog'))
+            loaded = list(load_samples(directory))
+            assert len(loaded) == 3
+            for (ics, ev), (lics, lev), chunk in zip(evolved, loaded, chunks):
+                assert ev.shape == chunk.shape
+                assert_allclose(ics, chunk)
+                assert_allclose(lics, ics)
+                assert_allclose(lev, ev)
+                assert not np.allclose(ev, ics)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_array_chunks(self):
+        """Test integrating an array of samples in chunks."""
+        samples = np.concatenate(list(DiskSampler('shu', seed=5, Rrange=(0.8, 1.2)).stream(25, chunk=10)))
+        pot = list(MWPotential2014)
+        ts = np.linspace(0, 1, 11)
+        batches = list(integrate_chunks(samples, pot, ts, chunk=10, method='leapfrog'))
+        assert [len(ics) for ics, _ in batches] == [10, 10, 5]
+        assert_allclose(np.concatenate([ics for ics, _ in batches]), samples)
+        orbits = integrate_batch(samples, pot, ts, method='leapfrog')
+        assert_allclose(np.concatenate([o for _, o in batches]), orbits)
+        (ics, evolved), = evolve_samples(samples, pot, ts, method='leapfrog')
+        assert_allclose(evolved, orbits[:, -1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+from __future__ import division
+from galpy.potential import SpiralArmsPotential as spiral
+from galpy.potential import DehnenSmoothWrapperPotential
+from multi_spiral_arms import MultiSpiralArmsPotential
+from orbit_diagnostics import pattern_speed
+from spiral_arms_fast import FastSpiralArmsPotential
+import numpy as np
+from numpy import pi
+from numpy.testing import assert_allclose
+import unittest
+
+# pitch angles and reference radii as found when fitting logarithmic spirals to individual arms
+_ARMS = [dict(N=2, alpha=0.346, r_ref=1.1, phi_ref=0.2, Cs=[1., 0.3], omega=0.9),
+         dict(N=4, alpha=0.120, r_ref=0.8, phi_ref=1.3, Cs=[0.5], omega=0.),
+         dict(N=2, alpha=0.223, r_ref=1.4, phi_ref=-0.6, Cs=[8./(3.*pi), 0.5, 8./(15.*pi)], omega=0.9),
+         dict(N=1, alpha=0.120, r_ref=0.8, phi_ref=0.4, Cs=[0., 0., 0., 0.7], omega=1.2)]
+
+_POINTS = [(0.3, 0., 0., 0.), (1., -.07, pi/2, 3.), (3.14, .2, 3.3*pi/2, -12.3)]
+
+
+class TestMultiSpiralArmsPotential(unittest.TestCase):
+
+    def setUp(self):
+        self.pots = [spiral(amp=a, Rs=0.4, H=0.1, **arm) for a, arm in zip([1., 2., 0.5, 1.3], _ARMS)]
+        self.mp = MultiSpiralArmsPotential.from_potentials(self.pots)
+
+    def _sum(self, method, R, z, phi, t):
+        return sum(getattr(p, method)(R, z, phi, t) for p in self.pots)
+
+    def test_same_as_sum(self):
+        """Test that the composite potential equals the sum of the individual SpiralArmsPotentials."""
+        # the n = 4 term of the one-armed pattern shares its wavenumber with the four-armed pattern
+        assert len(self.mp._k) < len(self.mp._C)
+        for R, z, phi, t in _POINTS:
+            for method in ['_evaluate', '_Rforce', '_zforce', '_dens']:
+                assert_allclose(getattr(self.mp, method)(R, z, phi, t) * self.mp._amp,
+                                sum(getattr(p, method)(R, z, phi, t) * p._amp for p in self.pots),
+                                rtol=1e-10, atol=1e-14)
+            assert_allclose(self.mp(R, z, phi, t), self._sum('__call__', R, z, phi, t), rtol=1e-10)
+            # the azimuthal force against -dPhi/dphi
+            dx = 1e-6
+            assert_allclose(self.mp._phiforce(R, z, phi, t),
+                            -(self.mp._evaluate(R, z, phi + dx, t) - self.mp._evaluate(R, z, phi - dx, t)) / 2 / dx,
+                            rtol=1e-6, atol=1e-10)
+
+    def test_arrays(self):
+        """Test that array inputs give the same results as scalar inputs."""
+        Rs = np.linspace(0.2, 3, 7)
+        zs = np.linspace(-0.5, 0.5, 7)
+        phis = np.linspace(0, 2*pi, 7)
+        for func in [self.mp._evaluate, self.mp._Rforce, self.mp._zforce, self.mp._phiforce, self.mp._dens]:
+            assert_allclose(func(Rs, zs, phis, 1.2), [func(R, z, phi, 1.2) for R, z, phi in zip(Rs, zs, phis)],
+                            rtol=1e-12)
+
+    def test_constructor(self):
+        """Test the constructor with a common list of Cs and its errors."""
+        mp = MultiSpiralArmsPotential(N=[2, 3], alpha=0.2, Cs=[1., 0.5])
+        assert_allclose(mp(1.2, 0.1, 0.4), spiral(N=2, Cs=[1., 0.5])(1.2, 0.1, 0.4)
+                        + spiral(N=3, Cs=[1., 0.5])(1.2, 0.1, 0.4), rtol=1e-10)
+        with self.assertRaises(ValueError):
+            MultiSpiralArmsPotential(N=[2, 3], Cs=[[1.], [1.], [1.]])
+        with self.assertRaises(ValueError):
+            MultiSpiralArmsPotential.from_potentials([spiral(H=0.1), spiral(H=0.2)])
+        # the growth envelope of a FastSpiralArmsPotential cannot be folded into Cs
+        grown = FastSpiralArmsPotential.from_potential(DehnenSmoothWrapperPotential(pot=spiral(), tform=-2.))
+        with self.assertRaises(ValueError):
+            MultiSpiralArmsPotential.from_potentials([spiral(), grown])
+
+    def test_from_potentials_after_array_calls(self):
+        """Test from_potentials with SpiralArmsPotentials that were evaluated on arrays first."""
+        for p in self.pots:
+            p.dens(np.array([0.8, 1.3]), np.array([0.1, -0.2]))
+        mp = MultiSpiralArmsPotential.from_potentials(self.pots)
+        for R, z, phi, t in _POINTS:
+            assert_allclose(mp(R, z, phi, t), self.mp(R, z, phi, t), rtol=1e-12)
+
+    def test_radial_cache(self):
+        """Test that a 0-d radius changed in place does not return the cached radial terms."""
+        R = np.array(1.1)
+        self.mp(R, 0.1, 0.3, 0.)
+        R[...] = 1.4
+        assert_allclose(self.mp(R, 0.1, 0.3, 0.), self._sum('__call__', 1.4, 0.1, 0.3, 0.), rtol=1e-10)
+
+    def test_pattern_speed(self):
+        """Test that pattern_speed only takes a composite pattern with a single pattern speed."""
+        with self.assertRaises(ValueError):
+            pattern_speed(self.mp)
+        assert pattern_speed(MultiSpiralArmsPotential(N=[2, 4], omega=0.7)) == 0.7
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+from __future__ import division
+from galpy.orbit import Orbit
+from galpy.potential import SpiralArmsPotential as spiral
+from galpy.potential import MWPotential2014, vcirc
+from orbit_diagnostics import orbit_array, jacobi, frequencies, classify_resonances, diagnose
+import numpy as np
+from numpy.testing import assert_allclose
+import unittest
+
+
+def _epicycles(Omega_R, Omega_phi, Omega_z, ts):
+    """Return orbits on epicycles with the given frequencies as an array of shape (norb, nt, 6)."""
+    t = ts[None, :]
+    R = 1 + 0.1 * np.cos(Omega_R[:, None] * t)
+    z = 0.05 * np.sin(Omega_z[:, None] * t)
+    phi = np.mod(Omega_phi[:, None] * t + 0.05 * np.sin(Omega_R[:, None] * t), 2 * np.pi)
+    zero = np.zeros_like(R)
+    return np.stack([R, zero, zero, z, zero, phi], axis=-1)
+
+
+class TestOrbitDiagnostics(unittest.TestCase):
+
+    def test_frequencies(self):
+        """Test that the frequencies of epicycles are recovered."""
+        ts = np.linspace(0, 300, 6001)
+        Omega_R = np.array([1.4, 2.1, 0.9])
+        Omega_phi = np.array([1., 1.3, 0.6])
+        Omega_z = np.array([3., 4.2, 2.5])
+        OR, Ophi, Oz = frequencies(_epicycles(Omega_R, Omega_phi, Omega_z, ts), ts)
+        assert_allclose(OR, Omega_R, rtol=1e-3)
+        assert_allclose(Ophi, Omega_phi, rtol=1e-3)
+        assert_allclose(Oz, Omega_z, rtol=1e-3)
+        # a single orbit
+        OR, Ophi, Oz = frequencies(_epicycles(Omega_R, Omega_phi, Omega_z, ts)[1], ts)
+        assert_allclose(OR, Omega_R[1], rtol=1e-3)
+
+    def test_classify(self):
+        """Test the resonance classification."""
+        Omega_R = np.array([1., 1., 1., 1., 1., 1.])
+        Omega_phi = np.array([2., 2.5, 1.5, 2.25, 1.75, 2.2])
+        labels, x = classify_resonances(Omega_R, Omega_phi, 2., m=2)
+        assert list(labels) == ['corotation', 'ILR', 'OLR', 'IUHR', 'OUHR', '']
+        assert_allclose(x, [0, 1, -1, 0.5, -0.5, 0.4])
+
+    def test_jacobi(self):
+        """Test that the Jacobi integral is conserved along orbits in a rotating spiral."""
+        pot = [spiral(amp=0.5, omega=1.5)] + list(MWPotential2014)
+        ts = np.linspace(0, 50, 1001)
+        orbits = []
+        for R in [0.8, 1., 1.2]:
+            o = Orbit([R, 0.05, vcirc(list(MWPotential2014), R), 0.01, 0., 0.3])
+            o.integrate(ts, pot, method='dopr54_c')
+            orbits.append(o)
+        EJ = jacobi(pot, orbit_array(orbits), ts)
+        assert EJ.shape == (3, 1001)
+        assert np.all(np.std(EJ, axis=1) < 1e-8 * np.fabs(np.mean(EJ, axis=1)))
+        d = diagnose(pot, orbit_array(orbits), ts)
+        assert_allclose(d['EJ'], np.mean(EJ, axis=1))
+        assert d['resonance'].shape == (3,)
+
+
+if __name__ == '__main__':
+    unittest.main()
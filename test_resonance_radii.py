@@ -0,0 +1,36 @@
+from __future__ import division
+from galpy.potential import SpiralArmsPotential as spiral
+from galpy.potential import MWPotential2014, lindbladR
+from resonance_radii import lindblad_radii, frequency_table
+import numpy as np
+from numpy.testing import assert_allclose
+import unittest
+
+
+class TestResonanceRadii(unittest.TestCase):
+
+    def test_lindbladR(self):
+        """Test the resonance radii against potential.lindbladR."""
+        mp = list(MWPotential2014)
+        pot = [spiral(N=2, amp=2)] + mp
+        omegas = np.linspace(0.5, 5, 7)
+        for m in ['corotation', 2, -2, 4, -4]:
+            assert_allclose(lindblad_radii(pot, omegas, m=m), [lindbladR(mp, omega, m=m) for omega in omegas],
+                            rtol=1e-8)
+
+    def test_broadcast(self):
+        """Test that arrays of omega and m broadcast, and that missing resonances are NaN."""
+        mp = list(MWPotential2014)
+        radii = lindblad_radii(mp, np.array([[1.], [2.]]), m=np.array([0, 2, -2]))
+        assert radii.shape == (2, 3)
+        assert_allclose(radii[1, 2], lindbladR(mp, 2., m=-2), rtol=1e-8)
+        assert np.isnan(lindblad_radii(mp, 1000., m=0))
+
+    def test_cache(self):
+        """Test that the frequency table is computed once per background potential."""
+        mp = list(MWPotential2014)
+        assert frequency_table(mp)[1] is frequency_table([spiral()] + mp)[1]
+
+
+if __name__ == '__main__':
+    unittest.main()
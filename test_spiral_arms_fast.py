@@ -0,0 +1,149 @@
+from __future__ import division
+from galpy.potential import SpiralArmsPotential as spiral
+from galpy.potential import DehnenSmoothWrapperPotential, LogarithmicHaloPotential
+from galpy.orbit import Orbit
+from galpy.util import galpyWarning
+from spiral_arms_fast import FastSpiralArmsPotential as fastspiral
+from spiral_arms_fast import for_integration
+from orbit_batches import integrate_batch
+import numpy as np
+from numpy import pi
+from numpy.testing import assert_allclose
+import unittest
+import warnings
+
+
+_PARAMS = [dict(),
+           dict(amp=13, N=7, alpha=-0.3, r_ref=0.5, phi_ref=0.3, Rs=0.7, H=0.7, Cs=[1, 2, 3], omega=3),
+           dict(N=10, r_ref=15, phi_ref=5, Cs=[8./(3.*pi), 0.5, 8./(15.*pi)])]
+
+_POINTS = [(0.3, 0, 0, 0), (1, -.7, pi/2, 3), (3.14, .7, 3.3*pi/2, -123.123)]
+
+
+class TestFastSpiralArmsPotential(unittest.TestCase):
+
+    def test_same_as_spiral(self):
+        """Test that the potential, forces and density are identical to those of SpiralArmsPotential."""
+        rtol = 1e-10
+        for params in _PARAMS:
+            sp, fp = spiral(**params), fastspiral(**params)
+            for R, z, phi, t in _POINTS:
+                assert_allclose(fp(R, z, phi, t), sp(R, z, phi, t), rtol=rtol)
+                assert_allclose(fp.Rforce(R, z, phi, t), sp.Rforce(R, z, phi, t), rtol=rtol)
+                assert_allclose(fp.zforce(R, z, phi, t), sp.zforce(R, z, phi, t), rtol=rtol, atol=1e-12)
+                assert_allclose(fp.dens(R, z, phi, t), sp.dens(R, z, phi, t), rtol=rtol)
+                # the azimuthal force against -dPhi/dphi
+                dx = 1e-6
+                assert_allclose(fp._phiforce(R, z, phi, t),
+                                -(sp._evaluate(R, z, phi + dx, t) - sp._evaluate(R, z, phi - dx, t)) / 2 / dx,
+                                rtol=1e-6, atol=1e-10)
+                # the public azimuthal force (phitorque in galpy >= 1.8) uses the fast kernel
+                phiforce = getattr(fp, 'phitorque', None) or fp.phiforce
+                assert_allclose(phiforce(R, z, phi, t), fp._amp * fp._phiforce(R, z, phi, t), rtol=1e-14)
+
+    def test_static(self):
+        """Test that the potential does not depend on time when omega == 0, and that cached terms are reused."""
+        fp = fastspiral(Cs=[1, 0.5])
+        assert fp(1.1, 0.2, 0.3, 0) == fp(1.1, 0.2, 0.3, 123.)
+        phase_terms = fp._phase_terms
+        fp.Rforce(1.1, 0.2, 0.3, 5.)
+        assert fp._phase_terms is phase_terms
+        fp.Rforce(1.1, 0.2, 0.4, 5.)
+        assert fp._phase_terms is not phase_terms
+
+        fp = fastspiral(omega=2.)
+        assert fp(1.1, 0.2, 0.3, 0) != fp(1.1, 0.2, 0.3, 1.)
+
+        # 0-d arrays changed in place do not return the terms cached for their old value
+        R, phi = np.array(1.), np.array(0.3)
+        fp(R, 0.2, phi, 0.)
+        R[...] = 2.
+        phi[...] = 0.5
+        assert_allclose(fp(R, 0.2, phi, 0.), spiral(omega=2.)(2., 0.2, 0.5, 0.), rtol=1e-12)
+
+    def test_arrays(self):
+        """Test that array inputs give the same results as scalar inputs."""
+        fp = fastspiral(**_PARAMS[1])
+        Rs = np.linspace(0.2, 3, 7)
+        zs = np.linspace(-1, 1, 7)
+        phis = np.linspace(0, 2*pi, 7)
+        for func in [fp._evaluate, fp._Rforce, fp._zforce, fp._phiforce, fp._dens]:
+            assert_allclose(func(Rs, zs, phis, 1.2), [func(R, z, phi, 1.2) for R, z, phi in zip(Rs, zs, phis)],
+                            rtol=1e-12)
+
+    def test_after_array_calls(self):
+        """Test the kernels after SpiralArmsPotential's methods replaced _Cs, _ns and _HNn for array input."""
+        params = _PARAMS[1]
+        R, z, phi = np.array([0.8, 1.3]), np.array([0.1, -0.2]), np.array([0.4, 2.])
+        expected = [spiral(**params)(1.1, 0.1, 0.3, 0.2), spiral(**params).Rforce(1.1, 0.1, 0.3, 0.2),
+                    spiral(**params).dens(1.1, 0.1, 0.3, 0.2)]
+        fp = fastspiral(**params)
+        fp.R2deriv(R, z, phi)
+        fp.phizderiv(R, z, phi)
+        # the second derivatives restore the arrays the scalar second derivatives need
+        assert fp._Cs.ndim == fp._ns.ndim == fp._HNn.ndim == 1
+        assert_allclose(fp.R2deriv(1.1, 0.1, 0.3, 0.2), spiral(**params).R2deriv(1.1, 0.1, 0.3, 0.2), rtol=1e-10)
+        sp = spiral(**params)
+        sp(R, z, phi=phi)
+        sp.dens(R, z, phi=phi)
+        for pot in [fp, fastspiral.from_potential(sp)]:
+            assert_allclose([pot(1.1, 0.1, 0.3, 0.2), pot.Rforce(1.1, 0.1, 0.3, 0.2), pot.dens(1.1, 0.1, 0.3, 0.2)],
+                            expected, rtol=1e-10)
+            assert_allclose(pot._evaluate(R, z, phi, 0.2),
+                            [spiral(**params)._evaluate(*x, t=0.2) for x in zip(R, z, phi)], rtol=1e-10)
+
+    def test_envelope(self):
+        """Test that the fused growth envelope matches DehnenSmoothWrapperPotential."""
+        params = _PARAMS[1]
+        with self.assertWarns(galpyWarning):
+            fp = fastspiral(tform=-3., tsteady=2., **params)
+        dp = DehnenSmoothWrapperPotential(pot=spiral(**params), tform=-3., tsteady=2.)
+        assert not fp.hasC and not fp.hasC_dxdv
+        for t in [-4., -2.5, -1.5, -0.9, 2.]:
+            for method in ['__call__', 'Rforce', 'zforce', 'dens']:
+                assert_allclose(getattr(fp, method)(1.1, 0.2, 0.3, t), getattr(dp, method)(1.1, 0.2, phi=0.3, t=t),
+                                rtol=1e-10, atol=1e-14)
+        ts = np.linspace(-4, 0, 9)
+        assert_allclose(fp._Rforce(1.1, 0.2, 0.3, ts), [fp._Rforce(1.1, 0.2, 0.3, t) for t in ts], rtol=1e-12)
+        # a 0-d time changed in place does not return the cached envelope
+        t = np.array(-2.5)
+        fp(1.1, 0.2, 0.3, t)
+        t[...] = -1.5
+        assert_allclose(fp(1.1, 0.2, 0.3, t), dp(1.1, 0.2, phi=0.3, t=-1.5), rtol=1e-10)
+        # from a wrapped potential, and without the envelope
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', galpyWarning)
+            wp = fastspiral.from_potential(DehnenSmoothWrapperPotential(amp=2., pot=spiral(**params), tform=-3.))
+        assert_allclose(wp(1.1, 0.2, 0.3, -1.), 2 * fp(1.1, 0.2, 0.3, -1.))
+        fp.set_envelope(None)
+        assert fp.hasC and fp.hasC_dxdv
+        assert_allclose(fp(1.1, 0.2, 0.3, -4.), spiral(**params)(1.1, 0.2, 0.3, -4.), rtol=1e-10)
+
+    def test_to_wrapper(self):
+        """Test that the C integration of to_wrapper() matches the Python integration of the fused envelope."""
+        fp = fastspiral(amp=2., omega=1.1, tform=-2., tsteady=1.)
+        cp = fp.to_wrapper()
+        assert isinstance(cp, DehnenSmoothWrapperPotential) and cp.hasC
+        assert type(cp._pot) is spiral and cp._pot.hasC
+        assert_allclose(cp(1.1, 0.2, phi=0.3, t=-1.2), fp(1.1, 0.2, 0.3, -1.2), rtol=1e-10)
+        assert type(fastspiral().to_wrapper()) is spiral
+        ts = np.linspace(-3, 2, 101)
+        lp = LogarithmicHaloPotential(normalize=1.)
+        orbits = []
+        for pot, method in [(fp, 'dopr54_c'), (cp, 'dopr54_c')]:
+            o = Orbit([1., 0.1, 1.1, 0.05, 0.02, 0.])
+            o.integrate(ts, [pot, lp], method=method)
+            orbits.append(o.getOrbit())
+            orbits[-1][:, 5] = np.unwrap(orbits[-1][:, 5])
+        assert_allclose(orbits[0], orbits[1], rtol=1e-6, atol=1e-6)
+        # integrate_batch integrates the fused envelope as to_wrapper(), in C
+        converted = for_integration([fp, lp])
+        assert isinstance(converted[0], DehnenSmoothWrapperPotential) and converted[1] is lp
+        assert for_integration(lp) is lp
+        batch = integrate_batch([1., 0.1, 1.1, 0.05, 0.02, 0.], [fp, lp], ts, method='dopr54_c')[0]
+        batch[:, 5] = np.unwrap(batch[:, 5])
+        assert_allclose(batch, orbits[1], rtol=1e-12, atol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+from __future__ import division
+from galpy.potential import SpiralArmsPotential as spiral
+from spiral_gradients import gradients, PARAMETERS, QUANTITIES
+import numpy as np
+from numpy.testing import assert_allclose
+import unittest
+
+_PARAMS = dict(amp=1.3, N=2, alpha=0.3, r_ref=1.1, phi_ref=0.4, Rs=0.5, H=0.2, Cs=[1., 0.5, 0.2], omega=0.)
+
+_METHODS = {'potential': '_evaluate', 'Rforce': '_Rforce', 'zforce': '_zforce', 'dens': '_dens'}
+
+
+class TestSpiralGradients(unittest.TestCase):
+
+    def setUp(self):
+        self.R = np.array([0.5, 1., 2.])
+        self.z = np.array([0.1, -0.2, 0.3])
+        self.phi = np.array([0.3, 1., 2.])
+        self.t = 1.5
+
+    def _evaluate(self, params, quantity):
+        sp = spiral(**params)
+        return np.array([sp._amp * getattr(sp, _METHODS[quantity])(R, z, phi, self.t)
+                         for R, z, phi in zip(self.R, self.z, self.phi)])
+
+    def test_finite_differences(self):
+        """Test the derivatives against central finite differences of SpiralArmsPotential."""
+        grads = gradients(spiral(**_PARAMS), self.R, self.z, self.phi, self.t)
+        assert set(grads) == set(QUANTITIES)
+        dx = 1e-6
+        for quantity in _METHODS:
+            assert_allclose(grads[quantity]['value'], self._evaluate(_PARAMS, quantity), rtol=1e-12)
+            for name in PARAMETERS:
+                if name == 'Cs':
+                    continue
+                up, down = dict(_PARAMS), dict(_PARAMS)
+                up[name] += dx
+                down[name] -= dx
+                fd = (self._evaluate(up, quantity) - self._evaluate(down, quantity)) / 2 / dx
+                assert_allclose(grads[quantity][name], fd, rtol=1e-6, atol=1e-9)
+            # the potential is linear in Cs
+            assert grads[quantity]['Cs'].shape == (3, 3)
+            for n in range(3):
+                Cs = np.zeros(3)
+                Cs[n] = 1.
+                params = dict(_PARAMS, Cs=Cs)
+                assert_allclose(grads[quantity]['Cs'][:, n], self._evaluate(params, quantity), rtol=1e-12)
+
+    def test_phiforce(self):
+        """Test the derivatives of the azimuthal force, with the physical parameters and arrays."""
+        R, phi = np.meshgrid(np.linspace(0.5, 2., 4), np.linspace(0., 3., 5), indexing='ij')
+        params = ('alpha', 'omega')
+        grads = gradients(spiral(**_PARAMS), R, 0.1, phi, self.t, quantities=['phiforce', 'potential'],
+                          params=params)
+        assert set(grads['phiforce']) == {'value', 'alpha', 'omega'}
+        assert grads['phiforce']['alpha'].shape == (4, 5)
+        # d/domega Phi = -t dPhi/dphi
+        assert_allclose(grads['potential']['omega'], self.t * grads['phiforce']['value'], rtol=1e-10, atol=1e-14)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+from __future__ import division
+from galpy.potential import SpiralArmsPotential as spiral
+from galpy.potential import MWPotential2014, DehnenSmoothWrapperPotential, evaluatePotentials
+from spiral_grid import evaluate, evaluate_xy, evaluate_Rz
+import numpy as np
+from numpy.testing import assert_allclose
+from astropy import units as u
+import unittest
+
+
+class TestSpiralGrid(unittest.TestCase):
+
+    def test_xy(self):
+        """Test that evaluate_xy matches a double loop over the grid."""
+        sp = spiral(Cs=[1, 0.5], omega=1.3)
+        xs = np.linspace(-2, 2, 5)
+        ys = np.linspace(-1.5, 2, 4)
+        for quantity, func in [('potential', sp), ('dens', sp.dens), ('Rforce', sp.Rforce), ('zforce', sp.zforce)]:
+            grid = evaluate_xy(sp, xs, ys, z=0.1, t=0.7, quantity=quantity)
+            assert grid.shape == (5, 4)
+            assert_allclose(grid, [[func(np.hypot(x, y), 0.1, np.arctan2(y, x), 0.7) for y in ys] for x in xs],
+                            rtol=1e-10, atol=1e-14)
+
+    def test_Rz(self):
+        """Test that evaluate_Rz matches a double loop for a list of potentials."""
+        pot = [spiral()] + list(MWPotential2014)
+        Rs = np.linspace(0.5, 2, 3)
+        zs = np.linspace(-0.2, 0.3, 4)
+        assert_allclose(evaluate_Rz(pot, Rs, zs, phi=0.4),
+                        [[evaluatePotentials(pot, R, z, phi=0.4) for z in zs] for R in Rs], rtol=1e-10)
+
+    def test_phiforce(self):
+        """Test the azimuthal force of a list of axisymmetric and non-axisymmetric potentials."""
+        sp = spiral(Cs=[1, 0.5], omega=1.3)
+        pot = [sp] + list(MWPotential2014)
+        R = np.linspace(0.5, 2., 4)
+        phi = np.linspace(0., 3., 4)
+        assert_allclose(evaluate(list(MWPotential2014), R, 0.1, phi, quantity='phiforce'), 0.)
+        dx = 1e-6
+        assert_allclose(evaluate(pot, R, 0.1, phi, 0.7, quantity='phiforce'),
+                        -(evaluatePotentials(pot, R, 0.1, phi=phi + dx, t=0.7)
+                          - evaluatePotentials(pot, R, 0.1, phi=phi - dx, t=0.7)) / 2 / dx, rtol=1e-6, atol=1e-10)
+
+    def test_growing(self):
+        """Test that a spiral wrapped in DehnenSmoothWrapperPotential is evaluated with the fused envelope."""
+        pot = DehnenSmoothWrapperPotential(amp=0.7, pot=spiral(omega=1.), tform=-2., tsteady=1.5)
+        Rs = np.linspace(0.5, 2, 4)
+        ts = np.array([-3., -1.2, 0.])
+        assert_allclose(evaluate(pot, Rs[:, None], 0.1, 0.3, ts[None, :], quantity='dens'),
+                        [[pot.dens(R, 0.1, phi=0.3, t=t) for t in ts] for R in Rs], rtol=1e-10, atol=1e-14)
+
+    def test_units(self):
+        """Test that Quantity and physical inputs are converted consistently."""
+        sp = spiral(omega=1.)
+        Rs = np.linspace(0.5, 2, 4)
+        internal = evaluate(sp, Rs, 0.1, 0.3, 0.2, quantity='Rforce')
+        assert_allclose(evaluate(sp, Rs * 8 * u.kpc, 0.8 * u.kpc, 0.3 * u.rad, 0.2, quantity='Rforce'), internal)
+        time_in_Gyr = 8. / 220. * u.kpc.to(u.km) / u.Gyr.to(u.s)
+        assert_allclose(evaluate(sp, Rs * 8, 0.8, 0.3, 0.2 * time_in_Gyr, quantity='Rforce', physical=True),
+                        internal * 220.**2 / 8. / (u.kpc.to(u.km) / u.Myr.to(u.s)), rtol=1e-10)
+        xs = np.linspace(-2, 2, 4)
+        assert_allclose(evaluate_xy(sp, xs * 8 * u.kpc, xs * 8 * u.kpc), evaluate_xy(sp, xs, xs))
+
+
+if __name__ == '__main__':
+    unittest.main()
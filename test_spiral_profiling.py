@@ -0,0 +1,61 @@
+from __future__ import division
+from galpy.potential import SpiralArmsPotential as spiral
+from galpy.potential import MWPotential2014
+from spiral_profiling import SpiralArmsProfiler
+import os
+import tempfile
+import unittest
+
+
+class TestSpiralArmsProfiler(unittest.TestCase):
+
+    def test_counts(self):
+        """Test that calls to methods and helpers are counted."""
+        sp = spiral(Cs=[1, 2])
+        prof = SpiralArmsProfiler()
+        with prof.instrument(sp):
+            for ii in range(5):
+                sp.Rforce(1., 0.1, 0.3)
+            sp(1., 0.1, 0.3)
+        stats = prof.stats()
+        assert stats['SpiralArmsPotential._Rforce'][0] == 5
+        assert stats['SpiralArmsPotential._evaluate'][0] == 1
+        assert stats['SpiralArmsPotential._K'][0] == 6
+        assert stats['SpiralArmsPotential._dK_dR'][0] == 5
+        # time in callees is included in cumtime but not in tottime
+        ncalls, tottime, cumtime = stats['SpiralArmsPotential._Rforce']
+        assert cumtime >= tottime
+
+    def test_release(self):
+        """Test that detaching restores the original methods."""
+        sp = spiral()
+        prof = SpiralArmsProfiler()
+        with prof.instrument([sp] + list(MWPotential2014)):
+            assert '_K' in sp.__dict__
+            assert '_Rforce' in MWPotential2014[0].__dict__
+        assert '_K' not in sp.__dict__
+        assert '_Rforce' not in MWPotential2014[0].__dict__
+        sp.Rforce(1., 0.)
+        assert prof.stats().get('SpiralArmsPotential._Rforce', (0,))[0] == 0
+
+    def test_output(self):
+        """Test the summary table and the folded stacks for flamegraphs."""
+        sp = spiral()
+        prof = SpiralArmsProfiler()
+        with prof.instrument(sp):
+            sp.zforce(1., 0.1)
+        assert 'SpiralArmsPotential._zforce' in prof.summary()
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            prof.dump_flamegraph(filename)
+            with open(filename) as f:
+                lines = f.read().splitlines()
+        finally:
+            os.remove(filename)
+        assert any(line.startswith('SpiralArmsPotential.zforce;SpiralArmsPotential._zforce;SpiralArmsPotential._K ')
+                   for line in lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
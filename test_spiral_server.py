@@ -0,0 +1,135 @@
+from __future__ import division
+from galpy.potential import SpiralArmsPotential as spiral
+from spiral_grid import evaluate, evaluate_xy
+from spiral_server import SpiralServer, SpiralClient
+from astropy import units as u
+import asyncio
+import os
+import shutil
+import tempfile
+import numpy as np
+from numpy.testing import assert_allclose
+import unittest
+
+_PARAMS = dict(amp=1.3, N=3, alpha=-0.3, Rs=0.5, H=0.2, Cs=[1., 0.5, 0.2], omega=0.6)
+
+
+class TestSpiralServer(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_batching(self):
+        """Test that concurrent requests over a Unix socket are coalesced per parameter set and answered correctly."""
+        rng = np.random.RandomState(1)
+        points = [(rng.uniform(0.5, 2., 5), rng.uniform(-0.1, 0.1, 5), rng.uniform(0., 6., 5)) for _ in range(40)]
+        other = dict(_PARAMS, N=2)
+
+        async def run():
+            server = SpiralServer()
+            path = await server.start(path=os.path.join(self.dir, 'spiral.sock'))
+            clients = [await SpiralClient.connect(path) for _ in range(2)]
+            results = await asyncio.gather(*[clients[ii % 2].evaluate(_PARAMS if ii % 4 else other, R, z, phi, 1.5,
+                                                                      quantity='Rforce')
+                                             for ii, (R, z, phi) in enumerate(points)])
+            metrics = await clients[0].metrics()
+            for client in clients:
+                await client.close()
+            await server.close()
+            return results, metrics
+
+        results, metrics = asyncio.run(run())
+        for ii, (R, z, phi) in enumerate(points):
+            pot = spiral(**(_PARAMS if ii % 4 else other))
+            assert_allclose(results[ii], evaluate(pot, R, z, phi, 1.5, quantity='Rforce'), rtol=1e-10)
+        assert metrics['requests'] == 40 and metrics['points'] == 200
+        # the requests were coalesced into few batches, each with a single parameter set
+        assert 2 <= metrics['batches'] < 10
+        assert metrics['pot_misses'] == 2 and metrics['pot_hits'] == 38
+        assert metrics['latency_p50'] <= metrics['latency_p99']
+        assert metrics['errors'] == 0
+
+    def test_grid_and_errors(self):
+        """Test the grid cache, physical units, broadcasting and errors over localhost TCP."""
+        x = np.linspace(-2., 2., 21)
+        y = np.linspace(-2., 2., 11)
+
+        async def run():
+            server = SpiralServer(delay=0.001)
+            host, port = await server.start()
+            client = await SpiralClient.connect(host=host, port=port)
+            grids = await asyncio.gather(*[client.grid(_PARAMS, 'xy', x, y, 0.1, quantity='dens')
+                                           for _ in range(3)])
+            direct = await server.grid(_PARAMS, 'xy', x, y, 0.1, quantity='dens')
+            physical = await client.evaluate(_PARAMS, [[4.], [8.]], 0.5, [0., 1., 2.], physical=True)
+            errors = []
+            for kwargs in [dict(quantity='R2deriv'), dict(params={'foo': 1.})]:
+                try:
+                    await client.evaluate(kwargs.pop('params', _PARAMS), 1., 0., **kwargs)
+                except ValueError as e:
+                    errors.append(str(e))
+            metrics = server.metrics()
+            await client.close()
+            await server.close()
+            return grids, direct, physical, errors, metrics
+
+        grids, direct, physical, errors, metrics = asyncio.run(run())
+        expected = evaluate_xy(spiral(**_PARAMS), x, y, 0.1, quantity='dens')
+        for grid in grids + [direct]:
+            assert_allclose(grid, expected, rtol=1e-10)
+        assert not direct.flags.writeable
+        assert metrics['grid_requests'] == 4 and metrics['grid_misses'] == 1 and metrics['grid_hits'] == 3
+        assert physical.shape == (2, 3)
+        assert_allclose(physical, evaluate(spiral(**_PARAMS), np.array([[4.], [8.]]), 0.5, [0., 1., 2.],
+                                           physical=True), rtol=1e-10)
+        assert len(errors) == 2 and errors[0].startswith('ValueError') and errors[1].startswith('TypeError')
+
+    def test_in_process(self):
+        """Test evaluating in-process without sockets, and a batch split by max_points."""
+        R = np.linspace(0.5, 2., 10)
+
+        async def run():
+            server = SpiralServer(max_points=20)
+            results = await asyncio.gather(*[server.evaluate(_PARAMS, R, 0., phi, quantity='phiforce')
+                                             for phi in range(5)])
+            await server.close()
+            return results, server.metrics()
+
+        results, metrics = asyncio.run(run())
+        for phi, result in enumerate(results):
+            assert_allclose(result, evaluate(spiral(**_PARAMS), R, 0., phi, quantity='phiforce'), rtol=1e-10)
+        assert metrics['batches'] == 3 and metrics['points_per_batch'] == 50 / 3
+
+    def test_quantity_params(self):
+        """Test that parameters given as Quantity are not confused with plain numbers in internal units."""
+        R = np.linspace(0.5, 2., 5)
+        params = [dict(_PARAMS, alpha=12. * u.deg), dict(_PARAMS, alpha=12.), dict(_PARAMS, alpha=np.radians(12.))]
+
+        async def run():
+            server = SpiralServer()
+            path = await server.start(path=os.path.join(self.dir, 'spiral.sock'))
+            client = await SpiralClient.connect(path)
+            direct = await asyncio.gather(*[server.evaluate(p, R, 0.1, 0.3) for p in params])
+            remote = await asyncio.gather(*[client.evaluate(p, R, 0.1, 0.3) for p in params])
+            grids = [await client.grid(p, 'Rz', R, [0., 0.1], 0.3) for p in params[:2]]
+            await client.close()
+            await server.close()
+            return direct, remote, grids, server.metrics()
+
+        direct, remote, grids, metrics = asyncio.run(run())
+        for p, d, r in zip(params, direct, remote):
+            expected = evaluate(spiral(**p), R, 0.1, 0.3)
+            assert_allclose(d, expected, rtol=1e-10)
+            assert_allclose(r, expected, rtol=1e-10)
+        assert not np.allclose(direct[0], direct[1])
+        assert_allclose(grids[0][:, 1], direct[0], rtol=1e-10)
+        assert_allclose(grids[1][:, 1], direct[1], rtol=1e-10)
+        # 12 deg and its value in radians make the same potential, and are evaluated in the same batch
+        assert metrics['batches'] == 4 and metrics['grid_misses'] == 2
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+from __future__ import division
+from galpy.potential import SpiralArmsPotential as spiral
+from galpy.potential import DehnenSmoothWrapperPotential
+from spiral_arms_fast import FastSpiralArmsPotential
+from spiral_threads import evaluate_threaded, kernel_available, _QUANTITIES
+import numpy as np
+from numpy.testing import assert_allclose
+import unittest
+
+
+class TestSpiralThreads(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(4)
+        self.R = rng.uniform(0.3, 3., 5000)
+        self.z = rng.uniform(-0.2, 0.2, 5000)
+        self.phi = rng.uniform(0., 2 * np.pi, 5000)
+        self.t = rng.uniform(0., 4., 5000)
+        self.pots = [spiral(),
+                     spiral(amp=1.3, N=3, alpha=0.3, r_ref=1.1, phi_ref=0.4, Rs=0.5, H=0.2, Cs=[1., 0.5, 0.2],
+                            omega=0.6),
+                     spiral(N=4, alpha=0.5, Cs=[0., 1., 0.3, 0.1], omega=-0.2),
+                     DehnenSmoothWrapperPotential(pot=spiral(Cs=[1., 0.5], omega=0.6), tform=1., tsteady=2.)]
+
+    def _compare(self, use_c):
+        for pot in self.pots:
+            fp = FastSpiralArmsPotential.from_potential(pot)
+            for quantity, (_, method) in _QUANTITIES.items():
+                expected = fp._amp * getattr(fp, method)(self.R, self.z, self.phi, self.t)
+                # (assert_allclose would treat NaN as equal to NaN)
+                assert np.all(np.isfinite(expected))
+                for nthreads in [1, 3]:
+                    assert_allclose(evaluate_threaded(pot, self.R, self.z, self.phi, self.t, quantity=quantity,
+                                                      nthreads=nthreads, use_c=use_c),
+                                    expected, rtol=1e-8, atol=1e-12)
+
+    def test_kernel(self):
+        """Test the compiled kernel against the numpy kernels for all quantities."""
+        if not kernel_available():
+            self.skipTest('no C compiler')
+        self._compare(True)
+
+    def test_numpy(self):
+        """Test the threaded numpy kernels."""
+        self._compare(False)
+
+    def test_broadcast(self):
+        """Test broadcasting, out and the scalar values of SpiralArmsPotential."""
+        pot = self.pots[1]
+        R, phi = np.meshgrid(np.linspace(0.5, 2., 40), np.linspace(0., 2 * np.pi, 50), indexing='ij')
+        out = np.empty((40, 50))
+        result = evaluate_threaded(pot, R, 0.1, phi, 1.5, quantity='Rforce', nthreads=2, out=out)
+        assert result is out
+        assert_allclose(out[7, 11], pot.Rforce(R[7, 11], 0.1, phi=phi[7, 11], t=1.5), rtol=1e-10)
+        assert_allclose(evaluate_threaded(pot, 1.2, 0.1, 0.3)[()], pot(1.2, 0.1, phi=0.3), rtol=1e-10)
+        with self.assertRaises(ValueError):
+            evaluate_threaded(pot, R, 0.1, phi, out=np.empty((50, 40)))
+        with self.assertRaises(ValueError):
+            evaluate_threaded(pot, R, 0.1, phi, quantity='R2deriv')
+
+    def test_after_array_calls(self):
+        """Test a SpiralArmsPotential whose methods were called on arrays before."""
+        R = np.linspace(0.5, 2., 50)
+        sp = spiral(Cs=[1., 0.5, 0.2])
+        sp.dens(R, np.zeros(50))
+        expected = spiral(Cs=[1., 0.5, 0.2])(R, 0.1, phi=0.3)
+        for use_c in [True, False]:
+            assert_allclose(evaluate_threaded(sp, R, 0.1, 0.3, nthreads=2, use_c=use_c), expected, rtol=1e-10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+from __future__ import division
+from galpy.orbit import Orbit
+from galpy.potential import SpiralArmsPotential as spiral
+from galpy.potential import MWPotential2014
+from orbit_batches import integrate_batch
+from surface_of_section import crossings, section_chunks
+from galpy.util import galpyWarning
+import numpy as np
+from numpy.testing import assert_allclose
+import unittest
+
+
+class TestSurfaceOfSection(unittest.TestCase):
+
+    def setUp(self):
+        self.pot = [spiral(amp=1., omega=0.7)] + list(MWPotential2014)
+        self.vxvv = np.array([[1., 0.1, 1., 0.02, 0.01, 0.], [1.2, -0.1, 0.9, 0., 0., 1.], [0.8, 0.2, 0.7, 0., 0., 2.]])
+        self.ts = np.linspace(0, 100, 1001)
+
+    def test_interpolation(self):
+        """Test that crossings from coarse output match those from fine output and lie on the section."""
+        fine = np.linspace(0, 100, 20001)
+        coarse = crossings(integrate_batch(self.vxvv, self.pot, self.ts, method='dopr54_c'), self.ts, self.pot)
+        exact = crossings(integrate_batch(self.vxvv, self.pot, fine, method='dopr54_c'), fine, self.pot)
+        assert coarse['offsets'][-1] > 10
+        assert_allclose(coarse['offsets'], exact['offsets'])
+        # (the two integrations themselves differ slightly at late times)
+        for name in ['t', 'R', 'vR', 'vT', 'z', 'vz']:
+            assert_allclose(coarse[name], exact[name], atol=1e-3)
+        # integrate the first orbit up to its first crossing
+        o = Orbit(list(self.vxvv[0]))
+        o.integrate(np.array([0, coarse['t'][0]]), self.pot, method='dopr54_c')
+        end = o.getOrbit()[-1]
+        assert_allclose(np.cos(end[5] - 0.7 * coarse['t'][0]), 1.)
+        assert_allclose(end[:5], [coarse[name][0] for name in ['R', 'vR', 'vT', 'z', 'vz']], atol=1e-4)
+
+    def test_filters(self):
+        """Test the direction and vR filters, the planar input and the chunked integration."""
+        orbits = integrate_batch(self.vxvv[:, [0, 1, 2, 5]], self.pot, self.ts, method='dopr54_c')
+        both = crossings(orbits, self.ts, self.pot, phi0=1., direction=0)
+        forward = crossings(orbits, self.ts, self.pot, phi0=1.)
+        backward = crossings(orbits, self.ts, self.pot, phi0=1., direction=-1)
+        assert len(both['t']) == len(forward['t']) + len(backward['t'])
+        assert np.all(both['z'] == 0.)
+        outward = crossings(orbits, self.ts, self.pot, phi0=1., vRsign=1)
+        assert np.all(outward['vR'] > 0) and np.all(np.diff(outward['offsets']) <= np.diff(forward['offsets']))
+        chunks = list(section_chunks(self.vxvv[:, [0, 1, 2, 5]], self.pot, self.ts, chunk=2, phi0=1.,
+                                     method='dopr54_c'))
+        assert [len(batch) for batch, _ in chunks] == [2, 1]
+        assert_allclose(np.concatenate([c['t'] for _, c in chunks]), forward['t'])
+        assert_allclose(chunks[1][1]['R'], forward['R'][forward['offsets'][2]:])
+
+    def test_undersampled(self):
+        """Test that output too coarse to follow the azimuth is flagged."""
+        orbits = integrate_batch(self.vxvv, self.pot, self.ts, method='dopr54_c')
+        dense = crossings(orbits, self.ts, self.pot)
+        assert np.all(dense['undersampled'] == 0)
+        # steps of 2: enough for the first two orbits, too coarse for the faster third one
+        with self.assertWarns(galpyWarning):
+            coarse = crossings(orbits[:, ::20], self.ts[::20], self.pot)
+        assert np.all(coarse['undersampled'][:2] == 0) and coarse['undersampled'][2] > 0
+        assert_allclose(coarse['offsets'][:3], dense['offsets'][:3])
+        assert coarse['offsets'][3] - coarse['offsets'][2] < dense['offsets'][3] - dense['offsets'][2]
+
+if __name__ == '__main__':
+    unittest.main()
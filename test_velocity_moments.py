@@ -0,0 +1,71 @@
+from __future__ import division
+from disk_sampler import DiskSampler
+from velocity_moments import MomentMap, VelocityHistogram, reduce_samples
+import os
+import shutil
+import tempfile
+import numpy as np
+from numpy.testing import assert_allclose
+import unittest
+
+
+class TestVelocityMoments(unittest.TestCase):
+
+    def setUp(self):
+        self.samples = DiskSampler('schwarzschild', seed=1, Rrange=(0.5, 2.), sigmaz=0.1).sample(20000)
+        self.edges = np.linspace(-2, 2, 9)
+
+    def test_moments(self):
+        """Test the streamed moments against the moments of the full sample."""
+        pmap = reduce_samples(np.array_split(self.samples, 7), MomentMap(self.edges, self.edges))
+        x = self.samples[:, 0] * np.cos(self.samples[:, 5])
+        y = self.samples[:, 0] * np.sin(self.samples[:, 5])
+        assert_allclose(pmap.count, np.histogram2d(x, y, bins=[self.edges, self.edges])[0])
+        for ii, velocity in [(1, 'vR'), (2, 'vT'), (4, 'vz')]:
+            for jj, kk in [(2, 5), (4, 4), (6, 3)]:
+                sel = ((x >= self.edges[jj]) & (x < self.edges[jj + 1])
+                       & (y >= self.edges[kk]) & (y < self.edges[kk + 1]))
+                assert_allclose(pmap.mean(velocity)[jj, kk], np.mean(self.samples[sel, ii]))
+                assert_allclose(pmap.dispersion(velocity)[jj, kk], np.std(self.samples[sel, ii]))
+        # the corner bins are outside of Rrange and empty
+        assert pmap.count[0, 0] == 0
+        assert np.isnan(pmap.mean('vT')[0, 0])
+
+    def test_merge(self):
+        """Test that merging partial maps gives the map of the full sample."""
+        full = MomentMap(self.edges, self.edges).update(self.samples)
+        part1 = MomentMap(self.edges, self.edges).update(self.samples[:5000])
+        part2 = reduce_samples([(None, self.samples[5000:12000]), (None, self.samples[12000:])],
+                               MomentMap(self.edges, self.edges))
+        part1.merge(part2)
+        assert_allclose(part1.count, full.count)
+        assert_allclose(part1.mean('vT'), full.mean('vT'))
+        assert_allclose(part1.variance('vR'), full.variance('vR'))
+        with self.assertRaises(ValueError):
+            part1.merge(MomentMap(self.edges[1:], self.edges))
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'map.npz')
+            full.save(filename)
+            loaded = MomentMap.load(filename)
+            assert_allclose(loaded.variance('vz'), full.variance('vz'))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_histogram(self):
+        """Test the local velocity histogram."""
+        vRedges = np.linspace(-1, 1, 21)
+        vTedges = np.linspace(0, 2, 21)
+        hists = [VelocityHistogram(1., 0., 0.2, vRedges, vTedges) for _ in range(2)]
+        reduce_samples(np.array_split(self.samples, 3), hists[0])
+        hists[1].update(self.samples[:100]).update(self.samples[100:])
+        x = self.samples[:, 0] * np.cos(self.samples[:, 5])
+        y = self.samples[:, 0] * np.sin(self.samples[:, 5])
+        near = (x - 1)**2 + y**2 < 0.04
+        expected = np.histogram2d(self.samples[near, 1], self.samples[near, 2], bins=[vRedges, vTedges])[0]
+        assert_allclose(hists[0].hist, expected)
+        assert_allclose(hists[0].merge(hists[1]).hist, 2 * expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
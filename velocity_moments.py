@@ -0,0 +1,178 @@
+###############################################################################
+#  velocity_moments.py: streaming reduction of (evolved) phase-space samples
+#                       into velocity-moment maps and local velocity histograms
+#
+#  Samples are arrays of shape (n, 6) with [R, vR, vT, z, vz, phi] (e.g., the
+#  evolved chunks from disk_sampler.evolve_samples). Each batch is binned on
+#  a fixed (x, y) grid with np.bincount, and its per-bin count, mean and sum
+#  of squared deviations are merged into the running totals with the pairwise
+#  update of Chan, Golub & LeVeque (1979), so the memory use only depends on
+#  the grid and partial results from different processes can be merged.
+###############################################################################
+
+from __future__ import division
+import numpy as np
+
+VELOCITIES = ('vR', 'vT', 'vz')
+_COLUMNS = {'vR': 1, 'vT': 2, 'vz': 4}
+
+
+def _merge_moments(count, mean, M2, bcount, bmean, bM2):
+    """Merge the moments (bcount, bmean, bM2) of a batch into (count, mean, M2) in place."""
+    total = count + bcount
+    frac = np.where(total > 0, bcount / np.where(total > 0, total, 1), 0.)[..., None]
+    delta = bmean - mean
+    mean += delta * frac
+    M2 += bM2 + delta**2 * (count[..., None] * frac)
+    count += bcount
+
+
+class MomentMap(object):
+    """Count, mean velocity and velocity dispersion of samples on a grid in (x, y)."""
+
+    def __init__(self, xedges, yedges):
+        """
+        NAME:
+            __init__
+        PURPOSE:
+            initialize an empty map
+        INPUT:
+            :xedges, yedges: bin edges in x = R cos(phi) and y = R sin(phi)
+        OUTPUT:
+            (none)
+        """
+        self.xedges = np.asarray(xedges, dtype=float)
+        self.yedges = np.asarray(yedges, dtype=float)
+        shape = (len(self.xedges) - 1, len(self.yedges) - 1)
+        self.count = np.zeros(shape)
+        self._mean = np.zeros(shape + (len(VELOCITIES),))
+        self._M2 = np.zeros(shape + (len(VELOCITIES),))
+
+    def update(self, samples):
+        """
+        NAME:
+            update
+        PURPOSE:
+            add a batch of samples to the map
+        INPUT:
+            :samples: array of shape (n, 6) with [R, vR, vT, z, vz, phi]; samples outside the grid are ignored
+        OUTPUT:
+            :return: self
+        """
+        samples = np.atleast_2d(samples)
+        x = samples[:, 0] * np.cos(samples[:, 5])
+        y = samples[:, 0] * np.sin(samples[:, 5])
+        nx, ny = self.count.shape
+        ix = np.searchsorted(self.xedges, x, side='right') - 1
+        iy = np.searchsorted(self.yedges, y, side='right') - 1
+        inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+        idx = ix[inside] * ny + iy[inside]
+        v = samples[inside][:, [_COLUMNS[name] for name in VELOCITIES]]
+
+        bcount = np.bincount(idx, minlength=nx * ny).astype(float)
+        bmean = np.empty((nx * ny, len(VELOCITIES)))
+        bM2 = np.empty((nx * ny, len(VELOCITIES)))
+        norm = np.where(bcount > 0, bcount, 1)
+        for ii in range(len(VELOCITIES)):
+            bmean[:, ii] = np.bincount(idx, weights=v[:, ii], minlength=nx * ny) / norm
+            bM2[:, ii] = np.bincount(idx, weights=(v[:, ii] - bmean[idx, ii])**2, minlength=nx * ny)
+        _merge_moments(self.count, self._mean, self._M2, bcount.reshape(nx, ny),
+                       bmean.reshape(nx, ny, -1), bM2.reshape(nx, ny, -1))
+        return self
+
+    def merge(self, other):
+        """Merge another MomentMap on the same grid (e.g., from another process) into this one; return self."""
+        if not (np.array_equal(self.xedges, other.xedges) and np.array_equal(self.yedges, other.yedges)):
+            raise ValueError('MomentMaps can only be merged if they have the same grid')
+        _merge_moments(self.count, self._mean, self._M2, other.count, other._mean, other._M2)
+        return self
+
+    def mean(self, velocity='vR'):
+        """Return the mean of velocity ('vR', 'vT' or 'vz') in every bin (NaN in empty bins)."""
+        ii = VELOCITIES.index(velocity)
+        return np.where(self.count > 0, self._mean[..., ii], np.nan)
+
+    def variance(self, velocity='vR'):
+        """Return the variance of velocity ('vR', 'vT' or 'vz') in every bin (NaN in empty bins)."""
+        ii = VELOCITIES.index(velocity)
+        return np.where(self.count > 0, self._M2[..., ii] / np.where(self.count > 0, self.count, 1), np.nan)
+
+    def dispersion(self, velocity='vR'):
+        """Return the dispersion of velocity ('vR', 'vT' or 'vz') in every bin (NaN in empty bins)."""
+        return np.sqrt(self.variance(velocity))
+
+    def save(self, filename):
+        """Save the map to a .npz file."""
+        np.savez(filename, xedges=self.xedges, yedges=self.yedges, count=self.count, mean=self._mean, M2=self._M2)
+
+    @classmethod
+    def load(cls, filename):
+        """Load a map saved with save."""
+        with np.load(filename) as data:
+            out = cls(data['xedges'], data['yedges'])
+            out.count[...] = data['count']
+            out._mean[...] = data['mean']
+            out._M2[...] = data['M2']
+        return out
+
+
+class VelocityHistogram(object):
+    """Histogram in (vR, vT) of the samples within a radius of a position in the disk."""
+
+    def __init__(self, x, y, radius, vRedges, vTedges):
+        """
+        NAME:
+            __init__
+        PURPOSE:
+            initialize an empty histogram
+        INPUT:
+            :x, y: position of the centre of the volume (e.g., the solar neighbourhood: x=1, y=0)
+            :radius: radius of the volume in the plane
+            :vRedges, vTedges: bin edges in vR and vT
+        OUTPUT:
+            (none)
+        """
+        self.x = x
+        self.y = y
+        self.radius = radius
+        self.vRedges = np.asarray(vRedges, dtype=float)
+        self.vTedges = np.asarray(vTedges, dtype=float)
+        self.hist = np.zeros((len(self.vRedges) - 1, len(self.vTedges) - 1))
+
+    def update(self, samples):
+        """Add a batch of samples (array of shape (n, 6) with [R, vR, vT, z, vz, phi]); return self."""
+        samples = np.atleast_2d(samples)
+        x = samples[:, 0] * np.cos(samples[:, 5])
+        y = samples[:, 0] * np.sin(samples[:, 5])
+        near = (x - self.x)**2 + (y - self.y)**2 < self.radius**2
+        self.hist += np.histogram2d(samples[near, 1], samples[near, 2], bins=[self.vRedges, self.vTedges])[0]
+        return self
+
+    def merge(self, other):
+        """Merge another VelocityHistogram with the same volume and bins into this one; return self."""
+        if not ((self.x, self.y, self.radius) == (other.x, other.y, other.radius)
+                and np.array_equal(self.vRedges, other.vRedges) and np.array_equal(self.vTedges, other.vTedges)):
+            raise ValueError('VelocityHistograms can only be merged if they have the same volume and bins')
+        self.hist += other.hist
+        return self
+
+
+def reduce_samples(batches, reducers):
+    """
+    NAME:
+        reduce_samples
+    PURPOSE:
+        feed batches of samples to MomentMaps and VelocityHistograms as they arrive
+    INPUT:
+        :batches: iterable of arrays of shape (n, 6), or of (initial conditions, evolved) pairs as yielded by
+                  disk_sampler.evolve_samples and load_samples (the evolved samples are reduced)
+        :reducers: MomentMap or VelocityHistogram, or list thereof
+    OUTPUT:
+        :return: reducers
+    """
+    for batch in batches:
+        if isinstance(batch, tuple):
+            batch = batch[-1]
+        for reducer in (reducers if isinstance(reducers, (list, tuple)) else [reducers]):
+            reducer.update(batch)
+    return reducers